@@ -0,0 +1,101 @@
+"""
+Server-side aggregation helpers
+Buckets activity into the UTC time buckets the dashboard heatmap bins into its
+local day-of-week x hour grid
+"""
+import logging
+from datetime import datetime, timedelta
+from typing import Iterable, Optional
+from sqlalchemy import Integer, cast, func
+from sqlalchemy.orm import Session
+from database import ActivityLog, DataAdjustment, HourlyActivity, event_encoding
+from partitions import archived_bucket_counts
+from rollup import hour_bucket
+
+# Hourly buckets come from the rollup; quarter hours line up with every local
+# hour, including zones offset from UTC by 30 or 45 minutes
+BUCKET_MINUTES = (60, 15)
+
+logger = logging.getLogger(__name__)
+
+def _floor(timestamp: datetime, minutes: int) -> datetime:
+    """Start of the UTC bucket containing timestamp"""
+    return hour_bucket(timestamp) + timedelta(minutes=timestamp.minute - timestamp.minute % minutes)
+
+def _bucket_range(start: datetime, end: datetime, minutes: int):
+    """[start, end) widened to whole buckets"""
+    range_start, range_end = _floor(start, minutes), _floor(end, minutes)
+    if range_end < end:
+        range_end += timedelta(minutes=minutes)
+    return range_start, range_end
+
+def _bucket_sql(column, minutes: int):
+    """SQLite expression for the start of the bucket containing a stored activity_logs timestamp"""
+    seconds = minutes * 60
+    if event_encoding() == "compact":
+        epoch = column
+    else:
+        epoch = cast(func.strftime("%s", column), Integer)
+    return func.datetime(epoch - epoch % seconds, "unixepoch")
+
+def heatmap_buckets(
+    db: Session,
+    start: datetime,
+    end: datetime,
+    sensor_ids: Optional[Iterable[int]] = None,
+    bucket_minutes: int = 60,
+):
+    """
+    Count 'active' events per (sensor, UTC bucket) for every bucket overlapping [start, end).
+
+    Buckets are left in UTC so the client can place each one in its own local
+    day and hour, which stays correct across daylight saving changes. Hourly
+    buckets are read from the hourly_activity rollup; quarter-hour buckets, for
+    zones whose offset isn't a whole hour, are grouped from the raw
+    activity_logs rows in SQLite, plus the archive partitions of any months
+    retention has moved out of the hot table. DataAdjustment offsets are folded
+    into the bucket holding their timestamp and flagged; counts are not clamped
+    here, since an adjustment applies to the whole local hour the client sums up.
+    """
+    range_start, range_end = _bucket_range(start, end, bucket_minutes)
+    if bucket_minutes == 60:
+        sensor_col, bucket = HourlyActivity.sensor_id, HourlyActivity.hour_bucket
+        query = db.query(sensor_col, bucket, HourlyActivity.active_count).filter(
+            bucket >= range_start, bucket < range_end, HourlyActivity.active_count > 0
+        )
+    else:
+        sensor_col, bucket = ActivityLog.sensor_id, _bucket_sql(ActivityLog.timestamp, bucket_minutes)
+        query = db.query(sensor_col, bucket.label("bucket"), func.count()).filter(
+            ActivityLog.value == "active", ActivityLog.timestamp >= range_start, ActivityLog.timestamp < range_end
+        ).group_by(sensor_col, "bucket")
+
+    adjustments = db.query(DataAdjustment).filter(
+        DataAdjustment.timestamp >= range_start,
+        DataAdjustment.timestamp < range_end,
+    )
+
+    if sensor_ids is not None:
+        sensor_ids = list(sensor_ids)
+        query = query.filter(sensor_col.in_(sensor_ids))
+        adjustments = adjustments.filter(DataAdjustment.sensor_id.in_(sensor_ids))
+
+    buckets = {}
+    for sensor_id, slot, count in query.all():
+        if isinstance(slot, str):
+            slot = datetime.fromisoformat(slot)
+        buckets[(sensor_id, slot)] = {"count": count, "adjusted": False}
+
+    if bucket_minutes != 60:
+        # Raw events of archived months only survive in their partitions
+        for sensor_id, slot, count in archived_bucket_counts(range_start, range_end, sensor_ids, bucket_minutes):
+            buckets.setdefault((sensor_id, slot), {"count": 0, "adjusted": False})["count"] += count
+
+    for adj in adjustments.all():
+        entry = buckets.setdefault((adj.sensor_id, _floor(adj.timestamp, bucket_minutes)), {"count": 0, "adjusted": False})
+        entry["count"] += adj.value
+        entry["adjusted"] = True
+
+    return [
+        {"sensor_id": sensor_id, "bucket": slot, "count": entry["count"], "adjusted": entry["adjusted"]}
+        for (sensor_id, slot), entry in sorted(buckets.items(), key=lambda item: (item[0][0] or 0, item[0][1]))
+    ]
@@ -1,78 +1,365 @@
+import numpy as np
 import pandas as pd
+from sqlalchemy import Integer, and_, bindparam, cast, delete, func, select
+from sqlalchemy.dialects.sqlite import insert
 from sqlalchemy.orm import Session
-from database import SessionLocal, ActivityLog, Anomaly, Sensor
+from database import (
+    SessionLocal, HourlyActivity, Anomaly, SensorBaseline,
+    RollupChange, AnalyzerState, AnalyzedBucket,
+)
 from sklearn.ensemble import IsolationForest
+import argparse
 import logging
+import math
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
+from typing import Optional
+from rollup import hour_bucket
+from broadcaster import broadcaster
+from response_cache import table_versions
+
+# Incremental analysis: a bucket is anomalous when its count is this many standard
+# deviations from the baseline for the same sensor, weekday and hour
+ANOMALY_Z_THRESHOLD = float(os.getenv("ANOMALY_Z_THRESHOLD", "3.0"))
+# Weeks of history a baseline needs before it is used for scoring
+BASELINE_MIN_SAMPLES = int(os.getenv("BASELINE_MIN_SAMPLES", "4"))
+
+# Full analysis trains one model per sensor in a process pool of this many workers
+ANALYZER_WORKERS = int(os.getenv("ANALYZER_WORKERS", str(max(1, (os.cpu_count() or 2) - 1))))
+# Each spawned worker spends seconds importing pandas/sklearn while a sensor's model
+# (at most 168 rows) fits in a fraction of one, so fewer sensors are trained in-process
+ANALYZER_POOL_MIN_SENSORS = int(os.getenv("ANALYZER_POOL_MIN_SENSORS", "24"))
+# Sensors with fewer (day_of_week, hour) buckets than this are skipped
+MIN_BUCKETS_PER_SENSOR = 10
+
+HOURLY_COUNT_DTYPES = {"sensor_id": "int64", "day_of_week": "int8", "hour": "int8", "event_count": "int64"}
 
 logger = logging.getLogger(__name__)
 
-def analyze_data():
+def load_hourly_counts(db: Session) -> pd.DataFrame:
+    """
+    Event counts per (sensor_id, day_of_week, hour) across all history.
+
+    The GROUP BY runs in SQLite against the hourly rollup and only the needed
+    columns are read, straight into typed columns, so memory is bounded by the
+    number of buckets rather than the number of events. day_of_week is 0=Monday
+    to match pandas' dayofweek.
+    """
+    day_of_week = (cast(func.strftime("%w", HourlyActivity.hour_bucket), Integer) + 6) % 7
+    hour = cast(func.strftime("%H", HourlyActivity.hour_bucket), Integer)
+    stmt = select(
+        HourlyActivity.sensor_id,
+        day_of_week.label("day_of_week"),
+        hour.label("hour"),
+        func.sum(HourlyActivity.event_count).label("event_count"),
+    ).group_by(HourlyActivity.sensor_id, "day_of_week", "hour")
+
+    return pd.read_sql(stmt, db.connection(), dtype=HOURLY_COUNT_DTYPES)
+
+def load_changed_buckets(db: Session, before: datetime):
+    """
+    Queued rollup changes for hours before `before`, as
+    (sensor_id, hour_bucket, version, event_count, analyzed_count) with 0 for
+    a missing rollup or analyzed row
+    """
+    stmt = select(
+        RollupChange.sensor_id,
+        RollupChange.hour_bucket,
+        RollupChange.version,
+        func.coalesce(HourlyActivity.event_count, 0),
+        func.coalesce(AnalyzedBucket.event_count, 0),
+    ).outerjoin(HourlyActivity, and_(
+        HourlyActivity.sensor_id == RollupChange.sensor_id, HourlyActivity.hour_bucket == RollupChange.hour_bucket
+    )).outerjoin(AnalyzedBucket, and_(
+        AnalyzedBucket.sensor_id == RollupChange.sensor_id, AnalyzedBucket.hour_bucket == RollupChange.hour_bucket
+    )).where(RollupChange.hour_bucket < before)
+    return db.execute(stmt).all()
+
+def load_sensor_counts(db: Session, sensor_id: int, start: datetime, end: datetime):
+    """{hour_bucket: event_count} of one sensor's rollup rows in [start, end)"""
+    return dict(db.execute(
+        select(HourlyActivity.hour_bucket, HourlyActivity.event_count).where(
+            HourlyActivity.sensor_id == sensor_id,
+            HourlyActivity.hour_bucket >= start,
+            HourlyActivity.hour_bucket < end,
+        )
+    ).all())
+
+def _fold(baseline: SensorBaseline, count: int):
+    """Welford update"""
+    baseline.samples += 1
+    delta = count - baseline.mean
+    baseline.mean += delta / baseline.samples
+    baseline.m2 += delta * (count - baseline.mean)
+
+def _unfold(baseline: SensorBaseline, count: int):
+    """Reverse a Welford update, for a bucket whose count changed after it was folded in"""
+    if baseline.samples <= 1:
+        baseline.samples, baseline.mean, baseline.m2 = 0, 0.0, 0.0
+        return
+    mean = (baseline.samples * baseline.mean - count) / (baseline.samples - 1)
+    baseline.m2 = max(baseline.m2 - (count - baseline.mean) * (count - mean), 0.0)
+    baseline.mean = mean
+    baseline.samples -= 1
+
+def _z_score(baseline: SensorBaseline, count: int) -> Optional[float]:
+    """Standard deviations of count from the baseline, or None until it has enough samples"""
+    if baseline.samples < BASELINE_MIN_SAMPLES:
+        return None
+    std = math.sqrt(baseline.m2 / (baseline.samples - 1)) if baseline.samples > 1 else 0.0
+    return (count - baseline.mean) / max(std, 1.0)
+
+def _hours(start: datetime, end: datetime):
+    while start < end:
+        yield start
+        start += timedelta(hours=1)
+
+def _score_sensor(sensor_id: int, features: np.ndarray):
+    """
+    Fit an IsolationForest to one sensor's (day_of_week, hour, event_count) rows
+    and return (sensor_id, day_of_week, hour, event_count, score) for the outliers.
+    Runs in a worker process, so it only takes and returns plain arrays/tuples.
+    """
+    clf = IsolationForest(contamination=0.05, random_state=42)
+    labels = clf.fit_predict(features)
+    scores = clf.decision_function(features)
+
+    # -1 indicates anomaly
+    return [
+        (sensor_id, int(day), int(hour), int(count), round(float(score), 4))
+        for (day, hour, count), label, score in zip(features, labels, scores)
+        if label == -1
+    ]
+
+def analyze_data(max_workers: Optional[int] = None):
+    """
+    Retrain per-sensor IsolationForest models over all history.
+
+    Each sensor gets its own model so sensors with very different activity
+    levels don't distort each other's feature space. With at least
+    ANALYZER_POOL_MIN_SENSORS sensors, models are trained in a process pool of
+    max_workers processes (default ANALYZER_WORKERS); otherwise, or when
+    max_workers is 1, they are trained in-process.
+    """
     db = SessionLocal()
     try:
-        # Fetch all logs
-        # In a real app, we might want to limit this to recent history or process in batches
-        logs = db.query(ActivityLog).all()
-        if not logs:
+        # Grouping happens in SQLite; pandas only sees one typed row per bucket
+        hourly_counts = load_hourly_counts(db)
+        if hourly_counts.empty:
             logger.info("No logs to analyze")
             return
 
-        # Convert to DataFrame
-        data = [{"timestamp": l.timestamp, "sensor_id": l.sensor_id, "value": l.value} for l in logs]
-        df = pd.DataFrame(data)
-        df['timestamp'] = pd.to_datetime(df['timestamp'])
-        
-        # Feature Engineering
-        # We want to detect unusual activity patterns.
-        # Let's aggregate by hour and sensor.
-        df['hour'] = df['timestamp'].dt.hour
-        df['day_of_week'] = df['timestamp'].dt.dayofweek
-        
-        # Count events per hour per sensor
-        hourly_counts = df.groupby(['sensor_id', 'day_of_week', 'hour']).size().reset_index(name='event_count')
-        
-        if len(hourly_counts) < 10:
+        # Prepare features for Isolation Forest, one block per sensor
+        features = ['day_of_week', 'hour', 'event_count']
+        jobs = [
+            (int(sensor_id), group[features].to_numpy(dtype=np.int64))
+            for sensor_id, group in hourly_counts.groupby('sensor_id')
+            if len(group) >= MIN_BUCKETS_PER_SENSOR
+        ]
+        if not jobs:
             logger.info("Not enough data for analysis")
             return
 
-        # Prepare features for Isolation Forest
-        features = ['day_of_week', 'hour', 'event_count']
-        X = hourly_counts[features]
+        workers = min(max_workers or ANALYZER_WORKERS, len(jobs))
+        if len(jobs) < ANALYZER_POOL_MIN_SENSORS:
+            workers = 1
+        if workers <= 1:
+            results = [_score_sensor(sensor_id, X) for sensor_id, X in jobs]
+        else:
+            # spawn rather than fork: the API process has live threads and DB connections
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+                results = list(pool.map(_score_sensor, *zip(*jobs)))
 
-        # Train Isolation Forest
-        clf = IsolationForest(contamination=0.05, random_state=42)
-        hourly_counts['anomaly'] = clf.fit_predict(X)
-        
-        # -1 indicates anomaly
-        anomalies = hourly_counts[hourly_counts['anomaly'] == -1]
-        
-        for _, row in anomalies.iterrows():
-            sensor_id = row['sensor_id']
-            hour = row['hour']
-            day = row['day_of_week']
-            count = row['event_count']
-            
-            description = f"Unusual activity count ({count}) on day {day} at hour {hour}:00"
-            
-            # Check if already reported recently to avoid duplicates?
-            # For simplicity, we just log it.
-            
-            # We need a timestamp for the anomaly. We'll use the current time or the time of the bucket.
-            # Let's use the most recent timestamp from that bucket if possible, or just now.
-            # For this simple logic, let's just log it as "detected now" but referring to that pattern.
-            
-            anomaly = Anomaly(
+        anomalies = [row for sensor_rows in results for row in sensor_rows]
+        detected_at = datetime.utcnow()
+        for sensor_id, day, hour, count, score in anomalies:
+            db.add(Anomaly(
                 sensor_id=sensor_id,
-                timestamp=datetime.utcnow(),
-                description=description,
-                score=-1.0 # Isolation forest returns -1 for anomalies
-            )
-            db.add(anomaly)
+                timestamp=detected_at,
+                description=f"Unusual activity count ({count}) on day {day} at hour {hour}:00",
+                score=score # IsolationForest decision function; negative is anomalous
+            ))
         
         db.commit()
-        logger.info(f"Analysis complete. Found {len(anomalies)} anomalies.")
+        table_versions.bump("anomalies")
+        broadcaster.publish("changed")
+        logger.info(f"Analysis complete. Trained {len(jobs)} sensor models on {workers} worker(s), found {len(anomalies)} anomalies.")
 
     except Exception as e:
         logger.error(f"Error during analysis: {e}")
     finally:
         db.close()
+
+def analyze_incremental(reset: bool = False):
+    """
+    Score the hourly buckets the analyzer hasn't seen, and re-score changed ones.
+
+    Each (sensor, day_of_week, hour) keeps running mean/variance statistics in
+    sensor_baselines. Every complete hour from a sensor's first activity is
+    scored against the baseline as it stood before that hour and then folded
+    in. Hours without a rollup row count as 0, so missing activity is scored
+    too. Hours whose count changed after they were folded in, e.g. through a
+    backfill, import, late event or purge, are queued in rollup_changes. Their
+    old count is taken back out and they are scored again. A run costs time
+    proportional to the new and changed hours. reset=True discards the
+    baselines and replays all history.
+    """
+    db = SessionLocal()
+    try:
+        if reset:
+            for model in (SensorBaseline, AnalyzerState, AnalyzedBucket):
+                db.query(model).delete(synchronize_session=False)
+
+        # Only complete hours, so a bucket is never scored while it is still filling
+        window_end = hour_bucket(datetime.utcnow())
+        states = {state.sensor_id: state for state in db.query(AnalyzerState)}
+        changes = load_changed_buckets(db, window_end)
+
+        # Where each sensor's analyzed hours must start: its first activity for
+        # the first run, or earlier if older history has appeared since
+        first_bucket = {sensor_id: state.first_bucket for sensor_id, state in states.items()}
+        if not states:
+            first_bucket.update(db.execute(
+                select(HourlyActivity.sensor_id, func.min(HourlyActivity.hour_bucket))
+                .where(HourlyActivity.hour_bucket < window_end)
+                .group_by(HourlyActivity.sensor_id)
+            ).all())
+        rescore = []
+        for sensor_id, bucket, _, count, analyzed in changes:
+            state = states.get(sensor_id)
+            if state and state.first_bucket <= bucket < state.next_bucket:
+                if count != analyzed:
+                    rescore.append((sensor_id, bucket, analyzed, count))
+            elif count and (sensor_id not in first_bucket or bucket < first_bucket[sensor_id]):
+                first_bucket[sensor_id] = bucket
+        if not first_bucket:
+            logger.info("No new hourly buckets to analyze")
+            return
+
+        # Hours never folded in: before the old start, and from the old end up to now
+        ranges = []
+        for sensor_id, start in first_bucket.items():
+            state = states.get(sensor_id)
+            if state is None:
+                ranges.append((sensor_id, start, window_end))
+                continue
+            if start < state.first_bucket:
+                ranges.append((sensor_id, start, state.first_bucket))
+            ranges.append((sensor_id, state.next_bucket, window_end))
+        ranges = [(sensor_id, start, end) for sensor_id, start, end in ranges if start < end]
+
+        baselines = {
+            (b.sensor_id, b.day_of_week, b.hour): b
+            for b in db.query(SensorBaseline).filter(SensorBaseline.sensor_id.in_(list(first_bucket)))
+        }
+        # Anomalies already reported for these hours, keyed by the bucket they describe
+        oldest = min([start for _, start, _ in ranges] + [bucket for _, bucket, _, _ in rescore], default=window_end)
+        reported = set(
+            db.query(Anomaly.sensor_id, Anomaly.timestamp).filter(
+                Anomaly.sensor_id.in_(list(first_bucket)),
+                Anomaly.timestamp >= oldest,
+                Anomaly.timestamp < window_end
+            )
+        )
+        analyzed_counts = {}
+        found = 0
+
+        def score(sensor_id: int, bucket: datetime, count: int):
+            nonlocal found
+            key = (sensor_id, bucket.weekday(), bucket.hour)
+            baseline = baselines.get(key)
+            if baseline is None:
+                baseline = SensorBaseline(sensor_id=sensor_id, day_of_week=key[1], hour=key[2], samples=0, mean=0.0, m2=0.0)
+                db.add(baseline)
+                baselines[key] = baseline
+
+            # Score against the baseline before this bucket is folded in
+            z = _z_score(baseline, count)
+            if z is not None and abs(z) >= ANOMALY_Z_THRESHOLD and (sensor_id, bucket) not in reported:
+                db.add(Anomaly(
+                    sensor_id=sensor_id,
+                    timestamp=bucket,
+                    description=f"Unusual activity count ({count}, expected ~{baseline.mean:.1f}) on day {key[1]} at hour {key[2]}:00",
+                    score=round(z, 3)
+                ))
+                reported.add((sensor_id, bucket))
+                found += 1
+            _fold(baseline, count)
+            analyzed_counts[(sensor_id, bucket)] = count
+
+        for sensor_id, bucket, old_count, count in rescore:
+            baseline = baselines.get((sensor_id, bucket.weekday(), bucket.hour))
+            if baseline is not None:
+                _unfold(baseline, old_count)
+            score(sensor_id, bucket, count)
+
+        scored = len(rescore)
+        for sensor_id, start, end in ranges:
+            counts = load_sensor_counts(db, sensor_id, start, end)
+            for bucket in _hours(start, end):
+                score(sensor_id, bucket, counts.get(bucket, 0))
+                scored += 1
+
+        # Remember what was folded in, so later changes can be taken back out. Only
+        # re-scored buckets can have a stored count that has now dropped to zero
+        zero = [{"b_sensor_id": s, "b_hour_bucket": b} for s, b, old_count, count in rescore if old_count and not count]
+        if zero:
+            table = AnalyzedBucket.__table__
+            db.execute(
+                delete(table).where(table.c.sensor_id == bindparam("b_sensor_id"), table.c.hour_bucket == bindparam("b_hour_bucket")),
+                zero
+            )
+        nonzero = [{"sensor_id": s, "hour_bucket": b, "event_count": count} for (s, b), count in analyzed_counts.items() if count]
+        if nonzero:
+            # Core insert: the ORM's bulk path costs more than the upsert itself here
+            table = AnalyzedBucket.__table__
+            stmt = insert(table)
+            db.execute(stmt.on_conflict_do_update(
+                index_elements=[table.c.sensor_id, table.c.hour_bucket],
+                set_={"event_count": stmt.excluded.event_count}
+            ), nonzero)
+
+        for sensor_id, start in first_bucket.items():
+            state = states.get(sensor_id)
+            if state is None:
+                db.add(AnalyzerState(sensor_id=sensor_id, first_bucket=start, next_bucket=window_end))
+            else:
+                state.first_bucket = min(state.first_bucket, start)
+                state.next_bucket = max(state.next_bucket, window_end)
+
+        # A change queued again while this run was scoring has a new version and stays queued
+        if changes:
+            table = RollupChange.__table__
+            db.execute(
+                delete(table).where(
+                    table.c.sensor_id == bindparam("b_sensor_id"),
+                    table.c.hour_bucket == bindparam("b_hour_bucket"),
+                    table.c.version == bindparam("b_version"),
+                ), [{"b_sensor_id": s, "b_hour_bucket": b, "b_version": v} for s, b, v, _, _ in changes]
+            )
+
+        db.commit()
+        table_versions.bump("anomalies")
+        broadcaster.publish("changed")
+        logger.info(f"Incremental analysis complete. Scored {scored} buckets, found {found} anomalies.")
+
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Error during incremental analysis: {e}")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run anomaly analysis")
+    parser.add_argument("--full", action="store_true", help="Retrain per-sensor IsolationForest models over all history")
+    parser.add_argument("--reset", action="store_true", help="Rebuild incremental baselines from all history")
+    parser.add_argument("--workers", type=int, default=None, help=f"Worker processes for --full (default {ANALYZER_WORKERS})")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.full:
+        analyze_data(max_workers=args.workers)
+    else:
+        analyze_incremental(reset=args.reset)
@@ -0,0 +1,101 @@
+"""
+Live event fan-out
+The ingest writer publishes every committed batch once; each connected
+dashboard gets its own bounded queue. A client that falls BROADCAST_QUEUE_SIZE
+messages behind has its backlog dropped and is sent a single "resync" message
+instead, so one slow browser never holds up ingest or the other clients.
+"""
+import asyncio
+import logging
+import os
+from typing import Optional
+from serialization import dumps
+
+BROADCAST_QUEUE_SIZE = int(os.getenv("BROADCAST_QUEUE_SIZE", "100"))
+SSE_KEEPALIVE_SECONDS = 15
+
+logger = logging.getLogger(__name__)
+
+class Broadcaster:
+    def __init__(self, queue_size: int = BROADCAST_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._subscribers = set()
+        self._loop = None
+
+        # Stats exposed through /status
+        self.messages_published = 0
+        self.clients_lagged = 0
+
+    def start(self):
+        """Bind to the running event loop so worker threads can publish"""
+        self._loop = asyncio.get_running_loop()
+
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.add(queue)
+        logger.info(f"Live client connected ({len(self._subscribers)} connected)")
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._subscribers.discard(queue)
+        logger.info(f"Live client disconnected ({len(self._subscribers)} connected)")
+
+    def publish(self, event: str, data: Optional[object] = None):
+        """Queue (event, data) for every client. Safe to call from any thread; never blocks."""
+        if self._loop is None:
+            return
+        try:
+            on_loop = asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            on_loop = False
+        if on_loop:
+            self._publish(event, data)
+        else:
+            self._loop.call_soon_threadsafe(self._publish, event, data)
+
+    async def sse_stream(self):
+        """Server-Sent Events for one client, until it disconnects or the server stops"""
+        queue = self.subscribe()
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    item = await asyncio.wait_for(queue.get(), SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"  # Stops proxies closing an idle stream
+                    continue
+                if item is None:
+                    break
+                event, data = item
+                yield f"event: {event}\ndata: {dumps(data).decode()}\n\n"
+        finally:
+            self.unsubscribe(queue)
+
+    def close(self):
+        """Tell every client stream to finish (on shutdown)"""
+        for queue in list(self._subscribers):
+            self._replace_backlog(queue, None)
+
+    def stats(self):
+        return {
+            "clients": len(self._subscribers),
+            "messages_published": self.messages_published,
+            "clients_lagged": self.clients_lagged,
+        }
+
+    def _publish(self, event: str, data):
+        self.messages_published += 1
+        for queue in list(self._subscribers):
+            try:
+                queue.put_nowait((event, data))
+            except asyncio.QueueFull:
+                # The client will refetch through /sync, so its stale backlog is worthless
+                self.clients_lagged += 1
+                self._replace_backlog(queue, ("resync", None))
+
+    def _replace_backlog(self, queue: asyncio.Queue, item):
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(item)
+
+broadcaster = Broadcaster()
@@ -0,0 +1,104 @@
+"""
+Convert activity_logs between the text and compact event encodings
+(see EVENT_ENCODING in database.py). Stop the backend before running it; the
+new layout is picked up automatically on the next start.
+
+    python compact_events.py            # text -> compact
+    python compact_events.py --to text  # compact -> text
+"""
+import argparse
+import logging
+import os
+import sqlite3
+from sqlalchemy.schema import CreateIndex
+from database import engine, init_db, event_encoding, ActivityLog, STATE_CODES
+
+logger = logging.getLogger(__name__)
+
+# timestamp_sql and value_sql convert from the other encoding; format them with the column to read
+LAYOUTS = {
+    "compact": {
+        "timestamp_type": "INTEGER",
+        "value_type": "SMALLINT",
+        "timestamp_sql": "CAST(strftime('%s', {column}) AS INTEGER)",
+        "value_sql": "CASE {column} " + " ".join(f"WHEN '{name}' THEN {code}" for name, code in STATE_CODES.items()) + " END",
+    },
+    "text": {
+        "timestamp_type": "DATETIME",
+        "value_type": "VARCHAR",
+        "timestamp_sql": "strftime('%Y-%m-%d %H:%M:%S.000000', {column}, 'unixepoch')",
+        "value_sql": "CASE {column} " + " ".join(f"WHEN {code} THEN '{name}'" for name, code in STATE_CODES.items()) + " END",
+    },
+}
+
+def convert_events(target: str):
+    """Rewrite activity_logs in the target encoding in a single transaction"""
+    if event_encoding() == target:
+        logger.info(f"activity_logs already uses the {target} encoding")
+        return
+
+    path = engine.url.database
+    layout = LAYOUTS[target]
+    index_ddl = [str(CreateIndex(index).compile(engine)) for index in ActivityLog.__table__.indexes]
+
+    engine.dispose()  # Release pooled connections so VACUUM can run
+    conn = sqlite3.connect(path, isolation_level=None)
+    try:
+        # Fold the WAL into the main file so the size comparison is meaningful
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        size_before = os.path.getsize(path)
+
+        if target == "compact":
+            # Any state without a code would silently become NULL
+            unknown = [
+                value for (value,) in conn.execute("SELECT DISTINCT value FROM activity_logs")
+                if value is not None and value not in STATE_CODES
+            ]
+            if unknown:
+                raise ValueError(f"Cannot encode event states {unknown}; known states are {list(STATE_CODES)}")
+
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute(f"""
+            CREATE TABLE activity_logs_converted (
+                id INTEGER NOT NULL PRIMARY KEY,
+                sensor_id INTEGER REFERENCES sensors (id),
+                timestamp {layout['timestamp_type']},
+                value {layout['value_type']},
+                event_key VARCHAR
+            )
+        """)
+        timestamp_sql = layout["timestamp_sql"].format(column="timestamp")
+        value_sql = layout["value_sql"].format(column="value")
+        conn.execute(f"""
+            INSERT INTO activity_logs_converted (id, sensor_id, timestamp, value, event_key)
+            SELECT id, sensor_id, {timestamp_sql}, {value_sql}, event_key
+            FROM activity_logs
+        """)
+        rows = conn.execute("SELECT COUNT(*) FROM activity_logs_converted").fetchone()[0]
+        conn.execute("DROP TABLE activity_logs")
+        conn.execute("ALTER TABLE activity_logs_converted RENAME TO activity_logs")
+        for ddl in index_ddl:
+            conn.execute(ddl)
+        conn.execute("COMMIT")
+
+        # Hand the freed pages back to the filesystem
+        conn.execute("VACUUM")
+    except Exception:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+    size_after = os.path.getsize(path)
+    logger.info(f"Converted {rows} events to the {target} encoding: {size_before / 1e6:.1f}MB -> {size_after / 1e6:.1f}MB")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert activity_logs between event encodings")
+    parser.add_argument("--to", choices=sorted(LAYOUTS), default="compact", help="Target encoding (default: compact)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    # Bring an old database up to date first so the converted table has every column
+    init_db()
+    convert_events(args.to)
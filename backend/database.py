@@ -1,15 +1,188 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, ForeignKey, Boolean, Float
+from sqlalchemy import create_engine, event, func, Column, Index, Integer, SmallInteger, String, DateTime, ForeignKey, Boolean, Float
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
-from datetime import datetime
+from sqlalchemy.types import TypeDecorator
+from datetime import datetime, timezone
+import calendar
+import os
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./matter_logger.db"
+SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./matter_logger.db")
+
+# SQLite pragmas applied to every pooled connection. WAL lets the dashboard's
+# readers run alongside the ingest writer instead of queueing on the file lock.
+STORAGE_PROFILES = {
+    "default": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -20000, # Negative = KiB, so ~20MB of page cache
+        "mmap_size": 268435456, # 256MB
+        "busy_timeout": 5000, # ms
+        "temp_store": "MEMORY",
+    },
+    # Small devices (e.g. a Raspberry Pi Zero) with little RAM to spare
+    "low_memory": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -2000,
+        "mmap_size": 0,
+        "busy_timeout": 5000,
+        "temp_store": "DEFAULT",
+    },
+    # SQLite's own defaults: rollback journal, fsync on every commit
+    "legacy": {
+        "journal_mode": "DELETE",
+        "synchronous": "FULL",
+        "cache_size": -2000,
+        "mmap_size": 0,
+        "busy_timeout": 5000,
+        "temp_store": "DEFAULT",
+    },
+}
+
+STORAGE_PROFILE = os.getenv("STORAGE_PROFILE", "default")
+if STORAGE_PROFILE not in STORAGE_PROFILES:
+    raise ValueError(f"Unknown STORAGE_PROFILE '{STORAGE_PROFILE}', expected one of {', '.join(STORAGE_PROFILES)}")
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
 
 engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+    SQLALCHEMY_DATABASE_URL,
+    connect_args={
+        "check_same_thread": False,
+        "timeout": STORAGE_PROFILES[STORAGE_PROFILE]["busy_timeout"] / 1000,
+    },
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
 )
+
+@event.listens_for(engine, "connect")
+def _apply_storage_profile(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for pragma, value in STORAGE_PROFILES[STORAGE_PROFILE].items():
+        cursor.execute(f"PRAGMA {pragma}={value}")
+    cursor.close()
+
+def get_storage_settings():
+    """Effective SQLite settings as reported by a live pooled connection"""
+    settings = {"profile": STORAGE_PROFILE}
+    with engine.connect() as conn:
+        for pragma in STORAGE_PROFILES[STORAGE_PROFILE]:
+            settings[pragma] = conn.exec_driver_sql(f"PRAGMA {pragma}").scalar()
+    settings["pool"] = engine.pool.status()
+    return settings
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Event encoding for activity_logs. "text" stores DateTime strings and the state
+# as free text; "compact" stores epoch seconds and a small-int state code, which
+# roughly thirds the row size. An existing database keeps whatever layout it was
+# created with (convert it with compact_events.py); EVENT_ENCODING only picks the
+# layout for a brand new database. The layout is read on first use rather than at
+# import, so importing this module never opens (or creates) the database file.
+STATE_CODES = {"inactive": 0, "active": 1}
+STATE_NAMES = {code: name for name, code in STATE_CODES.items()}
+
+class EpochSeconds(TypeDecorator):
+    """Naive UTC datetime stored as integer seconds since the epoch"""
+    impl = Integer
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None or isinstance(value, int):
+            return value
+        return calendar.timegm(value.utctimetuple())
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return datetime.fromtimestamp(value, timezone.utc).replace(tzinfo=None)
+
+class StateCode(TypeDecorator):
+    """Event state ("active"/"inactive") stored as a small integer"""
+    impl = SmallInteger
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None or isinstance(value, int):
+            return value
+        return STATE_CODES[value]
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return STATE_NAMES[value]
+
+def _detect_event_encoding():
+    with engine.connect() as conn:
+        columns = {row[1]: row[2].upper() for row in conn.exec_driver_sql("PRAGMA table_info(activity_logs)")}
+    if "timestamp" in columns:
+        return "compact" if columns["timestamp"] == "INTEGER" else "text"
+    encoding = os.getenv("EVENT_ENCODING", "text")
+    if encoding not in ("text", "compact"):
+        raise ValueError(f"Unknown EVENT_ENCODING '{encoding}', expected 'text' or 'compact'")
+    return encoding
+
+_event_encoding = None
+
+def event_encoding():
+    """The activity_logs layout in use, "text" or "compact", detected on first call"""
+    global _event_encoding
+    if _event_encoding is None:
+        _event_encoding = _detect_event_encoding()
+    return _event_encoding
+
+class EventTime(TypeDecorator):
+    """activity_logs timestamp: DateTime text or EpochSeconds, whichever event_encoding() is in use"""
+    impl = DateTime
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if event_encoding() == "compact":
+            return dialect.type_descriptor(Integer())
+        return dialect.type_descriptor(DateTime())
+
+    def process_bind_param(self, value, dialect):
+        if event_encoding() == "compact":
+            return EpochSeconds().process_bind_param(value, dialect)
+        return value
+
+    def process_result_value(self, value, dialect):
+        if event_encoding() == "compact":
+            return EpochSeconds().process_result_value(value, dialect)
+        return value
+
+class EventState(TypeDecorator):
+    """activity_logs state: free text or StateCode, whichever event_encoding() is in use"""
+    impl = String
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if event_encoding() == "compact":
+            return dialect.type_descriptor(SmallInteger())
+        return dialect.type_descriptor(String())
+
+    def process_bind_param(self, value, dialect):
+        if event_encoding() == "compact":
+            return StateCode().process_bind_param(value, dialect)
+        return value
+
+    def process_result_value(self, value, dialect):
+        if event_encoding() == "compact":
+            return StateCode().process_result_value(value, dialect)
+        return value
+
+def event_time_sql(column):
+    """SQL expression rendering an activity_logs timestamp as SQLite datetime text"""
+    if event_encoding() == "compact":
+        return func.datetime(column, "unixepoch")
+    return column
+
+def event_time_param(value: datetime):
+    """A datetime as stored in activity_logs.timestamp, for raw DB-API statements"""
+    processor = EventTime().dialect_impl(engine.dialect).bind_processor(engine.dialect)
+    return processor(value) if processor else value
+
 Base = declarative_base()
 
 class SystemConfig(Base):
@@ -30,16 +203,27 @@ class Sensor(Base):
     logs = relationship("ActivityLog", back_populates="sensor")
     anomalies = relationship("Anomaly", back_populates="sensor")
 
+    # Ids are never reused, so a new sensor can't inherit a deleted one's history
+    __table_args__ = {"sqlite_autoincrement": True}
+
 class ActivityLog(Base):
     __tablename__ = "activity_logs"
 
     id = Column(Integer, primary_key=True, index=True)
     sensor_id = Column(Integer, ForeignKey("sensors.id"))
-    timestamp = Column(DateTime, default=datetime.utcnow)
-    value = Column(String) # "active", "inactive", etc.
+    timestamp = Column(EventTime, default=datetime.utcnow)
+    value = Column(EventState) # "active", "inactive", etc.
+    event_key = Column(String, nullable=True) # Source event id (e.g. hub trigger-log id), or the ingest-derived capture time; unique per sensor
     
     sensor = relationship("Sensor", back_populates="logs")
 
+    __table_args__ = (
+        Index("ix_activity_logs_sensor_timestamp", "sensor_id", "timestamp"),
+        Index("ix_activity_logs_timestamp", "timestamp"),
+        # NULL keys never collide; only rows stored before live ingest derived keys have them
+        Index("ux_activity_logs_sensor_event_key", "sensor_id", "event_key", unique=True),
+    )
+
 class Anomaly(Base):
     __tablename__ = "anomalies"
 
@@ -51,6 +235,68 @@ class Anomaly(Base):
 
     sensor = relationship("Sensor", back_populates="anomalies")
 
+    __table_args__ = (
+        Index("ix_anomalies_timestamp", "timestamp"),
+        Index("ix_anomalies_sensor_timestamp", "sensor_id", "timestamp"),
+    )
+
+class HourlyActivity(Base):
+    __tablename__ = "hourly_activity"
+
+    # Rollup of activity_logs, maintained on ingest (see rollup.py)
+    sensor_id = Column(Integer, ForeignKey("sensors.id"), primary_key=True)
+    hour_bucket = Column(DateTime, primary_key=True) # Truncated to the hour
+    event_count = Column(Integer, default=0) # All events
+    active_count = Column(Integer, default=0) # "active" events only
+
+    __table_args__ = (
+        Index("ix_hourly_activity_hour_bucket", "hour_bucket"),
+    )
+
+class SensorBaseline(Base):
+    __tablename__ = "sensor_baselines"
+
+    # Running statistics of hourly event counts, updated by the incremental analyzer
+    sensor_id = Column(Integer, ForeignKey("sensors.id"), primary_key=True)
+    day_of_week = Column(Integer, primary_key=True) # 0=Monday
+    hour = Column(Integer, primary_key=True)
+    samples = Column(Integer, default=0)
+    mean = Column(Float, default=0.0)
+    m2 = Column(Float, default=0.0) # Sum of squared deviations (Welford)
+
+class RollupChange(Base):
+    __tablename__ = "rollup_changes"
+
+    # Hourly buckets changed since the incremental analyzer last read them (see rollup.py)
+    sensor_id = Column(Integer, primary_key=True)
+    hour_bucket = Column(DateTime, primary_key=True)
+    version = Column(Integer, default=0) # Bumped on every change, so a bucket changed mid-run stays queued
+
+class AnalyzerState(Base):
+    __tablename__ = "analyzer_state"
+
+    # Hours of a sensor's rollup folded into its baselines: first_bucket up to, not including, next_bucket
+    sensor_id = Column(Integer, ForeignKey("sensors.id"), primary_key=True)
+    first_bucket = Column(DateTime)
+    next_bucket = Column(DateTime)
+
+class AnalyzedBucket(Base):
+    __tablename__ = "analyzed_buckets"
+
+    # Non-zero hourly counts as folded into sensor_baselines; analyzed hours without a row were folded in as 0
+    sensor_id = Column(Integer, ForeignKey("sensors.id"), primary_key=True)
+    hour_bucket = Column(DateTime, primary_key=True)
+    event_count = Column(Integer)
+
+class BackfillState(Base):
+    __tablename__ = "backfill_state"
+
+    # High-water mark of the hub trigger logs already ingested for a sensor
+    sensor_id = Column(Integer, ForeignKey("sensors.id"), primary_key=True)
+    last_log_id = Column(Integer, nullable=True) # Hub trigger-log id
+    last_timestamp = Column(DateTime, nullable=True) # Used when the hub omits log ids
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
 class DataAdjustment(Base):
     __tablename__ = "data_adjustments"
 
@@ -61,11 +307,51 @@ class DataAdjustment(Base):
     comment = Column(String)
     created_at = Column(DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        Index("ix_data_adjustments_sensor_timestamp", "sensor_id", "timestamp"),
+    )
+
+class ChangeLog(Base):
+    __tablename__ = "change_log"
+
+    # Row-level change feed for /sync, written by SQLite triggers (see SYNC_TABLES)
+    id = Column(Integer, primary_key=True) # AUTOINCREMENT, so ids are never reused
+    table_name = Column(String)
+    row_id = Column(Integer)
+    op = Column(String) # "upsert" or "delete"
+    changed_at = Column(DateTime)
+
+    __table_args__ = (
+        Index("ix_change_log_changed_at", "changed_at"),
+        {"sqlite_autoincrement": True},
+    )
+
+# Tables whose inserts, updates and deletes are recorded in change_log. Activity
+# logs are append-only from the dashboard's point of view and sync by id instead.
+SYNC_TABLES = ("sensors", "data_adjustments", "anomalies")
+
+def _change_triggers():
+    for table in SYNC_TABLES:
+        for action, row, op in (("INSERT", "NEW", "upsert"), ("UPDATE", "NEW", "upsert"), ("DELETE", "OLD", "delete")):
+            yield f"""
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_{action.lower()}_change_log
+                AFTER {action} ON {table}
+                BEGIN
+                    INSERT INTO change_log (table_name, row_id, op, changed_at)
+                    VALUES ('{table}', {row}.id, '{op}', datetime('now'));
+                END
+            """
+
 def init_db():
+    from sqlalchemy import inspect, text
+    # Before create_all(), so a new database gets the EVENT_ENCODING layout
+    event_encoding()
+    inspector = inspect(engine)
+    had_rollup = inspector.has_table('hourly_activity')
+
     Base.metadata.create_all(bind=engine)
     
     # Migration: Add is_hidden column if it doesn't exist
-    from sqlalchemy import inspect, text
     inspector = inspect(engine)
     columns = [col['name'] for col in inspector.get_columns('sensors')]
     
@@ -75,3 +361,52 @@ def init_db():
             conn.commit()
         print("Migration: Added is_hidden column to sensors table")
 
+    # Migration: Add event_key column to activity_logs if it doesn't exist
+    columns = [col['name'] for col in inspector.get_columns('activity_logs')]
+    if 'event_key' not in columns:
+        with engine.connect() as conn:
+            conn.execute(text('ALTER TABLE activity_logs ADD COLUMN event_key VARCHAR'))
+            conn.commit()
+        print("Migration: Added event_key column to activity_logs table")
+
+    # Migration: rebuild sensors with AUTOINCREMENT, continuing after every id
+    # that is still referenced (e.g. by the rollup of a deleted sensor)
+    with engine.begin() as conn:
+        sensors_sql = conn.exec_driver_sql("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'sensors'").scalar()
+        if "AUTOINCREMENT" not in sensors_sql.upper():
+            from sqlalchemy.schema import CreateTable
+            names = ", ".join(column.name for column in Sensor.__table__.columns)
+            ddl = str(CreateTable(Sensor.__table__).compile(engine)).replace("CREATE TABLE sensors", "CREATE TABLE sensors_migrated", 1)
+            conn.exec_driver_sql(ddl)
+            conn.exec_driver_sql(f"INSERT INTO sensors_migrated ({names}) SELECT {names} FROM sensors")
+            conn.exec_driver_sql("DROP TABLE sensors")
+            conn.exec_driver_sql("ALTER TABLE sensors_migrated RENAME TO sensors")
+            for index in Sensor.__table__.indexes:
+                index.create(bind=conn)
+            last_id = conn.exec_driver_sql(
+                "SELECT MAX(id) FROM (SELECT MAX(id) AS id FROM sensors UNION ALL SELECT MAX(sensor_id) FROM activity_logs"
+                " UNION ALL SELECT MAX(sensor_id) FROM hourly_activity)"
+            ).scalar() or 0
+            conn.exec_driver_sql("DELETE FROM sqlite_sequence WHERE name = 'sensors'")
+            conn.exec_driver_sql("INSERT INTO sqlite_sequence (name, seq) VALUES ('sensors', ?)", (last_id,))
+            print("Migration: Rebuilt sensors table so ids are never reused")
+
+    # Migration: create_all() skips indexes on tables that already exist
+    for table in (ActivityLog.__table__, Anomaly.__table__, HourlyActivity.__table__, DataAdjustment.__table__):
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(bind=engine)
+                print(f"Migration: Created index {index.name}")
+
+    # Triggers feeding change_log for /sync; IF NOT EXISTS makes this a no-op after the first run
+    with engine.begin() as conn:
+        for ddl in _change_triggers():
+            conn.execute(text(ddl))
+
+    # Migration: Populate the hourly rollup from existing raw logs
+    if not had_rollup:
+        from rollup import rebuild_hourly_activity
+        buckets = rebuild_hourly_activity()
+        if buckets:
+            print(f"Migration: Built hourly_activity rollup ({buckets} buckets)")
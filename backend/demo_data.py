@@ -0,0 +1,170 @@
+"""
+Synthetic activity generator
+Builds demo history in bulk with NumPy: Poisson event counts per
+hour from a weekly profile, uniformly spread seconds within each hour, and
+occasional 3 AM bursts as anomalies. Events go in with one executemany per
+week of history, already in the table's storage encoding, and the hourly
+rollup is written from the same counts instead of from the events:
+
+    python demo_data.py --sensors 100 --days 730
+    python demo_data.py --profile office --scale 2 --anomaly-rate 0.02
+"""
+import argparse
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+import numpy as np
+from database import SessionLocal, Sensor, event_encoding, STATE_CODES
+from rollup import record_hourly_counts
+
+# Named sensors used by the dashboard demo; further sensors are numbered
+DEMO_SENSORS = [
+    ("demo-living-room", "Living Room Motion (Demo)"),
+    ("demo-kitchen", "Kitchen Motion (Demo)"),
+    ("demo-bedroom", "Bedroom Motion (Demo)"),
+]
+
+ANOMALY_HOUR = 3
+ANOMALY_EVENTS = (15, 25)
+
+# Hours of history generated and committed at a time
+CHUNK_HOURS = 7 * 24
+
+logger = logging.getLogger(__name__)
+
+def _weekly_profile(weekday_hours, weekend_hours, default: float) -> np.ndarray:
+    """7x24 array of mean events per hour (0=Monday), from {hours: rate} maps"""
+    profile = np.full((7, 24), default)
+    for days, hours in ((slice(0, 5), weekday_hours), (slice(5, 7), weekend_hours)):
+        for hour_range, rate in hours.items():
+            profile[days, list(hour_range)] = rate
+    return profile
+
+PROFILES = {
+    # Matches the original demo: busy mornings and evenings on weekdays, home all day at weekends
+    "home": _weekly_profile(
+        {range(6, 9): 13.0, range(9, 17): 5.0, range(17, 23): 16.0, (23, 0): 1.25, range(1, 6): 0.06},
+        {range(8, 12): 10.0, range(12, 18): 18.5, range(18, 23): 13.0, (23, 0): 1.25, range(1, 6): 0.12, (6, 7): 0.5},
+        0.0,
+    ),
+    "office": _weekly_profile({range(8, 18): 12.0, (7, 18): 3.0}, {}, 0.2),
+    "flat": np.full((7, 24), 5.0),
+}
+
+def generate_demo_data(
+    sensors: int = 3,
+    days: int = 30,
+    profile: str = "home",
+    scale: float = 1.0,
+    anomaly_rate: float = 0.1,
+    seed: Optional[int] = None,
+):
+    """
+    Add days of synthetic history ending now for `sensors` demo sensors.
+    anomaly_rate is the chance that a sensor has a 3 AM burst on any given day.
+    """
+    rates = PROFILES[profile] * scale
+    rng = np.random.default_rng(seed)
+    started = time.perf_counter()
+
+    # Complete hours from midnight UTC `days` days back, so hour index % 24 is the hour of day
+    current_hour = datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+    first_hour = current_hour.replace(hour=0) - timedelta(days=days - 1)
+    hours = int((current_hour - first_hour).total_seconds() // 3600)
+    hour_starts = np.datetime64(first_hour, "s") + np.arange(hours) * np.timedelta64(3600, "s")
+    weekday = (hour_starts.astype("datetime64[D]").astype(np.int64) + 3) % 7  # 1970-01-01 was a Thursday
+    hourly_rates = rates[weekday, np.arange(hours) % 24]
+
+    # Each sensor gets its own level of activity around the profile
+    sensor_levels = rng.uniform(0.7, 1.3, (sensors, 1))
+    burst_sensor, burst_day = np.nonzero(rng.random((sensors, days)) < anomaly_rate)
+    burst_hour = burst_day * 24 + ANOMALY_HOUR
+
+    logs_created = 0
+    db = SessionLocal()
+    try:
+        sensor_ids = np.array(_demo_sensors(db, sensors))
+        db.commit()
+
+        # Insert in time order across all sensors, a week at a time, so every
+        # index on activity_logs is appended to rather than split at random
+        for start in range(0, hours, CHUNK_HOURS):
+            end = min(start + CHUNK_HOURS, hours)
+            chunk = rng.poisson(hourly_rates[start:end] * sensor_levels)
+            in_chunk = (burst_hour >= start) & (burst_hour < end)
+            chunk[burst_sensor[in_chunk], burst_hour[in_chunk] - start] += rng.integers(
+                ANOMALY_EVENTS[0], ANOMALY_EVENTS[1] + 1, in_chunk.sum()
+            )
+            sensor_index, hour_index = np.nonzero(chunk)
+            per_hour = chunk[sensor_index, hour_index]
+
+            event_sensors = np.repeat(sensor_ids[sensor_index], per_hour)
+            offsets = rng.integers(0, 3600, per_hour.sum()).astype("timedelta64[s]")
+            timestamps = np.repeat(hour_starts[start + hour_index], per_hour) + offsets
+            order = np.argsort(timestamps, kind="stable")
+            db.connection().exec_driver_sql(
+                "INSERT INTO activity_logs (sensor_id, timestamp, value) VALUES (?, ?, ?)",
+                _encode_events(event_sensors[order], timestamps[order]),
+            )
+
+            record_hourly_counts(db, zip(
+                sensor_ids[sensor_index].tolist(),
+                hour_starts[start + hour_index].astype("datetime64[us]").tolist(),
+                per_hour.tolist(),
+                per_hour.tolist(),
+            ))
+            db.commit()
+            logs_created += int(per_hour.sum())
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+    elapsed = time.perf_counter() - started
+    logger.info(f"Generated {logs_created} events for {sensors} sensors over {days} days in {elapsed:.2f}s")
+    return {"sensors_created": sensors, "logs_created": logs_created, "elapsed_seconds": round(elapsed, 2)}
+
+def _demo_sensors(db, count: int):
+    """Create or refresh the demo sensors. Returns their ids."""
+    definitions = DEMO_SENSORS[:count] + [
+        (f"demo-sensor-{i}", f"Demo Sensor {i}") for i in range(len(DEMO_SENSORS) + 1, count + 1)
+    ]
+    existing = {s.unique_id: s for s in db.query(Sensor).filter(Sensor.unique_id.in_([uid for uid, _ in definitions]))}
+    for unique_id, name in definitions:
+        sensor = existing.get(unique_id)
+        if sensor:
+            sensor.name = name
+            sensor.is_hidden = False
+        else:
+            existing[unique_id] = Sensor(unique_id=unique_id, name=name, type="PIR", is_hidden=False)
+            db.add(existing[unique_id])
+    db.flush()
+    return [existing[unique_id].id for unique_id, _ in definitions]
+
+def _encode_events(sensor_ids: np.ndarray, timestamps: np.ndarray):
+    """Rows for a raw executemany, already in activity_logs' storage encoding"""
+    if event_encoding() == "compact":
+        values = timestamps.astype(np.int64).tolist()
+        state = STATE_CODES["active"]
+    else:
+        # The text layout SQLAlchemy's DateTime uses on SQLite
+        values = np.char.replace(np.datetime_as_string(timestamps, unit="us"), "T", " ").tolist()
+        state = "active"
+    return [(sensor_id, value, state) for sensor_id, value in zip(sensor_ids.tolist(), values)]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic motion data")
+    parser.add_argument("--sensors", type=int, default=3, help="Number of demo sensors (default 3)")
+    parser.add_argument("--days", type=int, default=30, help="Days of history ending today (default 30)")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="home", help="Weekly events-per-hour profile (default home)")
+    parser.add_argument("--scale", type=float, default=1.0, help="Multiply the profile's event rates (default 1.0)")
+    parser.add_argument("--anomaly-rate", type=float, default=0.1, help="Chance of a 3 AM burst per sensor per day (default 0.1)")
+    parser.add_argument("--seed", type=int, help="Random seed for reproducible data")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    from database import init_db
+    init_db()
+    generate_demo_data(args.sensors, args.days, args.profile, args.scale, args.anomaly_rate, args.seed)
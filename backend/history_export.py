@@ -0,0 +1,219 @@
+"""
+Columnar export and import of activity history
+Streams activity_logs, anomalies and data_adjustments for a date range to
+Parquet or Arrow IPC files in fixed-size chunks, so millions of rows move
+without being held in memory. Rows carry the sensor's unique_id, so a file
+can be imported into another database and re-linked to the right sensor.
+
+    python history_export.py export activity_logs events.parquet --start 2026-01-01
+    python history_export.py import activity_logs events.parquet
+
+Requires pyarrow (pip install pyarrow).
+"""
+import argparse
+import logging
+import os
+import time
+from datetime import datetime
+from itertools import islice
+from typing import Optional
+from sqlalchemy import or_, select
+from sqlalchemy.dialects.sqlite import insert
+from database import SessionLocal, ActivityLog, Anomaly, DataAdjustment, Sensor
+from broadcaster import broadcaster
+from response_cache import table_versions
+from rollup import record_activity
+from partitions import list_partitions, next_month, query_archived_events
+from sensor_registry import sensor_registry
+
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "50000"))
+
+FORMATS = ("parquet", "arrow")
+
+# Exported columns per table, besides id, sensor_id and sensor_unique_id
+TABLES = {
+    "activity_logs": (ActivityLog, {"timestamp": "timestamp", "value": "string", "event_key": "string"}),
+    "anomalies": (Anomaly, {"timestamp": "timestamp", "description": "string", "score": "float"}),
+    "data_adjustments": (DataAdjustment, {"timestamp": "timestamp", "value": "int", "comment": "string", "created_at": "timestamp"}),
+}
+
+logger = logging.getLogger(__name__)
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError("Columnar export needs pyarrow; install it with 'pip install pyarrow'")
+    return pyarrow
+
+def table_schema(table: str):
+    pa = _pyarrow()
+    types = {"timestamp": pa.timestamp("us"), "string": pa.string(), "float": pa.float64(), "int": pa.int64()}
+    _, columns = TABLES[table]
+    return pa.schema(
+        [("id", pa.int64()), ("sensor_id", pa.int64()), ("sensor_unique_id", pa.string())]
+        + [(name, types[kind]) for name, kind in columns.items()]
+    )
+
+def export_table(table: str, path: str, start: Optional[datetime] = None, end: Optional[datetime] = None, format: str = "parquet") -> int:
+    """
+    Write rows of table with start <= timestamp < end to path. For activity_logs
+    this includes the months retention has moved into archive partitions, which
+    are written first. Returns rows written.
+    """
+    pa = _pyarrow()
+    model, columns = TABLES[table]
+    schema = table_schema(table)
+
+    stmt = select(model.id, model.sensor_id, Sensor.unique_id, *[getattr(model, name) for name in columns]) \
+        .outerjoin(Sensor, Sensor.id == model.sensor_id)
+    if start is not None:
+        stmt = stmt.where(model.timestamp >= start)
+    if end is not None:
+        stmt = stmt.where(model.timestamp < end)
+
+    writer = pa.parquet.ParquetWriter(path, schema) if format == "parquet" else pa.ipc.new_file(path, schema)
+    db = SessionLocal()
+    written = 0
+    started = time.perf_counter()
+
+    def write(rows):
+        writer.write_batch(pa.RecordBatch.from_arrays(
+            [pa.array(values, type=field.type) for values, field in zip(zip(*rows), schema)],
+            schema=schema
+        ))
+        return len(rows)
+
+    try:
+        partitions = list_partitions() if table == "activity_logs" else []
+        if partitions:
+            unique_ids = dict(db.execute(select(Sensor.id, Sensor.unique_id)).all())
+            archived = query_archived_events(
+                start or datetime.strptime(partitions[0]["month"], "%Y-%m"),
+                end or next_month(datetime.strptime(partitions[-1]["month"], "%Y-%m")),
+                event_keys=True
+            )
+            while chunk := list(islice(archived, EXPORT_CHUNK_ROWS)):
+                written += write([
+                    (e["id"], e["sensor_id"], unique_ids.get(e["sensor_id"]), e["timestamp"], e["value"], e["event_key"])
+                    for e in chunk
+                ])
+
+        # Keyset pagination on id keeps each chunk an index range scan
+        last_id = 0
+        while True:
+            rows = db.execute(stmt.where(model.id > last_id).order_by(model.id).limit(EXPORT_CHUNK_ROWS)).all()
+            if not rows:
+                break
+            written += write(rows)
+            last_id = rows[-1][0]
+    finally:
+        writer.close()
+        db.close()
+
+    logger.info(f"Exported {written} {table} rows to {path} in {time.perf_counter() - started:.2f}s")
+    return written
+
+def import_table(table: str, path: str, format: str = "parquet") -> dict:
+    """
+    Append rows from an exported file, re-linking them to sensors by unique_id.
+    Rows whose sensor and timestamp are already stored, or already appeared
+    earlier in the file, are skipped, so importing the same file twice is
+    harmless.
+    """
+    pa = _pyarrow()
+    if format == "parquet":
+        batches = pa.parquet.ParquetFile(path).iter_batches(batch_size=EXPORT_CHUNK_ROWS)
+    else:
+        reader = pa.ipc.open_file(path)
+        batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+
+    stats = {"table": table, "read": 0, "inserted": 0}
+    started = time.perf_counter()
+    for batch in batches:
+        rows = batch.to_pylist()
+        stats["read"] += len(rows)
+        stats["inserted"] += _import_batch(table, rows)
+
+    stats["elapsed_seconds"] = round(time.perf_counter() - started, 2)
+    logger.info(f"Imported {stats['inserted']} of {stats['read']} {table} rows from {path} in {stats['elapsed_seconds']}s")
+    return stats
+
+def _import_batch(table: str, rows) -> int:
+    model, _ = TABLES[table]
+    for row in rows:
+        unique_id = row.pop("sensor_unique_id")
+        row["sensor_id"] = sensor_registry.resolve(unique_id) if unique_id else None
+        del row["id"]
+
+    db = SessionLocal()
+    try:
+        # One indexed lookup per batch finds rows that are already stored
+        timestamps = [row["timestamp"] for row in rows]
+        sensor_ids = {row["sensor_id"] for row in rows}
+        same_sensor = model.sensor_id.in_(sensor_ids - {None})
+        if None in sensor_ids:
+            same_sensor = or_(same_sensor, model.sensor_id.is_(None))  # IN never matches NULL
+        existing = set(db.execute(
+            select(model.sensor_id, model.timestamp).where(
+                same_sensor,
+                model.timestamp >= min(timestamps),
+                model.timestamp <= max(timestamps)
+            )
+        ).all())
+        # Also drops repeats within the file (e.g. an export taken mid-retention)
+        new_rows = []
+        for row in rows:
+            key = (row["sensor_id"], row["timestamp"])
+            if key not in existing:
+                existing.add(key)
+                new_rows.append(row)
+        rows = new_rows
+        if not rows:
+            return 0
+
+        if table == "activity_logs":
+            # Keyed events are also protected by the unique (sensor_id, event_key) index
+            stmt = (
+                insert(model)
+                .on_conflict_do_nothing(index_elements=[model.sensor_id, model.event_key])
+                .returning(model.sensor_id, model.timestamp, model.value)
+            )
+            inserted = db.execute(stmt, rows).all()
+            record_activity(db, [tuple(row) for row in inserted])
+        else:
+            inserted = db.execute(insert(model).returning(model.id), rows).all()
+        db.commit()
+        table_versions.bump(model.__tablename__)
+        if inserted:
+            broadcaster.publish("changed")
+        return len(inserted)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+def format_for_path(path: str) -> str:
+    return "arrow" if path.endswith((".arrow", ".feather", ".ipc")) else "parquet"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export or import activity history as Parquet/Arrow")
+    parser.add_argument("action", choices=["export", "import"])
+    parser.add_argument("table", choices=sorted(TABLES))
+    parser.add_argument("path", help="File to write or read (.parquet, or .arrow for Arrow IPC)")
+    parser.add_argument("--start", type=datetime.fromisoformat, help="Export rows from this time (ISO 8601)")
+    parser.add_argument("--end", type=datetime.fromisoformat, help="Export rows before this time (ISO 8601)")
+    parser.add_argument("--format", choices=FORMATS, help="Defaults to the file extension")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    from database import init_db
+    init_db()
+    file_format = args.format or format_for_path(args.path)
+    if args.action == "export":
+        export_table(args.table, args.path, args.start, args.end, file_format)
+    else:
+        import_table(args.table, args.path, file_format)
@@ -0,0 +1,173 @@
+"""
+Tapo hub manager
+Runs one TapoClient per configured H100 hub, each with its own polling and
+backfill task. They all feed the shared ingest writer and sensor registry.
+
+The primary hub is the one edited in Settings (tapo_ip / tapo_username /
+tapo_password in system_config, or config.py). Further hubs are stored as a
+JSON list under "tapo_hubs" and can be added or removed at runtime. An extra
+hub without credentials uses the primary hub's Tapo account. The primary hub
+can only be changed from Settings, not removed here.
+"""
+import asyncio
+import json
+import logging
+from typing import Optional
+from database import SessionLocal, SystemConfig
+from tapo_client import TapoClient
+
+HUBS_KEY = "tapo_hubs"
+PRIMARY_KEYS = ("tapo_ip", "tapo_username", "tapo_password")
+# How long a stopping client may take to finish its current request
+STOP_TIMEOUT_SECONDS = 5
+
+logger = logging.getLogger(__name__)
+
+def load_hub_configs():
+    """Configured hubs as [{"ip", "username", "password", "primary"}], primary first"""
+    db = SessionLocal()
+    try:
+        config = {c.key: c.value for c in db.query(SystemConfig)}
+    finally:
+        db.close()
+
+    hubs = []
+    primary = _primary_config(config)
+    if primary:
+        hubs.append(primary)
+    for extra in json.loads(config.get(HUBS_KEY) or "[]"):
+        if any(hub["ip"] == extra["ip"] for hub in hubs):
+            continue
+        hubs.append({
+            "ip": extra["ip"],
+            "username": extra.get("username") or (primary or {}).get("username"),
+            "password": extra.get("password") or (primary or {}).get("password"),
+            "primary": False,
+        })
+    return hubs
+
+def _primary_config(config: dict):
+    if all(key in config for key in PRIMARY_KEYS):
+        return {"ip": config["tapo_ip"], "username": config["tapo_username"], "password": config["tapo_password"], "primary": True}
+    # Fallback to config.py
+    try:
+        from config import TAPO_USERNAME, TAPO_PASSWORD, TAPO_HUB_IP
+        return {"ip": TAPO_HUB_IP, "username": TAPO_USERNAME, "password": TAPO_PASSWORD, "primary": True}
+    except ImportError:
+        return None
+
+def _save_extra_hubs(hubs):
+    db = SessionLocal()
+    try:
+        item = db.query(SystemConfig).filter(SystemConfig.key == HUBS_KEY).first()
+        if item is None:
+            item = SystemConfig(key=HUBS_KEY)
+            db.add(item)
+        item.value = json.dumps(hubs)
+        db.commit()
+    finally:
+        db.close()
+
+def _load_extra_hubs():
+    db = SessionLocal()
+    try:
+        item = db.query(SystemConfig).filter(SystemConfig.key == HUBS_KEY).first()
+        return json.loads(item.value) if item and item.value else []
+    finally:
+        db.close()
+
+class HubManager:
+    def __init__(self):
+        self.clients = {}  # hub ip -> TapoClient
+        self._tasks = {}  # hub ip -> polling task
+        self._lock = None
+
+    async def start(self):
+        """Start a client for every configured hub"""
+        await self.reload()
+
+    async def reload(self):
+        """Bring the running clients in line with the stored configuration"""
+        async with self._get_lock():
+            await self._sync_clients()
+
+    async def add_hub(self, ip: str, username: Optional[str] = None, password: Optional[str] = None):
+        """Store an extra hub and start polling it. Returns False if the hub is already configured."""
+        # The lock covers the whole read-modify-write of the hub list, so concurrent adds can't drop one
+        async with self._get_lock():
+            if any(hub["ip"] == ip for hub in await asyncio.to_thread(load_hub_configs)):
+                return False
+            extras = await asyncio.to_thread(_load_extra_hubs)
+            extras.append({"ip": ip, "username": username, "password": password})
+            await asyncio.to_thread(_save_extra_hubs, extras)
+            await self._sync_clients()
+        return True
+
+    async def remove_hub(self, ip: str):
+        """
+        Stop polling an extra hub and forget it. Returns False if no such hub is
+        configured, and raises ValueError for the primary hub.
+        """
+        async with self._get_lock():
+            hubs = await asyncio.to_thread(load_hub_configs)
+            hub = next((hub for hub in hubs if hub["ip"] == ip), None)
+            if hub is None:
+                return False
+            if hub["primary"]:
+                raise ValueError(f"Hub {ip} is the primary hub; change it in Settings instead")
+            extras = await asyncio.to_thread(_load_extra_hubs)
+            await asyncio.to_thread(_save_extra_hubs, [extra for extra in extras if extra["ip"] != ip])
+            await self._sync_clients()
+        return True
+
+    async def stop(self):
+        async with self._get_lock():
+            for ip in list(self.clients):
+                await self._stop_client(ip)
+
+    def get(self, ip: Optional[str] = None) -> Optional[TapoClient]:
+        """The client for a hub, or with no ip the primary (first) hub's"""
+        if ip is None:
+            return next(iter(self.clients.values()), None)
+        return self.clients.get(ip)
+
+    def stats(self):
+        return [client.stats() for client in self.clients.values()]
+
+    async def _sync_clients(self):
+        """Start and stop clients to match the stored configuration. Call with the lock held."""
+        wanted = {hub["ip"]: hub for hub in await asyncio.to_thread(load_hub_configs)}
+        for ip, client in list(self.clients.items()):
+            hub = wanted.get(ip)
+            if hub is None or (hub["username"], hub["password"]) != (client.username, client.password):
+                await self._stop_client(ip)
+        for ip, hub in wanted.items():
+            if ip not in self.clients:
+                self._start_client(TapoClient(ip, hub["username"], hub["password"]))
+        if not self.clients:
+            logger.warning("No Tapo hubs configured. Please configure via settings.")
+
+    def _start_client(self, client: TapoClient):
+        self.clients[client.hub_ip] = client
+        self._tasks[client.hub_ip] = asyncio.create_task(client.start())
+        logger.info(f"Tapo client started for hub {client.hub_ip}")
+
+    async def _stop_client(self, ip: str):
+        client = self.clients.pop(ip)
+        task = self._tasks.pop(ip)
+        client.stop()
+        # A client mid-connect or mid-backfill only notices stop() between requests
+        try:
+            await asyncio.wait_for(task, timeout=STOP_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            logger.warning(f"Tapo client for hub {ip} did not stop in time; cancelled")
+        except Exception as e:
+            logger.error(f"Tapo client for hub {ip} failed while stopping: {e}")
+        logger.info(f"Tapo client stopped for hub {ip}")
+
+    def _get_lock(self) -> asyncio.Lock:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+hub_manager = HubManager()
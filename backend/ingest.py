@@ -0,0 +1,206 @@
+"""
+Write-behind ingest queue
+Sensor sources submit events without touching the database; a single writer
+task batches them into one transaction per INGEST_BATCH_SIZE events or per
+INGEST_FLUSH_MS milliseconds, whichever comes first. A batch that fails to
+write (e.g. "database is locked") is retried up to INGEST_RETRIES times with
+exponential backoff before its events are dropped; the writer handles batches
+in order, so later events wait behind it rather than overtaking it. Every
+event carries an event_key, so a batch that was committed before its attempt
+reported failure is not stored a second time by the retry.
+"""
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import List, Optional
+from sqlalchemy.dialects.sqlite import insert
+from database import SessionLocal, ActivityLog
+from broadcaster import broadcaster
+from response_cache import table_versions
+from rollup import record_activity
+from sensor_registry import sensor_registry
+
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "200"))
+INGEST_FLUSH_MS = int(os.getenv("INGEST_FLUSH_MS", "250"))
+INGEST_RETRIES = int(os.getenv("INGEST_RETRIES", "5"))
+# First retry delay; doubled for each further attempt up to INGEST_RETRY_MAX_SECONDS
+INGEST_RETRY_SECONDS = 0.1
+INGEST_RETRY_MAX_SECONDS = 5
+
+EPOCH = datetime(1970, 1, 1)
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class IngestEvent:
+    unique_id: str
+    value: str
+    name: Optional[str] = None
+    type: str = "PIR"
+    timestamp: datetime = field(default_factory=datetime.utcnow)
+    event_key: Optional[str] = None  # Source event id; derived from the timestamp when the source has none
+
+def _event_key(event: IngestEvent) -> str:
+    """The source's key, or the event's capture time in hex microseconds (unique per sensor in practice)"""
+    return event.event_key or f"t{(event.timestamp - EPOCH) // timedelta(microseconds=1):x}"
+
+class IngestQueue:
+    def __init__(self, batch_size: int = INGEST_BATCH_SIZE, flush_ms: int = INGEST_FLUSH_MS, retries: int = INGEST_RETRIES):
+        self.batch_size = batch_size
+        self.flush_interval = flush_ms / 1000
+        self.retries = retries
+        self.queue = None
+        self.running = False
+        self._task = None
+
+        # Stats exposed through /status
+        self.events_written = 0
+        self.events_failed = 0
+        self.batches_written = 0
+        self.batch_retries = 0
+        self.last_flush_ms = None
+        self.max_flush_ms = None
+        self._total_flush_ms = 0.0
+
+    async def start(self):
+        """Start the writer task on the running event loop"""
+        if self.running:
+            return
+        self.queue = asyncio.Queue()
+        self.running = True
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"Ingest writer started (batch size {self.batch_size}, flush every {int(self.flush_interval * 1000)}ms)")
+
+    async def stop(self):
+        """Stop accepting events and flush everything still queued"""
+        if not self.running:
+            return
+        self.running = False
+        self.queue.put_nowait(None)  # Wake the writer so it can drain and exit
+        await self._task
+        self._task = None
+        logger.info("Ingest writer stopped")
+
+    def submit(self, event: IngestEvent):
+        """Queue an event for writing. Never blocks the caller."""
+        if not self.running:
+            logger.warning(f"Ingest writer not running, dropping event for {event.unique_id}")
+            self.events_failed += 1
+            return
+        self.queue.put_nowait(event)
+
+    def stats(self):
+        return {
+            "running": self.running,
+            "queue_depth": self.queue.qsize() if self.queue else 0,
+            "events_written": self.events_written,
+            "events_failed": self.events_failed,
+            "batches_written": self.batches_written,
+            "batch_retries": self.batch_retries,
+            "last_flush_ms": self.last_flush_ms,
+            "max_flush_ms": self.max_flush_ms,
+            "avg_flush_ms": round(self._total_flush_ms / self.batches_written, 2) if self.batches_written else None,
+        }
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self.queue.get()
+            if item is None:
+                stopping = True
+                batch = []
+            else:
+                batch = [item]
+
+            # Keep collecting until the batch is full or the flush deadline passes
+            deadline = loop.time() + self.flush_interval
+            while not stopping and len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                else:
+                    batch.append(item)
+
+            # On shutdown, drain whatever is left without waiting
+            if stopping:
+                while not self.queue.empty():
+                    item = self.queue.get_nowait()
+                    if item is not None:
+                        batch.append(item)
+
+            for start in range(0, len(batch), self.batch_size):
+                await self._flush(batch[start:start + self.batch_size])
+
+    async def _flush(self, batch: List[IngestEvent]):
+        if not batch:
+            return
+        started = time.perf_counter()
+        delay = INGEST_RETRY_SECONDS
+        for attempt in range(self.retries + 1):
+            try:
+                rows = await asyncio.to_thread(self._write_batch, batch)
+                break
+            except Exception as e:
+                if attempt == self.retries:
+                    logger.error(f"Error writing ingest batch of {len(batch)} events, dropping it after {attempt + 1} attempts: {e}")
+                    self.events_failed += len(batch)
+                    return
+                logger.warning(f"Error writing ingest batch of {len(batch)} events (retrying in {delay:.1f}s): {e}")
+                self.batch_retries += 1
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, INGEST_RETRY_MAX_SECONDS)
+        self.events_written += len(rows)
+        self.batches_written += 1
+        # Only committed rows reach live clients
+        broadcaster.publish("activity", rows)
+
+        elapsed_ms = round((time.perf_counter() - started) * 1000, 2)
+        self.last_flush_ms = elapsed_ms
+        self.max_flush_ms = max(self.max_flush_ms or 0, elapsed_ms)
+        self._total_flush_ms += elapsed_ms
+
+    def _write_batch(self, batch: List[IngestEvent]):
+        """Write a batch in a single transaction (runs in a worker thread). Returns the newly stored rows."""
+        db = SessionLocal()
+        try:
+            rows = [
+                {
+                    "sensor_id": sensor_registry.resolve(event.unique_id, event.name, event.type),
+                    "timestamp": event.timestamp,
+                    "value": event.value,
+                    "event_key": _event_key(event)
+                }
+                for event in batch
+            ]
+            # Events already stored under the same (sensor_id, event_key) are skipped
+            stmt = (
+                insert(ActivityLog)
+                .on_conflict_do_nothing(index_elements=[ActivityLog.sensor_id, ActivityLog.event_key])
+                .returning(ActivityLog.id, ActivityLog.sensor_id, ActivityLog.event_key)
+            )
+            ids = {(sensor_id, key): log_id for log_id, sensor_id, key in db.execute(stmt, rows).all()}
+            stored = [
+                {"id": ids[row["sensor_id"], row["event_key"]], "sensor_id": row["sensor_id"], "timestamp": row["timestamp"], "value": row["value"]}
+                for row in rows if (row["sensor_id"], row["event_key"]) in ids
+            ]
+            record_activity(db, [(row["sensor_id"], row["timestamp"], row["value"]) for row in stored])
+            db.commit()
+            table_versions.bump("activity_logs")
+            return stored
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+ingest_queue = IngestQueue()
@@ -1,8 +1,9 @@
-from fastapi import FastAPI, HTTPException, Depends, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Depends, BackgroundTasks, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional
+from datetime import datetime, timedelta
 import logging
 import asyncio
 import os
@@ -29,15 +30,28 @@ def get_db():
 @app.on_event("startup")
 async def startup_event():
     database.init_db()
+    logger.info(f"Storage settings: {database.get_storage_settings()}")
     
-    # Start Tapo Client if config exists
-    from tapo_client import get_tapo_client
-    tapo_client = get_tapo_client()
-    if tapo_client:
-        asyncio.create_task(tapo_client.start())
-        logger.info("Tapo client started")
-    else:
-        logger.warning("Tapo client not configured. Please configure via settings.")
+    # Start the ingest writer before any sensor source can submit events
+    from broadcaster import broadcaster
+    from ingest import ingest_queue
+    broadcaster.start()
+    await ingest_queue.start()
+    
+    # Archive raw events that have aged out of the retention window
+    from partitions import RETENTION_DAYS, retention_loop
+    if RETENTION_DAYS > 0:
+        asyncio.create_task(retention_loop())
+        logger.info(f"Retention enabled: raw events older than {RETENTION_DAYS} days are archived monthly")
+    
+    # Listen to a local python-matter-server for occupancy sensors
+    from matter_client import MATTER_ENABLED, matter_listener
+    if MATTER_ENABLED:
+        await matter_listener.start()
+    
+    # Start a Tapo client for every configured hub
+    from hub_manager import hub_manager
+    await hub_manager.start()
 
 @app.get("/config")
 def get_config(db: Session = Depends(get_db)):
@@ -71,7 +85,7 @@ class ConfigUpdate(BaseModel):
 @app.post("/config")
 async def update_config(config: ConfigUpdate, db: Session = Depends(get_db)):
     from database import SystemConfig
-    from tapo_client import get_tapo_client, reset_tapo_client
+    from hub_manager import hub_manager
     
     # Update or create configs
     settings = {
@@ -90,48 +104,94 @@ async def update_config(config: ConfigUpdate, db: Session = Depends(get_db)):
     
     db.commit()
     
-    # Restart client
-    reset_tapo_client()
-    tapo_client = get_tapo_client()
-    if tapo_client:
-        # Stop existing if running (handled in reset/start logic usually, but let's be safe)
-        # Ideally tapo_client.stop() was called. 
-        # Since we just reset the global, the old one might still be running if we didn't stop it.
-        # We need a way to stop the old one.
-        # Let's rely on reset_tapo_client to handle the stop.
-        asyncio.create_task(tapo_client.start())
+    # Restart the primary hub's client if its settings changed
+    await hub_manager.reload()
         
     return {"status": "success", "message": "Configuration updated and client restarted"}
 
 @app.on_event("shutdown")
-def shutdown_event():
-    from tapo_client import get_tapo_client
-    tapo_client = get_tapo_client()
-    if tapo_client:
-        tapo_client.stop()
+async def shutdown_event():
+    from hub_manager import hub_manager
+    from ingest import ingest_queue
+    await hub_manager.stop()
+    from matter_client import matter_listener
+    await matter_listener.stop()
+    
+    # Flush queued events once the sources have stopped
+    await ingest_queue.stop()
+    
+    from broadcaster import broadcaster
+    broadcaster.close()
 
 @app.get("/status")
 def get_status():
-    from tapo_client import get_tapo_client
-    tapo_client = get_tapo_client()
+    from hub_manager import hub_manager
+    from ingest import ingest_queue
+    from broadcaster import broadcaster
+    from matter_client import matter_listener
+    tapo_client = hub_manager.get()
     
     if not tapo_client:
-        return {"status": "not_configured", "error": "Tapo client not initialized"}
-        
+        return {"status": "not_configured", "error": "Tapo client not initialized", "hubs": [], "ingest": ingest_queue.stats(), "live": broadcaster.stats(), "matter": matter_listener.stats()}
+    
+    # Top-level fields describe the primary hub; "hubs" has every hub
     return {
         "status": "running" if tapo_client.running else "stopped",
         "connected": tapo_client.hub is not None,
-        "error": tapo_client.last_error
+        "error": tapo_client.last_error,
+        "polling": {**tapo_client.scheduler.stats(), "rate_limit": tapo_client.rate_limiter.stats()},
+        "hubs": hub_manager.stats(),
+        "ingest": ingest_queue.stats(),
+        "live": broadcaster.stats(),
+        "matter": matter_listener.stats()
     }
 
+@app.get("/hubs")
+def read_hubs():
+    """Configured Tapo hubs (without passwords) and their status"""
+    from hub_manager import hub_manager, load_hub_configs
+    running = {stats["hub_ip"]: stats for stats in hub_manager.stats()}
+    return [
+        {"ip": hub["ip"], "username": hub["username"], "primary": hub["primary"], **running.get(hub["ip"], {"status": "stopped"})}
+        for hub in load_hub_configs()
+    ]
+
+class HubCreate(BaseModel):
+    ip: str
+    username: Optional[str] = None
+    password: Optional[str] = None
+
+@app.post("/hubs")
+async def add_hub(hub: HubCreate):
+    """Add a Tapo hub and start polling it; omitted credentials default to the primary hub's"""
+    from hub_manager import hub_manager
+    if not await hub_manager.add_hub(hub.ip, hub.username, hub.password):
+        raise HTTPException(status_code=409, detail=f"Hub {hub.ip} is already configured")
+    return {"message": f"Hub {hub.ip} added"}
+
+@app.delete("/hubs/{ip}")
+async def remove_hub(ip: str):
+    """Stop polling an extra Tapo hub and remove it from the configuration"""
+    from hub_manager import hub_manager
+    try:
+        removed = await hub_manager.remove_hub(ip)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if not removed:
+        raise HTTPException(status_code=404, detail=f"Hub {ip} is not configured")
+    return {"message": f"Hub {ip} removed"}
+
 @app.get("/")
 def read_root():
     return {"message": "Matter Activity Logger API"}
 
 @app.get("/sensors", response_model=List[dict])
-def read_sensors(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    sensors = db.query(Sensor).offset(skip).limit(limit).all()
-    return [{"id": s.id, "name": s.name, "unique_id": s.unique_id, "type": s.type, "is_hidden": s.is_hidden} for s in sensors]
+def read_sensors(request: Request, skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+    from response_cache import response_cache
+    def build():
+        sensors = db.query(Sensor).offset(skip).limit(limit).all()
+        return [{"id": s.id, "name": s.name, "unique_id": s.unique_id, "type": s.type, "is_hidden": s.is_hidden} for s in sensors]
+    return response_cache.respond(request, ["sensors"], build)
 
 class SensorUpdate(BaseModel):
     is_hidden: bool
@@ -146,23 +206,173 @@ def update_sensor(sensor_id: int, sensor_update: SensorUpdate, db: Session = Dep
     db.commit()
     db.refresh(sensor)
     
+    from sensor_registry import sensor_registry
+    from broadcaster import broadcaster
+    from response_cache import table_versions
+    sensor_registry.invalidate(sensor.id)
+    table_versions.bump("sensors")
+    broadcaster.publish("changed")
+    
     return {"id": sensor.id, "name": sensor.name, "is_hidden": sensor.is_hidden, "message": "Sensor updated successfully"}
 
 @app.get("/logs", response_model=List[dict])
-def read_logs(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    logs = db.query(ActivityLog).order_by(ActivityLog.timestamp.desc()).offset(skip).limit(limit).all()
-    return [{"id": l.id, "sensor_id": l.sensor_id, "timestamp": l.timestamp, "value": l.value} for l in logs]
+def read_logs(
+    request: Request,
+    skip: int = 0,
+    limit: Optional[int] = Query(None, ge=1),
+    cursor: Optional[str] = None,
+    sensor_ids: Optional[List[int]] = Query(None),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    format: str = Query("json", pattern="^(json|ndjson)$"),
+    db: Session = Depends(get_db)
+):
+    """
+    Events newest first. Pass the X-Next-Cursor header (or "<timestamp>_<id>" of
+    the last row) as cursor for the next page; format=ndjson streams rows with
+    no limit unless one is given.
+    """
+    from fastapi.responses import StreamingResponse
+    from pagination import encode_cursor, logs_query, stream_ndjson
+    from serialization import rows_to_dicts
+    try:
+        stmt = logs_query(cursor, sensor_ids, start, end)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if skip and not cursor:
+        stmt = stmt.offset(skip)  # Deprecated: deep offsets get slower, use cursor
+    
+    if format == "ndjson":
+        if limit:
+            stmt = stmt.limit(limit)
+        return StreamingResponse(stream_ndjson(stmt), media_type="application/x-ndjson")
+    
+    from response_cache import response_cache
+    def build():
+        result = db.execute(stmt.limit(limit or 100))
+        logs = result.all()
+        headers = {}
+        if len(logs) == (limit or 100):
+            headers["X-Next-Cursor"] = encode_cursor(logs[-1].timestamp, logs[-1].id)
+        return rows_to_dicts(result.keys(), logs), headers
+    return response_cache.respond(request, ["activity_logs"], build)
+
+@app.get("/sync")
+def sync_changes(since: Optional[str] = None, db: Session = Depends(get_db)):
+    """
+    Everything the dashboard shows that changed since the cursor returned by the
+    previous call. With no cursor (or a stale one) returns a full snapshot with full=true.
+    """
+    from sync import sync, prune_change_log
+    from serialization import FastJSONResponse
+    result = sync(db, since)
+    if result["full"]:
+        # Snapshots happen on page load, a cheap moment to trim the change feed
+        prune_change_log(db)
+        db.commit()
+    return FastJSONResponse(result)
+
+@app.get("/events")
+async def stream_events():
+    """
+    Server-Sent Events. "activity" carries each batch of new log rows as it is
+    committed; "changed" and "resync" mean the client should call /sync.
+    """
+    from fastapi.responses import StreamingResponse
+    from broadcaster import broadcaster
+    return StreamingResponse(
+        broadcaster.sse_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/heatmap")
+def read_heatmap(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    sensor_ids: Optional[List[int]] = Query(None),
+    bucket_minutes: int = 60,
+    db: Session = Depends(get_db)
+):
+    """Pre-bucketed activity counts per sensor and UTC hour (or quarter hour).
+
+    Bucket start times are UTC; the client places each bucket in its local day and
+    hour. bucket_minutes=15 serves zones whose offset from UTC isn't a whole hour.
+    """
+    from aggregation import BUCKET_MINUTES, heatmap_buckets
+    from serialization import FastJSONResponse
+    end = end or datetime.utcnow()
+    start = start or end - timedelta(weeks=12)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    if bucket_minutes not in BUCKET_MINUTES:
+        raise HTTPException(status_code=400, detail=f"bucket_minutes must be one of {', '.join(map(str, BUCKET_MINUTES))}")
+
+    buckets = heatmap_buckets(db, start, end, sensor_ids, bucket_minutes)
+    return FastJSONResponse({
+        "start": start,
+        "end": end,
+        "bucket_minutes": bucket_minutes,
+        "buckets": buckets
+    })
+
+@app.get("/logs/history", response_model=List[dict])
+def read_log_history(
+    start: datetime,
+    end: Optional[datetime] = None,
+    sensor_ids: Optional[List[int]] = Query(None),
+    limit: int = 10000,
+    db: Session = Depends(get_db)
+):
+    """Raw events in [start, end), oldest first, including archived months"""
+    from itertools import chain, islice
+    from partitions import query_archived_events
+    from serialization import FastJSONResponse
+    end = end or datetime.utcnow()
+    
+    hot = db.query(ActivityLog.id, ActivityLog.sensor_id, ActivityLog.timestamp, ActivityLog.value).filter(ActivityLog.timestamp >= start, ActivityLog.timestamp < end)
+    if sensor_ids is not None:
+        hot = hot.filter(ActivityLog.sensor_id.in_(sensor_ids))
+    hot = hot.order_by(ActivityLog.timestamp, ActivityLog.id).limit(limit)
+    hot_rows = (row._asdict() for row in hot)
+    
+    return FastJSONResponse(list(islice(chain(query_archived_events(start, end, sensor_ids), hot_rows), limit)))
+
+@app.get("/archive")
+def read_archive():
+    """Compressed monthly partitions of raw events"""
+    from partitions import list_partitions, RETENTION_DAYS
+    return {"retention_days": RETENTION_DAYS, "partitions": list_partitions()}
+
+@app.post("/archive/retention")
+def run_retention(retention_days: Optional[int] = Query(None, ge=1)):
+    """Archive raw events older than retention_days (defaults to RETENTION_DAYS) now"""
+    from partitions import apply_retention, RETENTION_DAYS
+    days = retention_days or RETENTION_DAYS
+    if days <= 0:
+        raise HTTPException(status_code=400, detail="Retention is disabled; pass retention_days or set RETENTION_DAYS")
+    return apply_retention(days)
 
 @app.get("/anomalies", response_model=List[dict])
-def read_anomalies(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    anomalies = db.query(Anomaly).order_by(Anomaly.timestamp.desc()).offset(skip).limit(limit).all()
-    return [{"id": a.id, "sensor_id": a.sensor_id, "timestamp": a.timestamp, "description": a.description, "score": a.score} for a in anomalies]
+def read_anomalies(request: Request, skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+    from response_cache import response_cache
+    from serialization import rows_to_dicts
+    def build():
+        anomalies = db.query(Anomaly.id, Anomaly.sensor_id, Anomaly.timestamp, Anomaly.description, Anomaly.score) \
+            .order_by(Anomaly.timestamp.desc()).offset(skip).limit(limit)
+        return rows_to_dicts(("id", "sensor_id", "timestamp", "description", "score"), anomalies)
+    return response_cache.respond(request, ["anomalies"], build)
 
 @app.get("/adjustments", response_model=List[dict])
-def read_adjustments(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+def read_adjustments(request: Request, skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
     from database import DataAdjustment
-    adjustments = db.query(DataAdjustment).order_by(DataAdjustment.timestamp.desc()).offset(skip).limit(limit).all()
-    return [{"id": a.id, "sensor_id": a.sensor_id, "timestamp": a.timestamp, "value": a.value, "comment": a.comment} for a in adjustments]
+    from response_cache import response_cache
+    from serialization import rows_to_dicts
+    def build():
+        adjustments = db.query(DataAdjustment.id, DataAdjustment.sensor_id, DataAdjustment.timestamp, DataAdjustment.value, DataAdjustment.comment) \
+            .order_by(DataAdjustment.timestamp.desc()).offset(skip).limit(limit)
+        return rows_to_dicts(("id", "sensor_id", "timestamp", "value", "comment"), adjustments)
+    return response_cache.respond(request, ["data_adjustments"], build)
 
 from pydantic import BaseModel
 from datetime import datetime
@@ -177,6 +387,8 @@ class AdjustmentCreate(BaseModel):
 @app.post("/adjustments")
 def create_adjustment(adjustment: AdjustmentCreate, db: Session = Depends(get_db)):
     from database import DataAdjustment
+    from broadcaster import broadcaster
+    from response_cache import table_versions
     # Check if adjustment already exists for this sensor/time, if so update it
     # We normalize timestamp to hour in the frontend, but let's ensure it here too if needed.
     # For now, assume frontend sends correct hour-aligned timestamp.
@@ -191,6 +403,8 @@ def create_adjustment(adjustment: AdjustmentCreate, db: Session = Depends(get_db
         existing.comment = adjustment.comment
         db.commit()
         db.refresh(existing)
+        table_versions.bump("data_adjustments")
+        broadcaster.publish("changed")
         return {"id": existing.id, "message": "Adjustment updated"}
     
     new_adj = DataAdjustment(
@@ -202,6 +416,8 @@ def create_adjustment(adjustment: AdjustmentCreate, db: Session = Depends(get_db
     db.add(new_adj)
     db.commit()
     db.refresh(new_adj)
+    table_versions.bump("data_adjustments")
+    broadcaster.publish("changed")
     return {"id": new_adj.id, "message": "Adjustment created"}
 
 @app.delete("/adjustments/{adjustment_id}")
@@ -209,204 +425,188 @@ def delete_adjustment(adjustment_id: int, db: Session = Depends(get_db)):
     from database import DataAdjustment
     db.query(DataAdjustment).filter(DataAdjustment.id == adjustment_id).delete()
     db.commit()
+    from broadcaster import broadcaster
+    from response_cache import table_versions
+    table_versions.bump("data_adjustments")
+    broadcaster.publish("changed")
     return {"message": "Adjustment deleted"}
 
 @app.post("/analyze")
-def trigger_analysis(background_tasks: BackgroundTasks):
-    from analyzer import analyze_data
-    background_tasks.add_task(analyze_data)
+def trigger_analysis(background_tasks: BackgroundTasks, full: bool = False, reset: bool = False, workers: Optional[int] = Query(None, ge=1)):
+    """Score new hourly buckets; full=true retrains per-sensor IsolationForest models over all history"""
+    from analyzer import analyze_data, analyze_incremental
+    if full:
+        background_tasks.add_task(analyze_data, workers)
+    else:
+        background_tasks.add_task(analyze_incremental, reset)
     return {"message": "Analysis triggered in background"}
 
 @app.post("/logs/fetch-historical")
-async def fetch_historical_logs():
-    from tapo_client import get_tapo_client
-    tapo_client = get_tapo_client()
-    if not tapo_client:
-        raise HTTPException(status_code=503, detail="Tapo client not initialized")
+async def fetch_historical_logs(full: bool = False, hub: Optional[str] = None):
+    """Backfill trigger logs from one hub, or from every hub concurrently"""
+    clients = _tapo_clients(hub)
     
-    result = await tapo_client.get_historical_logs()
-    return result
+    results = await asyncio.gather(*(client.get_historical_logs(full=full) for client in clients))
+    if len(results) == 1:
+        return results[0]
+    return {
+        "message": "Historical fetch completed",
+        "count": sum(result["count"] for result in results),
+        "fetched": sum(result["fetched"] for result in results),
+        "inserted": sum(result.get("inserted", 0) for result in results),
+        "failed_pages": sum(result.get("failed_pages", 0) for result in results),
+        "failed_sensors": sum(result.get("failed_sensors", 0) for result in results),
+        "elapsed_seconds": max(result.get("elapsed_seconds", 0) for result in results),
+        "full": full,
+        "hubs": {client.hub_ip: result for client, result in zip(clients, results)}
+    }
 
-@app.post("/demo/generate")
-def generate_demo_data(db: Session = Depends(get_db)):
-    """Generate demo data for testing the UI"""
-    from datetime import datetime, timedelta
-    import random
-    
-    # Create demo sensors
-    demo_sensors = [
-        {"unique_id": "demo-living-room", "name": "Living Room Motion (Demo)", "type": "PIR", "is_hidden": False},
-        {"unique_id": "demo-kitchen", "name": "Kitchen Motion (Demo)", "type": "PIR", "is_hidden": False},
-        {"unique_id": "demo-bedroom", "name": "Bedroom Motion (Demo)", "type": "PIR", "is_hidden": False},
-    ]
-    
-    sensor_ids = []
-    for sensor_data in demo_sensors:
-        sensor = db.query(Sensor).filter(Sensor.unique_id == sensor_data["unique_id"]).first()
-        if not sensor:
-            sensor = Sensor(**sensor_data)
-            db.add(sensor)
-        else:
-            # Update existing sensor
-            sensor.name = sensor_data["name"]
-            sensor.is_hidden = sensor_data.get("is_hidden", False)
-        
-        db.commit()
-        db.refresh(sensor)
-        sensor_ids.append(sensor.id)
+def _tapo_clients(hub: Optional[str] = None):
+    """The client for one hub, or all of them; 503 if there are none"""
+    from hub_manager import hub_manager
+    clients = [hub_manager.get(hub)] if hub else list(hub_manager.clients.values())
+    if not clients or clients[0] is None:
+        raise HTTPException(status_code=503, detail="Tapo client not initialized" if not hub else f"Hub {hub} is not configured")
+    return clients
+
+@app.get("/export")
+def export_history(
+    table: str = "activity_logs",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    format: str = Query("parquet", pattern="^(parquet|arrow)$")
+):
+    """Download rows in [start, end) as a Parquet or Arrow IPC file, written in chunks"""
+    import tempfile
+    from fastapi.responses import FileResponse
+    from starlette.background import BackgroundTask
+    from history_export import TABLES, export_table
+    if table not in TABLES:
+        raise HTTPException(status_code=400, detail=f"Unknown table {table}; expected one of {sorted(TABLES)}")
     
-    # Generate 30 days of activity with weekly variations
-    base_time = datetime.utcnow() - timedelta(days=30)
-    logs_created = 0
+    suffix = ".parquet" if format == "parquet" else ".arrow"
+    fd, path = tempfile.mkstemp(suffix=suffix)
+    os.close(fd)
+    try:
+        export_table(table, path, start, end, format)
+    except RuntimeError as e:  # pyarrow not installed
+        os.remove(path)
+        raise HTTPException(status_code=501, detail=str(e))
+    except Exception:
+        os.remove(path)
+        raise
+    return FileResponse(path, filename=f"{table}{suffix}", background=BackgroundTask(os.remove, path))
+
+@app.post("/import")
+async def import_history(request: Request, table: str = "activity_logs", format: str = Query("parquet", pattern="^(parquet|arrow)$")):
+    """Bulk-load a file produced by /export (sent as the raw request body)"""
+    import tempfile
+    from history_export import TABLES, import_table
+    if table not in TABLES:
+        raise HTTPException(status_code=400, detail=f"Unknown table {table}; expected one of {sorted(TABLES)}")
     
-    for day in range(30):
-        current_day = base_time + timedelta(days=day)
-        day_of_week = current_day.weekday()  # 0=Monday, 6=Sunday
-        
-        # Different patterns for weekdays vs weekends
-        is_weekend = day_of_week >= 5
-        
-        for sensor_id in sensor_ids:
-            # Weekday pattern
-            if not is_weekend:
-                # Morning rush (6-9 AM) - higher on weekdays
-                for hour in range(6, 9):
-                    count = random.randint(8, 18)
-                    for _ in range(count):
-                        timestamp = current_day.replace(hour=hour, minute=random.randint(0, 59), second=random.randint(0, 59))
-                        log = ActivityLog(sensor_id=sensor_id, timestamp=timestamp, value="active")
-                        db.add(log)
-                        logs_created += 1
-                
-                # Work hours (9 AM-5 PM) - lower on weekdays (people at work)
-                for hour in range(9, 17):
-                    count = random.randint(2, 8)
-                    for _ in range(count):
-                        timestamp = current_day.replace(hour=hour, minute=random.randint(0, 59), second=random.randint(0, 59))
-                        log = ActivityLog(sensor_id=sensor_id, timestamp=timestamp, value="active")
-                        db.add(log)
-                        logs_created += 1
-                
-                # Evening (5-11 PM) - high activity
-                for hour in range(17, 23):
-                    count = random.randint(10, 22)
-                    for _ in range(count):
-                        timestamp = current_day.replace(hour=hour, minute=random.randint(0, 59), second=random.randint(0, 59))
-                        log = ActivityLog(sensor_id=sensor_id, timestamp=timestamp, value="active")
-                        db.add(log)
-                        logs_created += 1
-            
-            # Weekend pattern
-            else:
-                # Late morning (8 AM-12 PM) - people sleep in
-                for hour in range(8, 12):
-                    count = random.randint(6, 14)
-                    for _ in range(count):
-                        timestamp = current_day.replace(hour=hour, minute=random.randint(0, 59), second=random.randint(0, 59))
-                        log = ActivityLog(sensor_id=sensor_id, timestamp=timestamp, value="active")
-                        db.add(log)
-                        logs_created += 1
-                
-                # Afternoon (12 PM-6 PM) - high activity (home all day)
-                for hour in range(12, 18):
-                    count = random.randint(12, 25)
-                    for _ in range(count):
-                        timestamp = current_day.replace(hour=hour, minute=random.randint(0, 59), second=random.randint(0, 59))
-                        log = ActivityLog(sensor_id=sensor_id, timestamp=timestamp, value="active")
-                        db.add(log)
-                        logs_created += 1
-                
-                # Evening (6-11 PM) - moderate to high
-                for hour in range(18, 23):
-                    count = random.randint(8, 18)
-                    for _ in range(count):
-                        timestamp = current_day.replace(hour=hour, minute=random.randint(0, 59), second=random.randint(0, 59))
-                        log = ActivityLog(sensor_id=sensor_id, timestamp=timestamp, value="active")
-                        db.add(log)
-                        logs_created += 1
-            
-            # Late night (11 PM-1 AM) - similar for all days
-            for hour in [23, 0]:
-                if random.random() < 0.5:
-                    count = random.randint(1, 4)
-                    for _ in range(count):
-                        timestamp = current_day.replace(hour=hour, minute=random.randint(0, 59), second=random.randint(0, 59))
-                        log = ActivityLog(sensor_id=sensor_id, timestamp=timestamp, value="active")
-                        db.add(log)
-                        logs_created += 1
-            
-            # Early morning (1-6 AM) - very low, slightly higher on weekends
-            if random.random() < (0.3 if is_weekend else 0.15):
-                night_hour = random.randint(1, 5)
-                count = random.randint(1, 3)
-                for _ in range(count):
-                    timestamp = current_day.replace(hour=night_hour, minute=random.randint(0, 59), second=random.randint(0, 59))
-                    log = ActivityLog(sensor_id=sensor_id, timestamp=timestamp, value="active")
-                    db.add(log)
-                    logs_created += 1
-    
-    # Add some anomalous patterns
-    # Unusual 3 AM activity
-    for _ in range(5):
-        anomaly_day = base_time + timedelta(days=random.randint(0, 29))
-        for sensor_id in random.sample(sensor_ids, 2):
-            for _ in range(random.randint(15, 25)):
-                timestamp = anomaly_day.replace(hour=3, minute=random.randint(0, 59))
-                log = ActivityLog(sensor_id=sensor_id, timestamp=timestamp, value="active")
-                db.add(log)
-                logs_created += 1
+    # Spool the upload to disk so large files are never held in memory
+    with tempfile.NamedTemporaryFile(suffix=f".{format}") as upload:
+        async for chunk in request.stream():
+            upload.write(chunk)
+        upload.flush()
+        try:
+            return await asyncio.to_thread(import_table, table, upload.name, format)
+        except RuntimeError as e:  # pyarrow not installed
+            raise HTTPException(status_code=501, detail=str(e))
+
+@app.post("/demo/generate")
+def generate_demo_data(
+    sensors: int = Query(3, ge=1, le=1000),
+    days: int = Query(30, ge=1, le=3650),
+    profile: str = "home",
+    scale: float = Query(1.0, gt=0),
+    anomaly_rate: float = Query(0.1, ge=0, le=1),
+    seed: Optional[int] = None
+):
+    """Generate demo data for testing the UI (or, with more sensors and days, for load testing)"""
+    from demo_data import PROFILES, generate_demo_data as generate
+    if profile not in PROFILES:
+        raise HTTPException(status_code=400, detail=f"Unknown profile {profile}; expected one of {sorted(PROFILES)}")
     
-    db.commit()
+    result = generate(sensors, days, profile, scale, anomaly_rate, seed)
     
+    from broadcaster import broadcaster
+    from response_cache import table_versions
+    table_versions.bump("sensors", "activity_logs")
+    broadcaster.publish("changed")
     return {
         "message": "Demo data generated successfully",
-        "sensors_created": len(demo_sensors),
-        "logs_created": logs_created
+        **result
     }
 
 @app.post("/demo/clear")
-def clear_demo_data(db: Session = Depends(get_db)):
+def clear_demo_data():
     """Clear all demo data"""
-    from database import DataAdjustment
-    
-    # Find demo sensors
-    demo_sensors = db.query(Sensor).filter(
-        Sensor.unique_id.like("demo-%")
-    ).all()
-    
-    logs_deleted = 0
-    anomalies_deleted = 0
-    adjustments_deleted = 0
-    sensors_deleted = 0
-    
-    for sensor in demo_sensors:
-        logs_deleted += db.query(ActivityLog).filter(ActivityLog.sensor_id == sensor.id).delete(synchronize_session=False)
-        anomalies_deleted += db.query(Anomaly).filter(Anomaly.sensor_id == sensor.id).delete(synchronize_session=False)
-        adjustments_deleted += db.query(DataAdjustment).filter(DataAdjustment.sensor_id == sensor.id).delete(synchronize_session=False)
-        db.delete(sensor)
-        sensors_deleted += 1
-    
-    db.commit()
+    from maintenance import delete_sensors, demo_sensor_ids
+    result = delete_sensors(demo_sensor_ids())
     
+    from broadcaster import broadcaster
+    broadcaster.publish("changed")
     return {
         "message": "Demo data cleared successfully",
-        "sensors_deleted": sensors_deleted,
-        "logs_deleted": logs_deleted,
-        "anomalies_deleted": anomalies_deleted,
-        "adjustments_deleted": adjustments_deleted
+        **result
     }
 
+@app.post("/maintenance/purge")
+def purge_rows(
+    table: str,
+    sensor_ids: Optional[List[int]] = Query(None),
+    global_only: bool = False,
+    ids: Optional[List[int]] = Query(None),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    all: bool = False,
+    chunk_size: Optional[int] = Query(None, ge=0),
+    checkpoint: bool = False,
+    vacuum: bool = False
+):
+    """Delete rows of one table by sensor, row id and/or [start, end), in bounded chunks; all=true empties it"""
+    from maintenance import TABLES, PURGE_CHUNK_ROWS, purge, reclaim_space
+    if table not in TABLES:
+        raise HTTPException(status_code=400, detail=f"Unknown table {table}; expected one of {sorted(TABLES)}")
+    if not (sensor_ids or ids or start or end or global_only or all):
+        raise HTTPException(status_code=400, detail="No filters given; pass all=true to empty the table")
+    
+    deleted = purge(table, sensor_ids, start, end, ids, global_only, PURGE_CHUNK_ROWS if chunk_size is None else chunk_size)
+    if deleted:
+        from broadcaster import broadcaster
+        broadcaster.publish("changed")
+    result = {"message": f"Purged {deleted} rows from {table}", "deleted": deleted}
+    if checkpoint or vacuum:
+        result["storage"] = reclaim_space(vacuum)
+    return result
+
+@app.post("/maintenance/delete-sensors")
+def delete_sensors(
+    sensor_ids: List[int] = Query(...),
+    chunk_size: Optional[int] = Query(None, ge=0),
+    checkpoint: bool = False,
+    vacuum: bool = False
+):
+    """Delete sensors with all of their events, anomalies, adjustments and rollup"""
+    from maintenance import PURGE_CHUNK_ROWS, delete_sensors as delete, reclaim_space
+    result = delete(sensor_ids, PURGE_CHUNK_ROWS if chunk_size is None else chunk_size)
+    
+    from broadcaster import broadcaster
+    broadcaster.publish("changed")
+    if checkpoint or vacuum:
+        result["storage"] = reclaim_space(vacuum)
+    return {"message": f"Deleted {result['sensors_deleted']} sensors", **result}
+
 @app.post("/sensors/refresh")
-async def refresh_sensors():
-    """Force immediate sensor polling from Tapo hub"""
-    from tapo_client import get_tapo_client
-    tapo_client = get_tapo_client()
-    if not tapo_client:
-        raise HTTPException(status_code=503, detail="Tapo client not initialized")
+async def refresh_sensors(hub: Optional[str] = None):
+    """Force immediate sensor polling from one Tapo hub, or all of them"""
+    clients = _tapo_clients(hub)
     
     try:
         # Force a poll of sensors
-        await tapo_client._poll_sensors()
+        await asyncio.gather(*(client._poll_sensors() for client in clients))
         return {"message": "Sensors refreshed successfully"}
     except Exception as e:
         logger.error(f"Error refreshing sensors: {e}")
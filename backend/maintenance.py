@@ -0,0 +1,213 @@
+"""
+Bulk deletes
+Removes rows by sensor set and/or time range with set-based DELETEs. Each
+transaction deletes at most chunk_size rows, so a large purge only holds the
+write lock briefly and the ingest writer gets in between chunks (chunk_size=0
+deletes everything in a single transaction). Events taken out of activity_logs
+are subtracted from the hourly rollup in the same transaction, and matching
+events in archived months are deleted from their partitions. Afterwards the
+WAL can be checkpointed, or the file VACUUMed to give the freed pages back:
+
+    python maintenance.py --demo                       # what /demo/clear removes
+    python maintenance.py --sensors 4 7                # sensors and all of their data
+    python maintenance.py --table activity_logs --before 2024-01-01 --vacuum
+    python maintenance.py --table data_adjustments --global
+    python maintenance.py --table data_adjustments --ids 4 6
+    python maintenance.py --table data_adjustments --all
+"""
+import argparse
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Iterable, Optional
+from sqlalchemy import delete, func, insert, select, true
+from database import (
+    SessionLocal, engine, ActivityLog, Anomaly, BackfillState, ChangeLog,
+    DataAdjustment, HourlyActivity, Sensor, SensorBaseline, RollupChange,
+    AnalyzerState, AnalyzedBucket,
+)
+from partitions import delete_archived_events
+from response_cache import table_versions
+from rollup import remove_activity
+
+PURGE_CHUNK_ROWS = int(os.getenv("PURGE_CHUNK_ROWS", "50000"))
+# Gives writers waiting on the lock a turn between chunks
+CHUNK_PAUSE_SECONDS = 0.05
+
+TABLES = {"activity_logs": ActivityLog, "anomalies": Anomaly, "data_adjustments": DataAdjustment}
+# Per-sensor state with no value once the sensor is gone
+SENSOR_STATE = (HourlyActivity, RollupChange, SensorBaseline, AnalyzerState, AnalyzedBucket, BackfillState)
+
+logger = logging.getLogger(__name__)
+
+def purge(
+    table: str,
+    sensor_ids: Optional[Iterable[int]] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    ids: Optional[Iterable[int]] = None,
+    global_only: bool = False,
+    chunk_size: int = PURGE_CHUNK_ROWS,
+) -> int:
+    """
+    Delete rows of table matching every given filter: sensor_ids, a [start, end)
+    timestamp range, row ids, or (global_only) rows without a sensor. With no
+    filters the whole table is emptied. Archived events match the same filters,
+    except row ids, which only refer to the hot table. Returns the number of
+    rows deleted.
+    """
+    if table not in TABLES:
+        raise ValueError(f"Unknown table {table}; expected one of {sorted(TABLES)}")
+    columns = TABLES[table].__table__.c
+
+    condition = true()
+    if sensor_ids is not None:
+        condition &= columns.sensor_id.in_(list(sensor_ids))
+    if global_only:
+        condition &= columns.sensor_id.is_(None)
+    if start is not None:
+        condition &= columns.timestamp >= start
+    if end is not None:
+        condition &= columns.timestamp < end
+    if ids is not None:
+        condition &= columns.id.in_(list(ids))
+
+    deleted = _delete_chunks(TABLES[table].__table__, condition, chunk_size)
+    if table == "activity_logs" and ids is None:
+        deleted += delete_archived_events(sensor_ids, start, end, global_only)
+    if deleted:
+        if table == "activity_logs":
+            _mark_events_deleted()
+        table_versions.bump(table)
+        logger.info(f"Purged {deleted} rows from {table}")
+    return deleted
+
+def delete_sensors(sensor_ids: Iterable[int], chunk_size: int = PURGE_CHUNK_ROWS):
+    """Delete sensors together with their events, anomalies, adjustments and rollup"""
+    sensor_ids = list(sensor_ids)
+    result = {"sensors_deleted": 0, "logs_deleted": 0, "anomalies_deleted": 0, "adjustments_deleted": 0}
+    if not sensor_ids:
+        return result
+
+    result["logs_deleted"] = purge("activity_logs", sensor_ids, chunk_size=chunk_size)
+    result["anomalies_deleted"] = purge("anomalies", sensor_ids, chunk_size=chunk_size)
+    result["adjustments_deleted"] = purge("data_adjustments", sensor_ids, chunk_size=chunk_size)
+
+    # The remaining rows are a handful per sensor: one transaction
+    db = SessionLocal()
+    try:
+        for model in SENSOR_STATE:
+            db.execute(delete(model).where(model.sensor_id.in_(sensor_ids)))
+        result["sensors_deleted"] = db.execute(delete(Sensor).where(Sensor.id.in_(sensor_ids))).rowcount
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+    from sensor_registry import sensor_registry
+    for sensor_id in sensor_ids:
+        sensor_registry.invalidate(sensor_id)
+    table_versions.bump("sensors")
+    logger.info(f"Deleted sensors {sensor_ids}: {result}")
+    return result
+
+def demo_sensor_ids():
+    """Ids of the sensors created by demo_data.py"""
+    db = SessionLocal()
+    try:
+        return [sensor_id for (sensor_id,) in db.query(Sensor.id).filter(Sensor.unique_id.like("demo-%"))]
+    finally:
+        db.close()
+
+def reclaim_space(vacuum: bool = False):
+    """
+    Checkpoint the WAL into the database file and truncate it. With vacuum the
+    file is first rebuilt without its free pages, which needs free disk space
+    about the size of the database and blocks writers while it runs.
+    """
+    started = time.perf_counter()
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if vacuum:
+            conn.exec_driver_sql("VACUUM")
+        busy, _, _ = conn.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)").one()
+    path = engine.url.database
+    return {
+        "vacuumed": vacuum,
+        "checkpointed": not busy,  # A reader kept the WAL from being fully checkpointed
+        "size_bytes": os.path.getsize(path) if path and os.path.exists(path) else None,
+        "elapsed_seconds": round(time.perf_counter() - started, 2),
+    }
+
+def _delete_chunks(table, condition, chunk_size: int) -> int:
+    is_events = table.name == "activity_logs"
+    deleted = 0
+    db = SessionLocal()
+    try:
+        while True:
+            chunk = select(table.c.id).where(condition)
+            if chunk_size > 0:
+                chunk = chunk.limit(chunk_size)
+            stmt = delete(table).where(table.c.id.in_(chunk))
+            if is_events:
+                # Keep the rollup consistent with the raw rows, chunk by chunk
+                events = db.execute(stmt.returning(table.c.sensor_id, table.c.timestamp, table.c.value)).all()
+                remove_activity(db, events)
+                count = len(events)
+            else:
+                count = db.execute(stmt).rowcount
+            db.commit()
+            deleted += count
+            if chunk_size <= 0 or count < chunk_size:
+                return deleted
+            time.sleep(CHUNK_PAUSE_SECONDS)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+def _mark_events_deleted():
+    """
+    Raw events have no change_log triggers, so record the purge itself: /sync
+    sends a full snapshot to any client whose cursor predates it.
+    """
+    db = SessionLocal()
+    try:
+        db.execute(insert(ChangeLog).values(table_name="activity_logs", row_id=0, op="delete", changed_at=func.datetime("now")))
+        db.commit()
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk-delete sensors, events, anomalies or adjustments")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--demo", action="store_true", help="Delete the demo sensors and all of their data")
+    target.add_argument("--sensors", type=int, nargs="+", metavar="ID", help="Delete these sensors and all of their data")
+    target.add_argument("--table", choices=sorted(TABLES), help="Delete matching rows from this table")
+    parser.add_argument("--sensor-ids", type=int, nargs="+", metavar="ID", help="With --table: only rows of these sensors")
+    parser.add_argument("--global", dest="global_only", action="store_true", help="With --table: only rows without a sensor")
+    parser.add_argument("--ids", type=int, nargs="+", metavar="ID", help="With --table: only these row ids")
+    parser.add_argument("--after", type=datetime.fromisoformat, help="With --table: only rows at or after this time (UTC)")
+    parser.add_argument("--before", type=datetime.fromisoformat, help="With --table: only rows before this time (UTC)")
+    parser.add_argument("--all", action="store_true", help="With --table and no filters: confirm emptying the table")
+    parser.add_argument("--chunk-size", type=int, default=PURGE_CHUNK_ROWS, help=f"Rows deleted per transaction, 0 for one transaction (default {PURGE_CHUNK_ROWS})")
+    parser.add_argument("--checkpoint", action="store_true", help="Checkpoint and truncate the WAL afterwards")
+    parser.add_argument("--vacuum", action="store_true", help="VACUUM the database afterwards (implies --checkpoint)")
+    args = parser.parse_args()
+
+    filtered = any(value is not None for value in (args.sensor_ids, args.ids, args.after, args.before)) or args.global_only
+    if args.table and not filtered and not args.all:
+        parser.error("--table without filters empties the table; pass --all to confirm")
+
+    logging.basicConfig(level=logging.INFO)
+    from database import init_db
+    init_db()
+    if args.table:
+        purge(args.table, args.sensor_ids, args.after, args.before, args.ids, args.global_only, args.chunk_size)
+    else:
+        delete_sensors(demo_sensor_ids() if args.demo else args.sensors, args.chunk_size)
+    if args.checkpoint or args.vacuum:
+        logger.info(reclaim_space(args.vacuum))
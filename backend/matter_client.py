@@ -1,91 +1,178 @@
+"""
+Matter Server listener
+Follows python-matter-server's websocket API directly: after the server info
+and start_listening handshake, each frame is checked for the occupancy
+attribute (cluster 0x0406, attribute 0) with a substring test before it is
+parsed, so the stream of unrelated attribute updates costs almost nothing.
+Occupancy changes are handed to the ingest queue without blocking.
+
+The connection is re-established with exponential backoff, and stop() closes
+it straight away rather than waiting for the next frame.
+"""
 import asyncio
 import logging
 import os
+import random
+from datetime import datetime
 import aiohttp
-from matter_server.client import MatterClient
-from matter_server.common.models import EventType
-from database import SessionLocal, Sensor, ActivityLog
+from ingest import ingest_queue, IngestEvent
+from serialization import dumps, loads
 
 # Default to localhost if not specified
 MATTER_SERVER_URL = os.getenv("MATTER_SERVER_URL", "ws://localhost:5580/ws")
+MATTER_ENABLED = os.getenv("MATTER_ENABLED", "0") == "1"
+MATTER_RECONNECT_MAX_SECONDS = int(os.getenv("MATTER_RECONNECT_MAX_SECONDS", "60"))
+
+OCCUPANCY_CLUSTER = 0x0406
+OCCUPANCY_ATTRIBUTE = 0x0000
+# Attribute paths are "<endpoint>/<cluster>/<attribute>"; frames without this can't be occupancy updates
+OCCUPANCY_MARKER = f'/{OCCUPANCY_CLUSTER}/{OCCUPANCY_ATTRIBUTE}"'
+# Basic Information cluster: NodeLabel, then ProductName
+NAME_ATTRIBUTES = ("0/40/5", "0/40/3")
 
 logger = logging.getLogger(__name__)
 
 class MatterListener:
-    def __init__(self):
-        self.client = None
+    def __init__(self, url: str = MATTER_SERVER_URL, max_backoff: float = MATTER_RECONNECT_MAX_SECONDS):
+        self.url = url
+        self.max_backoff = max_backoff
         self.running = False
+        self.connected = False
+        self.last_error = None
+        self.node_names = {}
+        self._stop = None
+        self._task = None
+
+        # Stats exposed through /status
+        self.frames_received = 0
+        self.frames_failed = 0
+        self.events_queued = 0
+        self.reconnects = 0
+        self.last_event_at = None
 
     async def start(self):
+        """Start listening on the running event loop"""
+        if self.running:
+            return
         self.running = True
-        logger.info(f"Connecting to Matter Server at {MATTER_SERVER_URL}")
-        async with aiohttp.ClientSession() as session:
-            async with MatterClient(MATTER_SERVER_URL, session) as client:
-                self.client = client
-                # Subscribe to events
-                client.subscribe_events(self._on_event)
-                
-                # Keep running
-                while self.running:
-                    await asyncio.sleep(1)
-
-    def stop(self):
+        self._stop = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"Matter listener started for {self.url}")
+
+    async def stop(self):
+        """Close the connection and wait for the listener to exit"""
+        if not self.running:
+            return
+        self._stop.set()
+        await self._task
+        self._task = None
         self.running = False
+        logger.info("Matter listener stopped")
 
-    def _on_event(self, event: EventType, data: any = None):
-        # This is a simplified event handler. 
-        # In a real scenario, we need to inspect the event type and data structure carefully.
-        # For PIR sensors, we are looking for Occupancy attributes.
-        
-        logger.info(f"Received event: {event}, data: {data}")
-        
-        # We need to filter for attribute changes on nodes
-        if event == EventType.ATTRIBUTE_UPDATED:
-            self._handle_attribute_update(data)
-            
-    def _handle_attribute_update(self, data):
-        # Data structure depends on python-matter-server version
-        # Assuming data contains node_id, endpoint_id, cluster_id, attribute_id, value
-        
-        try:
-            node_id = data.node_id
-            endpoint_id = data.endpoint_id
-            cluster_id = data.cluster_id
-            attribute_id = data.attribute_id
-            value = data.value
-            
-            # Check for Occupancy Sensing Cluster (0x0406) and Occupancy Attribute (0x0000)
-            if cluster_id == 1030 and attribute_id == 0: # 1030 is 0x0406
-                self._log_activity(node_id, endpoint_id, value)
-                
-        except Exception as e:
-            logger.error(f"Error handling attribute update: {e}")
+    def stats(self):
+        return {
+            "running": self.running,
+            "connected": self.connected,
+            "url": self.url,
+            "error": self.last_error,
+            "frames_received": self.frames_received,
+            "frames_failed": self.frames_failed,
+            "events_queued": self.events_queued,
+            "reconnects": self.reconnects,
+            "last_event_at": self.last_event_at,
+        }
+
+    async def _run(self):
+        delay = 1
+        async with aiohttp.ClientSession() as session:
+            while not self._stop.is_set():
+                try:
+                    await self._listen(session)
+                except Exception as e:
+                    self.last_error = str(e) or type(e).__name__
+                    logger.warning(f"Matter server connection failed: {self.last_error}")
+                if self.connected:
+                    delay = 1  # The last attempt got through, so start backing off afresh
+                self.connected = False
+                if self._stop.is_set():
+                    break
+
+                wait = delay * random.uniform(0.5, 1.0)  # Jitter so restarts don't reconnect in step
+                logger.info(f"Reconnecting to Matter server in {wait:.1f}s")
+                try:
+                    await asyncio.wait_for(self._stop.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                delay = min(delay * 2, self.max_backoff)
+                self.reconnects += 1
+
+    async def _listen(self, session: aiohttp.ClientSession):
+        """One connection, until the server closes it or stop() is called"""
+        async with session.ws_connect(self.url, heartbeat=55, max_msg_size=0) as ws:
+            closer = asyncio.create_task(self._close_on_stop(ws))
+            try:
+                info = loads(await ws.receive_str())
+                logger.info(f"Connected to Matter server (SDK {info.get('sdk_version')}, schema {info.get('schema_version')})")
+                await ws.send_str(dumps({"message_id": "start_listening", "command": "start_listening"}).decode())
+                self.connected = True
+                self.last_error = None
+
+                async for message in ws:
+                    if message.type == aiohttp.WSMsgType.TEXT:
+                        self._on_frame(message.data)
+                    elif message.type == aiohttp.WSMsgType.ERROR:
+                        raise ws.exception() or ConnectionError("websocket error")
+            finally:
+                closer.cancel()
+        if not self._stop.is_set():
+            raise ConnectionError("Matter server closed the connection")
 
-    def _log_activity(self, node_id, endpoint_id, value):
-        db = SessionLocal()
+    async def _close_on_stop(self, ws):
+        await self._stop.wait()
+        await ws.close()
+
+    def _on_frame(self, raw: str):
+        self.frames_received += 1
+        if OCCUPANCY_MARKER not in raw:
+            return
+
+        # One malformed frame is skipped rather than tearing down the connection
         try:
-            unique_id = f"{node_id}-{endpoint_id}"
-            
-            # Find or create sensor
-            sensor = db.query(Sensor).filter(Sensor.unique_id == unique_id).first()
-            if not sensor:
-                sensor = Sensor(unique_id=unique_id, name=f"Sensor {unique_id}", type="PIR")
-                db.add(sensor)
-                db.commit()
-                db.refresh(sensor)
-            
-            # Log activity
-            # Value is likely a bitmap for Occupancy. 1 = Occupied.
-            status = "active" if value else "inactive"
-            
-            log = ActivityLog(sensor_id=sensor.id, value=status)
-            db.add(log)
-            db.commit()
-            logger.info(f"Logged activity for {unique_id}: {status}")
-            
+            message = loads(raw)
+            event = message.get("event")
+            if event == "attribute_updated":
+                node_id, attribute_path, value = message["data"]
+                endpoint_id, cluster_id, attribute_id = (int(part) for part in attribute_path.split("/"))
+                if cluster_id == OCCUPANCY_CLUSTER and attribute_id == OCCUPANCY_ATTRIBUTE:
+                    self._queue_occupancy(node_id, endpoint_id, value)
+            elif event in ("node_added", "node_updated"):
+                self._load_names([message["data"]])
+            elif message.get("message_id") == "start_listening" and "result" in message:
+                # The start_listening result is a dump of every node
+                self._load_names(message["result"])
         except Exception as e:
-            logger.error(f"Error logging activity: {e}")
-        finally:
-            db.close()
+            self.frames_failed += 1
+            logger.warning(f"Skipping malformed Matter frame ({type(e).__name__}: {e}): {raw[:200]}")
+
+    def _load_names(self, nodes):
+        for node in nodes:
+            attributes = node.get("attributes", {})
+            name = next((attributes[path] for path in NAME_ATTRIBUTES if attributes.get(path)), None)
+            if name:
+                self.node_names[node["node_id"]] = name
+
+    def _queue_occupancy(self, node_id: int, endpoint_id: int, value):
+        unique_id = f"{node_id}-{endpoint_id}"
+        # Occupancy is a bitmap; bit 0 is "occupied"
+        status = "active" if (value or 0) & 1 else "inactive"
+        ingest_queue.submit(IngestEvent(
+            unique_id=unique_id,
+            name=self.node_names.get(node_id) or f"Sensor {unique_id}",
+            value=status,
+            timestamp=datetime.utcnow()
+        ))
+        self.events_queued += 1
+        self.last_event_at = datetime.utcnow()
+        logger.debug(f"Queued activity for {unique_id}: {status}")
 
 matter_listener = MatterListener()
@@ -0,0 +1,54 @@
+"""
+Keyset pagination for activity_logs
+Pages are ordered newest first by (timestamp, id). The cursor is the last row's
+"<ISO timestamp>_<id>", so the next page is a range seek on the timestamp
+index however deep the client has paged, and clients streaming NDJSON can build
+it from the last row they received.
+"""
+from datetime import datetime
+from typing import Iterable, Optional, Tuple
+from sqlalchemy import select, tuple_
+from database import SessionLocal, ActivityLog
+from serialization import dumps
+
+STREAM_CHUNK_ROWS = 1000
+
+def encode_cursor(timestamp: datetime, log_id: int) -> str:
+    return f"{timestamp.isoformat()}_{log_id}"
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Raises ValueError for a malformed cursor"""
+    timestamp, _, log_id = cursor.rpartition("_")
+    return datetime.fromisoformat(timestamp), int(log_id)
+
+def logs_query(
+    cursor: Optional[str] = None,
+    sensor_ids: Optional[Iterable[int]] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+):
+    """SELECT for activity_logs rows after cursor, newest first, with every filter in SQL"""
+    stmt = select(ActivityLog.id, ActivityLog.sensor_id, ActivityLog.timestamp, ActivityLog.value)
+    if cursor:
+        timestamp, log_id = decode_cursor(cursor)
+        stmt = stmt.where(tuple_(ActivityLog.timestamp, ActivityLog.id) < (timestamp, log_id))
+    if sensor_ids is not None:
+        stmt = stmt.where(ActivityLog.sensor_id.in_(list(sensor_ids)))
+    if start is not None:
+        stmt = stmt.where(ActivityLog.timestamp >= start)
+    if end is not None:
+        stmt = stmt.where(ActivityLog.timestamp < end)
+    return stmt.order_by(ActivityLog.timestamp.desc(), ActivityLog.id.desc())
+
+def stream_ndjson(stmt):
+    """Yield rows as NDJSON lines straight off the cursor, in a session of its own"""
+    db = SessionLocal()
+    try:
+        result = db.execute(stmt.execution_options(yield_per=STREAM_CHUNK_ROWS))
+        for rows in result.partitions():
+            yield b"".join(
+                dumps({"id": r.id, "sensor_id": r.sensor_id, "timestamp": r.timestamp, "value": r.value}) + b"\n"
+                for r in rows
+            )
+    finally:
+        db.close()
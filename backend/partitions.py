@@ -0,0 +1,473 @@
+"""
+Monthly archive partitions for raw activity events
+Once every event in a calendar month is older than RETENTION_DAYS, the month's
+raw activity_logs rows are moved into their own SQLite file under ARCHIVE_DIR
+and gzip-compressed (activity_YYYY_MM.db.gz). The hourly_activity rollup keeps
+its aggregates for those hours, so the analyzer and the hourly heatmap are
+unaffected; quarter-hour heatmap buckets (for zones offset from UTC by 30 or 45
+minutes) read the archives through archived_bucket_counts(). The hot table
+stays a constant size as the deployment ages.
+
+Each partition records the event encoding its rows are stored in (see
+EVENT_ENCODING in database.py) and keeps it when late events are appended
+after a compact_events.py conversion, so archives are always decoded the way
+they were written. Range queries only open the archive files for the months
+they cover, and keep the last ARCHIVE_CACHE_MONTHS of them decompressed for
+later queries. Run this module directly to apply the retention policy
+immediately:
+
+    python partitions.py                     # uses RETENTION_DAYS
+    python partitions.py --retention-days 90
+"""
+import argparse
+import asyncio
+import atexit
+import gzip
+import logging
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Iterable, Optional
+from sqlalchemy import create_engine, delete, func, select, true, Column, DateTime, Integer, MetaData, String, Table
+from database import SessionLocal, engine, ActivityLog, EpochSeconds, StateCode, STATE_CODES, event_encoding, event_time_param
+from compact_events import LAYOUTS
+from broadcaster import broadcaster
+from response_cache import table_versions
+from rollup import remove_activity
+
+# 0 keeps raw events in the main database forever
+RETENTION_DAYS = int(os.getenv("RETENTION_DAYS", "0"))
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "./archive")
+# Decompressed partitions kept on disk for repeated /logs/history queries
+ARCHIVE_CACHE_MONTHS = int(os.getenv("ARCHIVE_CACHE_MONTHS", "12"))
+
+PARTITION_PATTERN = re.compile(r"^activity_(\d{4})_(\d{2})\.db\.gz$")
+
+# Serialises rewrites of an archive file (retention appending, purges deleting)
+_archive_lock = threading.Lock()
+
+logger = logging.getLogger(__name__)
+
+def month_start(value: datetime) -> datetime:
+    return datetime(value.year, value.month, 1)
+
+def next_month(value: datetime) -> datetime:
+    return datetime(value.year + value.month // 12, value.month % 12 + 1, 1)
+
+def partition_path(month: datetime) -> str:
+    return os.path.join(ARCHIVE_DIR, f"activity_{month:%Y_%m}.db.gz")
+
+def list_partitions():
+    """Archived months, oldest first"""
+    if not os.path.isdir(ARCHIVE_DIR):
+        return []
+    partitions = []
+    for name in sorted(os.listdir(ARCHIVE_DIR)):
+        match = PARTITION_PATTERN.match(name)
+        if match:
+            path = os.path.join(ARCHIVE_DIR, name)
+            partitions.append({
+                "month": f"{match.group(1)}-{match.group(2)}",
+                "file": name,
+                "size_bytes": os.path.getsize(path),
+            })
+    return partitions
+
+async def retention_loop(interval_hours: int = 24):
+    """Apply the retention policy periodically, off the event loop"""
+    while True:
+        try:
+            await asyncio.to_thread(apply_retention)
+        except Exception as e:
+            logger.error(f"Error applying retention policy: {e}")
+        await asyncio.sleep(interval_hours * 3600)
+
+def apply_retention(retention_days: int = RETENTION_DAYS):
+    """Archive every whole month of raw events older than retention_days"""
+    if retention_days <= 0:
+        return {"message": "Retention disabled", "months_archived": [], "events_archived": 0}
+
+    cutoff = month_start(datetime.utcnow() - timedelta(days=retention_days))
+    db = SessionLocal()
+    try:
+        oldest = db.query(func.min(ActivityLog.timestamp)).scalar()
+    finally:
+        db.close()
+
+    archived = []
+    total = 0
+    month = month_start(oldest) if oldest else cutoff
+    while month < cutoff:
+        moved = _archive_month(month)
+        if moved:
+            archived.append(f"{month:%Y-%m}")
+            total += moved
+        month = next_month(month)
+
+    if archived:
+        table_versions.bump("activity_logs")
+        broadcaster.publish("changed")
+        logger.info(f"Retention: archived {total} events from {', '.join(archived)}")
+    return {"message": "Retention applied", "months_archived": archived, "events_archived": total}
+
+def _archive_month(month: datetime) -> int:
+    """Move one month of raw events into its compressed partition. Returns rows moved."""
+    start, end = event_time_param(month), event_time_param(next_month(month))
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    archive = partition_path(month)
+
+    with _archive_lock, tempfile.TemporaryDirectory(dir=ARCHIVE_DIR) as work_dir:
+        partition_file = os.path.join(work_dir, "partition.db")
+        # Late events for an archived month are appended to the existing partition
+        if os.path.exists(archive):
+            _decompress(archive, partition_file)
+
+        conn = sqlite3.connect(engine.url.database, isolation_level=None, timeout=30)
+        try:
+            conn.execute("ATTACH DATABASE ? AS part", (partition_file,))
+
+            # Copy first, and only delete hot rows once the compressed archive is on
+            # disk. A crash in between leaves rows in both places, never in neither.
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("CREATE TABLE IF NOT EXISTS part.activity_logs AS SELECT * FROM main.activity_logs WHERE 0")
+            # Rows are matched on id, sensor and time: SQLite reuses the ids of
+            # archived rows once the hot table has been emptied
+            conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS part.ux_partition_row ON activity_logs (id, sensor_id, timestamp)")
+            conn.execute("CREATE INDEX IF NOT EXISTS part.ix_partition_sensor_timestamp ON activity_logs (sensor_id, timestamp)")
+            # Rows appended after an encoding conversion are converted back to the partition's encoding
+            timestamp_sql, value_sql = _stored_as(_partition_encoding(conn, "part"), "main.activity_logs")
+            copied = conn.execute(
+                f"""
+                INSERT OR IGNORE INTO part.activity_logs (id, sensor_id, timestamp, value, event_key)
+                SELECT id, sensor_id, {timestamp_sql}, {value_sql}, event_key FROM main.activity_logs WHERE timestamp >= ? AND timestamp < ?
+                """,
+                (start, end)
+            ).rowcount
+            conn.execute("COMMIT")
+            if copied:
+                _compress(partition_file, archive)
+
+            conn.execute("BEGIN IMMEDIATE")
+            moved = conn.execute(
+                f"""
+                DELETE FROM main.activity_logs WHERE timestamp >= ? AND timestamp < ? AND EXISTS (
+                    SELECT 1 FROM part.activity_logs AS archived
+                    WHERE archived.id = main.activity_logs.id
+                    AND archived.sensor_id IS main.activity_logs.sensor_id
+                    AND archived.timestamp = {timestamp_sql}
+                )
+                """,
+                (start, end)
+            ).rowcount
+            if moved:
+                # Raw events have no change_log triggers, so record the move itself:
+                # /sync sends a full snapshot to any client still holding these rows
+                conn.execute(
+                    "INSERT INTO main.change_log (table_name, row_id, op, changed_at) VALUES ('activity_logs', 0, 'delete', datetime('now'))"
+                )
+            conn.execute("COMMIT")
+            conn.execute("DETACH DATABASE part")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+        return moved
+
+def delete_archived_events(
+    sensor_ids: Optional[Iterable[int]] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    global_only: bool = False,
+) -> int:
+    """
+    Delete archived events matching every given filter (sensor_ids, a [start, end)
+    range, or rows without a sensor) from the partitions of the months they could
+    be in, and take them out of the hourly rollup. A partition left empty is
+    removed. Returns the number of events deleted.
+    """
+    sensor_ids = None if sensor_ids is None else list(sensor_ids)
+    total = 0
+    for partition in list_partitions():
+        month = datetime.strptime(partition["month"], "%Y-%m")
+        if (start is not None and next_month(month) <= start) or (end is not None and month >= end):
+            continue
+        archive = os.path.join(ARCHIVE_DIR, partition["file"])
+
+        with _archive_lock, tempfile.TemporaryDirectory(dir=ARCHIVE_DIR) as work_dir:
+            partition_file = os.path.join(work_dir, "partition.db")
+            _decompress(archive, partition_file)
+            conn = sqlite3.connect(partition_file, isolation_level=None)
+            try:
+                table = ARCHIVE_TABLES[_partition_encoding(conn)]
+            finally:
+                conn.close()
+
+            condition = true()
+            if sensor_ids is not None:
+                condition &= table.c.sensor_id.in_(sensor_ids)
+            if global_only:
+                condition &= table.c.sensor_id.is_(None)
+            if start is not None:
+                condition &= table.c.timestamp >= start
+            if end is not None:
+                condition &= table.c.timestamp < end
+
+            partition_engine = create_engine(f"sqlite:///{partition_file}")
+            try:
+                with partition_engine.begin() as conn:
+                    events = conn.execute(
+                        delete(table).where(condition).returning(table.c.sensor_id, table.c.timestamp, table.c.value)
+                    ).all()
+                    remaining = conn.execute(select(func.count()).select_from(table)).scalar()
+            finally:
+                partition_engine.dispose()
+            if not events:
+                continue
+
+            if remaining:
+                _compress(partition_file, archive)
+            else:
+                os.remove(archive)
+
+        db = SessionLocal()
+        try:
+            remove_activity(db, [tuple(event) for event in events if event.sensor_id is not None])
+            db.commit()
+        finally:
+            db.close()
+        total += len(events)
+        logger.info(f"Deleted {len(events)} archived events from {partition['month']}")
+    return total
+
+def _stored_as(encoding: str, table: str):
+    """SQL for a hot table's timestamp and value columns as stored in a partition of the given encoding"""
+    if encoding == event_encoding():
+        return f"{table}.timestamp", f"{table}.value"
+    layout = LAYOUTS[encoding]
+    return layout["timestamp_sql"].format(column=f"{table}.timestamp"), layout["value_sql"].format(column=f"{table}.value")
+
+def _partition_encoding(conn: sqlite3.Connection, schema: str = "main") -> str:
+    """
+    The event encoding recorded in a partition. Partitions written before it was
+    recorded get it from their stored rows (or, if empty, the current encoding).
+    """
+    conn.execute(f"CREATE TABLE IF NOT EXISTS {schema}.partition_info (key TEXT PRIMARY KEY, value TEXT)")
+    row = conn.execute(f"SELECT value FROM {schema}.partition_info WHERE key = 'encoding'").fetchone()
+    if row:
+        return row[0]
+    stored = conn.execute(f"SELECT typeof(timestamp) FROM {schema}.activity_logs WHERE timestamp IS NOT NULL LIMIT 1").fetchone()
+    encoding = event_encoding() if stored is None else ("compact" if stored[0] == "integer" else "text")
+    conn.execute(f"INSERT INTO {schema}.partition_info (key, value) VALUES ('encoding', ?)", (encoding,))
+    return encoding
+
+def _archive_table(encoding: str) -> Table:
+    """activity_logs as stored in a partition of the given encoding"""
+    time_type, state_type = (EpochSeconds, StateCode) if encoding == "compact" else (DateTime, String)
+    return Table(
+        "activity_logs", MetaData(),
+        Column("id", Integer, primary_key=True),
+        Column("sensor_id", Integer),
+        Column("timestamp", time_type),
+        Column("value", state_type),
+        Column("event_key", String),
+    )
+
+ARCHIVE_TABLES = {encoding: _archive_table(encoding) for encoding in LAYOUTS}
+
+class _PartitionCache:
+    """
+    Decompressed partitions, most recently used last. An entry is reused until
+    its archive file changes (e.g. late events were appended).
+    """
+
+    def __init__(self, max_months: int = ARCHIVE_CACHE_MONTHS):
+        self.max_months = max_months
+        self.entries = OrderedDict()  # archive path -> (file stat, decompressed path, encoding)
+        self.work_dir = None
+        self._lock = threading.Lock()
+
+    def open(self, archive: str):
+        """(decompressed file path, encoding) for an archive"""
+        stat = os.stat(archive)
+        version = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            entry = self.entries.get(archive)
+            if entry and entry[0] == version:
+                self.entries.move_to_end(archive)
+                return entry[1], entry[2]
+
+            if self.work_dir is None:
+                self.work_dir = tempfile.mkdtemp(prefix="movementmapper-archive-")
+                atexit.register(shutil.rmtree, self.work_dir, True)
+            partition_file = os.path.join(self.work_dir, f"{os.path.basename(archive)}.{version[0]}.db")
+            _decompress(archive, partition_file)
+            conn = sqlite3.connect(partition_file, isolation_level=None)
+            try:
+                encoding = _partition_encoding(conn)
+            finally:
+                conn.close()
+
+            if entry:
+                self._remove(entry[1])
+            self.entries[archive] = (version, partition_file, encoding)
+            self.entries.move_to_end(archive)
+            while len(self.entries) > max(self.max_months, 1):
+                _, (_, evicted, _) = self.entries.popitem(last=False)
+                self._remove(evicted)
+            return partition_file, encoding
+
+    def _remove(self, path: str):
+        # Readers that already opened the file keep it until they finish
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+partition_cache = _PartitionCache()
+
+def query_archived_events(start: datetime, end: datetime, sensor_ids: Optional[Iterable[int]] = None, event_keys: bool = False):
+    """
+    Archived events in [start, end), oldest first, as dicts shaped like /logs rows
+    (plus event_key when event_keys is set). Only the partitions for months
+    overlapping the range are opened.
+    """
+    sensor_ids = None if sensor_ids is None else list(sensor_ids)
+    month = month_start(start)
+    while month < end:
+        archive = partition_path(month)
+        if os.path.exists(archive):
+            partition_file, encoding = partition_cache.open(archive)
+            table = ARCHIVE_TABLES[encoding]
+            stmt = select(table.c.id, table.c.sensor_id, table.c.timestamp, table.c.value, table.c.event_key).where(
+                table.c.timestamp >= start, table.c.timestamp < end
+            ).order_by(table.c.timestamp, table.c.id)
+            if sensor_ids is not None:
+                stmt = stmt.where(table.c.sensor_id.in_(sensor_ids))
+
+            partition_engine = create_engine(f"sqlite:///{partition_file}")
+            try:
+                with partition_engine.connect() as conn:
+                    for row in conn.execute(stmt):
+                        event = {"id": row.id, "sensor_id": row.sensor_id, "timestamp": row.timestamp, "value": row.value}
+                        if event_keys:
+                            event["event_key"] = row.event_key
+                        yield event
+            finally:
+                partition_engine.dispose()
+        month = next_month(month)
+
+def archived_hourly_counts():
+    """
+    (sensor_id, hour_bucket, event_count, active_count) rollup rows for every
+    archived month, one list per partition. Rows that are also still in the hot
+    table (a retention run interrupted between copy and delete) are left out, as
+    they are counted from there.
+    """
+    for partition in list_partitions():
+        partition_file, encoding = partition_cache.open(os.path.join(ARCHIVE_DIR, partition["file"]))
+        timestamp_sql, _ = _stored_as(encoding, "hot")
+        if encoding == "compact":
+            bucket_sql, active = "strftime('%Y-%m-%d %H:00:00', archived.timestamp, 'unixepoch')", STATE_CODES["active"]
+        else:
+            bucket_sql, active = "strftime('%Y-%m-%d %H:00:00', archived.timestamp)", "active"
+
+        conn = sqlite3.connect(engine.url.database, timeout=30)
+        try:
+            conn.execute("ATTACH DATABASE ? AS part", (partition_file,))
+            rows = conn.execute(
+                f"""
+                SELECT archived.sensor_id, {bucket_sql}, COUNT(*), SUM(CASE WHEN archived.value = ? THEN 1 ELSE 0 END)
+                FROM part.activity_logs AS archived
+                WHERE archived.sensor_id IS NOT NULL AND archived.timestamp IS NOT NULL AND NOT EXISTS (
+                    SELECT 1 FROM main.activity_logs AS hot
+                    WHERE hot.id = archived.id AND hot.sensor_id IS archived.sensor_id AND {timestamp_sql} = archived.timestamp
+                )
+                GROUP BY 1, 2
+                """,
+                (active,)
+            ).fetchall()
+        finally:
+            conn.close()
+        yield [(sensor_id, datetime.fromisoformat(bucket), total, active_count) for sensor_id, bucket, total, active_count in rows]
+
+def _time_param(encoding: str, value: datetime):
+    """A datetime as stored in a partition of the given encoding, for raw DB-API statements"""
+    time_type = ARCHIVE_TABLES[encoding].c.timestamp.type
+    processor = time_type.dialect_impl(engine.dialect).bind_processor(engine.dialect)
+    return processor(value) if processor else value
+
+def archived_bucket_counts(start: datetime, end: datetime, sensor_ids: Optional[Iterable[int]] = None, bucket_minutes: int = 15):
+    """
+    (sensor_id, bucket_start, active_count) for archived events in [start, end),
+    grouped into UTC buckets of bucket_minutes. Only the partitions for months
+    overlapping the range are opened, and rows still in the hot table are left
+    out as in archived_hourly_counts().
+    """
+    sensor_ids = None if sensor_ids is None else list(sensor_ids)
+    seconds = bucket_minutes * 60
+    month = month_start(start)
+    while month < end:
+        archive = partition_path(month)
+        month = next_month(month)
+        if not os.path.exists(archive):
+            continue
+        partition_file, encoding = partition_cache.open(archive)
+        timestamp_sql, _ = _stored_as(encoding, "hot")
+        if encoding == "compact":
+            epoch_sql, active = "archived.timestamp", STATE_CODES["active"]
+        else:
+            epoch_sql, active = "CAST(strftime('%s', archived.timestamp) AS INTEGER)", "active"
+        params = [seconds, active, _time_param(encoding, start), _time_param(encoding, end)]
+        sensor_sql = ""
+        if sensor_ids is not None:
+            sensor_sql = f"AND archived.sensor_id IN ({', '.join('?' * len(sensor_ids))})"
+            params.extend(sensor_ids)
+
+        conn = sqlite3.connect(engine.url.database, timeout=30)
+        try:
+            conn.execute("ATTACH DATABASE ? AS part", (partition_file,))
+            rows = conn.execute(
+                f"""
+                SELECT archived.sensor_id, datetime({epoch_sql} - {epoch_sql} % ?, 'unixepoch'), COUNT(*)
+                FROM part.activity_logs AS archived
+                WHERE archived.value = ? AND archived.timestamp >= ? AND archived.timestamp < ? {sensor_sql}
+                AND NOT EXISTS (
+                    SELECT 1 FROM main.activity_logs AS hot
+                    WHERE hot.id = archived.id AND hot.sensor_id IS archived.sensor_id AND {timestamp_sql} = archived.timestamp
+                )
+                GROUP BY 1, 2
+                """,
+                params
+            ).fetchall()
+        finally:
+            conn.close()
+        for sensor_id, bucket, count in rows:
+            yield sensor_id, datetime.fromisoformat(bucket), count
+
+def _compress(source: str, target: str):
+    partial = target + ".partial"
+    with open(source, "rb") as src, gzip.open(partial, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    os.replace(partial, target)
+
+def _decompress(source: str, target: str):
+    with gzip.open(source, "rb") as src, open(target, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Archive raw events older than the retention window")
+    parser.add_argument("--retention-days", type=int, default=RETENTION_DAYS, help=f"Keep this many days of raw events in the main database (default {RETENTION_DAYS})")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    from database import init_db
+    init_db()
+    logger.info(apply_retention(args.retention_days))
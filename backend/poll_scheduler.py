@@ -0,0 +1,203 @@
+"""
+Adaptive polling for hub sources
+A PollScheduler picks the delay before the next poll: TAPO_POLL_MIN_SECONDS
+while there has been motion in the last TAPO_POLL_HOT_SECONDS or during hours
+of the week that are usually busy, otherwise growing by half each quiet poll up
+to TAPO_POLL_MAX_SECONDS; and doubling on consecutive errors up to
+TAPO_POLL_ERROR_MAX_SECONDS. Every delay gets +/- TAPO_POLL_JITTER so several
+hubs don't fall into step.
+
+Busy hours come from the hourly rollup (see busy_hours()), so the slow cadence
+is only used when motion is unlikely, e.g. at 4 a.m., and the first trigger of
+a normal day is seen as quickly as with a fixed interval.
+
+Each hub also has a HubRateLimiter shared by all requests to it (polling,
+manual refreshes and backfills), so no combination of callers exceeds
+TAPO_HUB_MAX_RPS.
+"""
+import asyncio
+import os
+import random
+import time
+from bisect import bisect_left
+from datetime import datetime, timedelta
+from typing import Iterable, Optional, Set, Tuple
+from sqlalchemy import func
+from database import SessionLocal, HourlyActivity, Sensor
+
+TAPO_POLL_MIN_SECONDS = float(os.getenv("TAPO_POLL_MIN_SECONDS", "2"))
+TAPO_POLL_MAX_SECONDS = float(os.getenv("TAPO_POLL_MAX_SECONDS", "5"))
+TAPO_POLL_HOT_SECONDS = float(os.getenv("TAPO_POLL_HOT_SECONDS", "120"))
+TAPO_POLL_ERROR_MAX_SECONDS = float(os.getenv("TAPO_POLL_ERROR_MAX_SECONDS", "60"))
+TAPO_POLL_JITTER = float(os.getenv("TAPO_POLL_JITTER", "0.1"))
+# Hours of the week averaging at least this many events across a hub's sensors keep the fast cadence
+TAPO_POLL_BUSY_EVENTS = float(os.getenv("TAPO_POLL_BUSY_EVENTS", "1"))
+TAPO_HUB_MAX_RPS = float(os.getenv("TAPO_HUB_MAX_RPS", "10"))
+
+IDLE_GROWTH = 1.5
+BUSY_HOURS_WEEKS = 4
+# Upper bounds of the poll latency histogram buckets, in milliseconds
+LATENCY_BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000)
+
+class LatencyHistogram:
+    def __init__(self, bounds=LATENCY_BUCKETS_MS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total_ms = 0.0
+        self.max_ms = None
+        self.last_ms = None
+
+    def observe(self, ms: float):
+        self.counts[bisect_left(self.bounds, ms)] += 1
+        self.total_ms += ms
+        self.max_ms = ms if self.max_ms is None else max(self.max_ms, ms)
+        self.last_ms = ms
+
+    def stats(self):
+        samples = sum(self.counts)
+        labels = [f"<={bound}ms" for bound in self.bounds] + [f">{self.bounds[-1]}ms"]
+        return {
+            "samples": samples,
+            "avg_ms": round(self.total_ms / samples, 1) if samples else None,
+            "max_ms": round(self.max_ms, 1) if self.max_ms is not None else None,
+            "last_ms": round(self.last_ms, 1) if self.last_ms is not None else None,
+            "buckets": dict(zip(labels, self.counts)),
+        }
+
+class PollScheduler:
+    def __init__(
+        self,
+        min_interval: float = TAPO_POLL_MIN_SECONDS,
+        max_interval: float = TAPO_POLL_MAX_SECONDS,
+        hot_seconds: float = TAPO_POLL_HOT_SECONDS,
+        error_max_interval: float = TAPO_POLL_ERROR_MAX_SECONDS,
+        jitter: float = TAPO_POLL_JITTER,
+    ):
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval, min_interval)
+        self.hot_seconds = hot_seconds
+        self.error_max_interval = max(error_max_interval, self.max_interval)
+        self.jitter = jitter
+        self.interval = min_interval
+        self.last_motion = None  # time.monotonic() of the last poll that saw motion
+        self.last_motion_at = None
+        self.busy_hours = set()  # (weekday, hour) in UTC, 0=Monday
+        self.consecutive_errors = 0
+        self.latency = LatencyHistogram()
+
+        # Stats exposed through /status
+        self.polls = 0
+        self.errors = 0
+
+    def record_success(self, latency_ms: float, motion: bool):
+        """A poll completed; motion is whether any sensor reported or changed to detected"""
+        self.polls += 1
+        self.latency.observe(latency_ms)
+        self.consecutive_errors = 0
+        now = time.monotonic()
+        if motion:
+            self.last_motion = now
+            self.last_motion_at = datetime.utcnow()
+        if self._hot(now):
+            self.interval = self.min_interval
+        else:
+            self.interval = min(max(self.interval, self.min_interval) * IDLE_GROWTH, self.max_interval)
+
+    def record_error(self, latency_ms: float):
+        self.polls += 1
+        self.errors += 1
+        self.latency.observe(latency_ms)
+        self.consecutive_errors += 1
+        self.interval = min(max(self.interval, self.min_interval) * 2, self.error_max_interval)
+
+    def next_delay(self) -> float:
+        """Seconds to wait before the next poll, jittered"""
+        return self.interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def set_busy_hours(self, hours: Iterable[Tuple[int, int]]):
+        self.busy_hours = set(hours)
+
+    def mode(self) -> str:
+        if self.consecutive_errors:
+            return "backoff"
+        if self.last_motion is not None and time.monotonic() - self.last_motion < self.hot_seconds:
+            return "active"
+        return "busy_hour" if self._busy_now() else "idle"
+
+    def stats(self):
+        return {
+            "mode": self.mode(),
+            "interval_seconds": round(self.interval, 2),
+            "polls": self.polls,
+            "errors": self.errors,
+            "consecutive_errors": self.consecutive_errors,
+            "last_motion_at": self.last_motion_at,
+            "busy_hours": len(self.busy_hours),
+            "latency": self.latency.stats(),
+        }
+
+    def _hot(self, now: float) -> bool:
+        return (self.last_motion is not None and now - self.last_motion < self.hot_seconds) or self._busy_now()
+
+    def _busy_now(self) -> bool:
+        now = datetime.utcnow()
+        return (now.weekday(), now.hour) in self.busy_hours
+
+def busy_hours(unique_ids: Iterable[str], min_events: float = TAPO_POLL_BUSY_EVENTS, weeks: int = BUSY_HOURS_WEEKS) -> Set[Tuple[int, int]]:
+    """
+    (weekday, hour) pairs, in UTC, whose average event count over the last weeks
+    across the given sensors (e.g. one hub's) is at least min_events
+    """
+    unique_ids = list(unique_ids)
+    if not unique_ids:
+        return set()
+    since = datetime.utcnow() - timedelta(weeks=weeks)
+    weekday = func.strftime("%w", HourlyActivity.hour_bucket)  # 0=Sunday
+    hour = func.strftime("%H", HourlyActivity.hour_bucket)
+    db = SessionLocal()
+    try:
+        rows = db.query(weekday, hour, func.sum(HourlyActivity.event_count)) \
+            .join(Sensor, Sensor.id == HourlyActivity.sensor_id) \
+            .filter(Sensor.unique_id.in_(unique_ids), HourlyActivity.hour_bucket >= since) \
+            .group_by(weekday, hour).all()
+    finally:
+        db.close()
+    return {((int(day) - 1) % 7, int(hr)) for day, hr, events in rows if events / weeks >= min_events}
+
+class HubRateLimiter:
+    """Token bucket allowing rate requests per second, in bursts of up to rate"""
+
+    def __init__(self, rate: float = TAPO_HUB_MAX_RPS):
+        self.rate = rate
+        self.tokens = max(rate, 1)
+        self.updated = time.monotonic()
+        self.waited_seconds = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            self._refill()
+            if self.tokens < 1:
+                wait = (1 - self.tokens) / self.rate
+                self.waited_seconds += wait
+                await asyncio.sleep(wait)
+                self._refill()
+            self.tokens -= 1
+
+    def stats(self):
+        return {"max_rps": self.rate, "waited_seconds": round(self.waited_seconds, 2)}
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(max(self.rate, 1), self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+_rate_limiters = {}
+
+def hub_rate_limiter(hub: str, rate: Optional[float] = None) -> HubRateLimiter:
+    """The shared limiter for one hub address"""
+    if hub not in _rate_limiters:
+        _rate_limiters[hub] = HubRateLimiter(TAPO_HUB_MAX_RPS if rate is None else rate)
+    return _rate_limiters[hub]
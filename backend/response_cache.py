@@ -0,0 +1,106 @@
+"""
+Conditional GET support for read endpoints
+Each table has an in-process version, bumped by the write paths (ingest,
+backfill, adjustments, sensor updates, analysis, demo data). A response's ETag
+is derived from the versions of the tables it reads plus its query string, so
+an unchanged poll is answered with 304 - or, without If-None-Match, straight
+from the cached body - without touching the database.
+
+Writes made by other processes (e.g. running analyzer.py from the shell) don't
+bump versions, so every ETag also rolls over each RESPONSE_CACHE_TTL seconds,
+and Last-Modified is never earlier than the start of the current TTL period.
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Callable, Iterable
+from fastapi import Request, Response
+from serialization import dumps
+
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", "60"))
+RESPONSE_CACHE_ENTRIES = 64
+
+class TableVersions:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versions = {}
+        self._modified = {}
+        self._started = datetime.now(timezone.utc).replace(microsecond=0)
+        self.epoch = f"{int(time.time()):x}"  # ETags from a previous run never match
+
+    def bump(self, *tables: str):
+        now = datetime.now(timezone.utc).replace(microsecond=0)
+        with self._lock:
+            for table in tables:
+                self._versions[table] = self._versions.get(table, 0) + 1
+                self._modified[table] = now
+
+    def version(self, tables: Iterable[str]) -> str:
+        with self._lock:
+            return ".".join(str(self._versions.get(table, 0)) for table in tables)
+
+    def last_modified(self, tables: Iterable[str]) -> datetime:
+        with self._lock:
+            return max([self._modified.get(table, self._started) for table in tables])
+
+table_versions = TableVersions()
+
+class ResponseCache:
+    def __init__(self, versions: TableVersions, max_entries: int = RESPONSE_CACHE_ENTRIES):
+        self.versions = versions
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # etag -> (body, headers)
+        self._lock = threading.Lock()
+
+    def respond(self, request: Request, tables: Iterable[str], build: Callable):
+        """
+        Serve the response for request from its ETag if possible. build() returns
+        the payload, or (payload, extra headers), and only runs on a miss.
+        """
+        tables = tuple(tables)
+        bucket = int(time.time() // RESPONSE_CACHE_TTL) if RESPONSE_CACHE_TTL > 0 else 0
+        query = hashlib.blake2b(f"{request.url.path}?{request.url.query}".encode(), digest_size=8).hexdigest()
+        etag = f'W/"{self.versions.epoch}-{bucket}-{self.versions.version(tables)}-{query}"'
+        last_modified = self.versions.last_modified(tables)
+        if RESPONSE_CACHE_TTL > 0:
+            # If-Modified-Since must expire with the TTL period, like the ETag
+            last_modified = max(last_modified, datetime.fromtimestamp(bucket * RESPONSE_CACHE_TTL, timezone.utc))
+        headers = {"ETag": etag, "Last-Modified": format_datetime(last_modified, usegmt=True), "Cache-Control": "no-cache"}
+
+        if self._not_modified(request, etag, last_modified):
+            return Response(status_code=304, headers=headers)
+
+        with self._lock:
+            entry = self._entries.get(etag)
+            if entry:
+                self._entries.move_to_end(etag)
+        if entry is None:
+            result = build()
+            payload, extra_headers = result if isinstance(result, tuple) else (result, {})
+            entry = (dumps(payload), extra_headers)
+            with self._lock:
+                self._entries[etag] = entry
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+
+        body, extra_headers = entry
+        return Response(content=body, media_type="application/json", headers={**headers, **extra_headers})
+
+    def _not_modified(self, request: Request, etag: str, last_modified: datetime) -> bool:
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match is not None:
+            # If-None-Match takes precedence over If-Modified-Since (RFC 9110)
+            return etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*"
+        if_modified_since = request.headers.get("if-modified-since")
+        if if_modified_since:
+            try:
+                return last_modified <= parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError):
+                return False
+        return False
+
+response_cache = ResponseCache(table_versions)
@@ -0,0 +1,165 @@
+"""
+Hourly activity rollup
+Maintains hourly_activity, a per-sensor, per-hour count of activity_logs rows.
+
+Writers call record_activity() inside the same session that inserts the raw
+ActivityLog rows so the rollup commits atomically with them. Every bucket
+written is also queued in rollup_changes for the incremental analyzer, so late
+and corrected hours are re-scored. Run this module
+directly to rebuild the rollup from the raw table and the archived months (see
+partitions.py):
+
+    python rollup.py
+"""
+import logging
+from collections import defaultdict
+from datetime import datetime
+from typing import Iterable, Tuple
+from sqlalchemy import bindparam, case, delete, func, literal, select, true
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+from database import SessionLocal, ActivityLog, HourlyActivity, RollupChange, event_time_sql
+
+logger = logging.getLogger(__name__)
+
+# Matches the way SQLAlchemy stores DateTime values in SQLite, so buckets written
+# by record_activity() and by rebuild_hourly_activity() compare equal
+HOUR_BUCKET_FORMAT = "%Y-%m-%d %H:00:00.000000"
+
+def hour_bucket(timestamp: datetime) -> datetime:
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+def record_activity(db: Session, events: Iterable[Tuple[int, datetime, str]]):
+    """
+    Add (sensor_id, timestamp, value) events to the rollup.
+
+    Events are pre-aggregated per bucket so a batch costs one upsert per touched
+    hour. The caller is responsible for committing.
+    """
+    record_hourly_counts(db, [
+        (sensor_id, bucket, total, active)
+        for (sensor_id, bucket), (total, active) in _count_by_hour(events).items()
+    ])
+
+def remove_activity(db: Session, events: Iterable[Tuple[int, datetime, str]]):
+    """
+    Take deleted (sensor_id, timestamp, value) events back out of the rollup,
+    dropping buckets left empty. The caller is responsible for committing.
+    """
+    counts = _count_by_hour(events)
+    record_hourly_counts(db, [
+        (sensor_id, bucket, -total, -active)
+        for (sensor_id, bucket), (total, active) in counts.items()
+    ])
+    if counts:
+        table = HourlyActivity.__table__
+        db.execute(
+            delete(table).where(
+                table.c.sensor_id == bindparam("b_sensor_id"),
+                table.c.hour_bucket == bindparam("b_hour_bucket"),
+                table.c.event_count <= 0,
+            ),
+            [{"b_sensor_id": sensor_id, "b_hour_bucket": bucket} for sensor_id, bucket in counts],
+        )
+
+def _count_by_hour(events: Iterable[Tuple[int, datetime, str]]):
+    counts = defaultdict(lambda: [0, 0])
+    for sensor_id, timestamp, value in events:
+        bucket = counts[(sensor_id, hour_bucket(timestamp))]
+        bucket[0] += 1
+        if value == "active":
+            bucket[1] += 1
+    return counts
+
+def record_hourly_counts(db: Session, buckets: Iterable[Tuple[int, datetime, int, int]]):
+    """
+    Add pre-aggregated (sensor_id, hour_bucket, event_count, active_count) rows
+    to the rollup. The caller is responsible for committing.
+    """
+    rows = [
+        {"sensor_id": sensor_id, "hour_bucket": bucket, "event_count": total, "active_count": active}
+        for sensor_id, bucket, total, active in buckets
+    ]
+    if not rows:
+        return
+
+    stmt = insert(HourlyActivity)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[HourlyActivity.sensor_id, HourlyActivity.hour_bucket],
+        set_={
+            "event_count": HourlyActivity.event_count + stmt.excluded.event_count,
+            "active_count": HourlyActivity.active_count + stmt.excluded.active_count,
+        },
+    )
+    db.execute(stmt, rows)
+    db.execute(_queue_changes(insert(RollupChange)), [
+        {"sensor_id": row["sensor_id"], "hour_bucket": row["hour_bucket"], "version": 0} for row in rows
+    ])
+
+def _queue_changes(stmt):
+    return stmt.on_conflict_do_update(
+        index_elements=[RollupChange.sensor_id, RollupChange.hour_bucket],
+        set_={"version": RollupChange.version + 1},
+    )
+
+def _queue_all_buckets(db: Session):
+    """Queue every bucket currently in the rollup for the analyzer"""
+    # WHERE true keeps SQLite from reading ON CONFLICT as part of the SELECT's join
+    db.execute(_queue_changes(
+        insert(RollupChange).from_select(
+            ["sensor_id", "hour_bucket", "version"],
+            select(HourlyActivity.sensor_id, HourlyActivity.hour_bucket, literal(0)).where(true())
+        )
+    ))
+
+def rebuild_hourly_activity(db: Session = None) -> int:
+    """
+    Recompute the whole rollup from activity_logs and the archived partitions,
+    whose months only survive in the rollup otherwise. Returns the number of
+    buckets.
+    """
+    from partitions import archived_hourly_counts
+    own_session = db is None
+    db = db or SessionLocal()
+    try:
+        # Read the archives before taking the write lock
+        archived = list(archived_hourly_counts())
+
+        bucket = func.strftime(HOUR_BUCKET_FORMAT, event_time_sql(ActivityLog.timestamp))
+        aggregate = select(
+            ActivityLog.sensor_id,
+            bucket,
+            func.count(),
+            func.sum(case((ActivityLog.value == "active", 1), else_=0)),
+        ).where(
+            ActivityLog.sensor_id.isnot(None),
+            ActivityLog.timestamp.isnot(None),
+        ).group_by(ActivityLog.sensor_id, bucket)
+
+        # Before and after, so buckets that disappear are re-scored as well as new ones
+        _queue_all_buckets(db)
+        db.query(HourlyActivity).delete(synchronize_session=False)
+        db.execute(
+            insert(HourlyActivity).from_select(
+                ["sensor_id", "hour_bucket", "event_count", "active_count"], aggregate
+            )
+        )
+        for buckets in archived:
+            record_hourly_counts(db, buckets)
+        _queue_all_buckets(db)
+        db.commit()
+        return db.query(HourlyActivity).count()
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Error rebuilding hourly rollup: {e}")
+        raise
+    finally:
+        if own_session:
+            db.close()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    from database import init_db
+    init_db()
+    buckets = rebuild_hourly_activity()
+    logger.info(f"Rebuilt hourly_activity: {buckets} buckets")
@@ -0,0 +1,59 @@
+"""
+Sensor identity cache
+Resolves a source unique_id (e.g. "tapo-<device_id>") to sensors.id from memory,
+creating the sensor row the first time it is seen.
+"""
+import logging
+import threading
+from typing import Optional
+from sqlalchemy.dialects.sqlite import insert
+from database import SessionLocal, Sensor
+from response_cache import table_versions
+
+logger = logging.getLogger(__name__)
+
+class SensorRegistry:
+    def __init__(self):
+        self._ids = {}  # unique_id -> sensors.id
+        self._lock = threading.Lock()
+
+    def resolve(self, unique_id: str, name: Optional[str] = None, type: str = "PIR") -> int:
+        """Return the sensor id for unique_id, creating the sensor if needed"""
+        sensor_id = self._ids.get(unique_id)
+        if sensor_id is not None:
+            return sensor_id
+
+        # Misses are serialised so concurrent events for a new sensor create it once
+        with self._lock:
+            sensor_id = self._ids.get(unique_id)
+            if sensor_id is None:
+                sensor_id = self._load_or_create(unique_id, name, type)
+                self._ids[unique_id] = sensor_id
+            return sensor_id
+
+    def invalidate(self, sensor_id: Optional[int] = None):
+        """Forget one sensor (by sensors.id) or, with no argument, every sensor"""
+        with self._lock:
+            if sensor_id is None:
+                self._ids.clear()
+            else:
+                self._ids = {uid: sid for uid, sid in self._ids.items() if sid != sensor_id}
+
+    def _load_or_create(self, unique_id: str, name: Optional[str], type: str) -> int:
+        db = SessionLocal()
+        try:
+            # INSERT OR IGNORE keeps this safe against other processes sharing the DB
+            result = db.execute(
+                insert(Sensor)
+                .values(unique_id=unique_id, name=name or f"Sensor {unique_id}", type=type, is_hidden=False)
+                .on_conflict_do_nothing(index_elements=[Sensor.unique_id])
+            )
+            db.commit()
+            if result.rowcount:
+                table_versions.bump("sensors")
+                logger.info(f"Created new sensor: {name} ({unique_id})")
+            return db.query(Sensor.id).filter(Sensor.unique_id == unique_id).scalar()
+        finally:
+            db.close()
+
+sensor_registry = SensorRegistry()
@@ -0,0 +1,41 @@
+"""
+Fast JSON for bulk responses
+Bulk endpoints build plain dicts from row tuples and return a FastJSONResponse,
+which skips FastAPI's jsonable_encoder / response_model validation pass and
+encodes with orjson. The output matches FastAPI's (naive datetimes as ISO 8601
+without an offset), and the stdlib json module is used if orjson is missing.
+"""
+import json
+from datetime import date, datetime
+from typing import Iterable, Sequence
+from fastapi.responses import Response
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is in requirements.txt
+    orjson = None
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def dumps(payload) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(payload, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(payload, default=_default, separators=(",", ":")).encode()
+
+def loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def rows_to_dicts(fields: Sequence[str], rows: Iterable[tuple]):
+    """Row tuples (e.g. from a column select) as a list of dicts"""
+    return [dict(zip(fields, row)) for row in rows]
+
+class FastJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return dumps(content)
@@ -0,0 +1,121 @@
+"""
+Delta sync for the dashboard
+A cursor is "<change_log id>.<activity_logs id>". Given the cursor from its last
+call, a client receives only the activity rows added since, plus the sensors,
+adjustments and anomalies that changed (or were deleted), and a new cursor.
+Without a cursor, or when the delta can't be computed, it gets a full snapshot
+flagged full=true and should replace its state.
+"""
+import os
+from datetime import datetime, timedelta
+from typing import Optional
+from sqlalchemy import func, text
+from sqlalchemy.orm import Session
+from database import ActivityLog, Anomaly, ChangeLog, DataAdjustment, Sensor
+
+# Same window the dashboard used to load with /logs?limit=50000
+SYNC_MAX_LOGS = int(os.getenv("SYNC_MAX_LOGS", "50000"))
+# change_log entries older than this are pruned; older cursors get a full snapshot
+SYNC_CHANGE_LOG_HOURS = int(os.getenv("SYNC_CHANGE_LOG_HOURS", "168"))
+
+# Bulk rows are read as plain tuples rather than ORM objects
+LOG_COLUMNS = (ActivityLog.id, ActivityLog.sensor_id, ActivityLog.timestamp, ActivityLog.value)
+
+MODELS = {"sensors": Sensor, "data_adjustments": DataAdjustment, "anomalies": Anomaly}
+
+def sensor_row(s):
+    return {"id": s.id, "name": s.name, "unique_id": s.unique_id, "type": s.type, "is_hidden": s.is_hidden}
+
+def log_row(l):
+    return {"id": l.id, "sensor_id": l.sensor_id, "timestamp": l.timestamp, "value": l.value}
+
+def adjustment_row(a):
+    return {"id": a.id, "sensor_id": a.sensor_id, "timestamp": a.timestamp, "value": a.value, "comment": a.comment}
+
+def anomaly_row(a):
+    return {"id": a.id, "sensor_id": a.sensor_id, "timestamp": a.timestamp, "description": a.description, "score": a.score}
+
+SERIALIZERS = {"sensors": sensor_row, "data_adjustments": adjustment_row, "anomalies": anomaly_row}
+
+def sync(db: Session, cursor: Optional[str] = None):
+    """Changes since cursor, or a full snapshot"""
+    # Read the high-water marks first; everything below is bounded by them
+    change_id = db.query(func.max(ChangeLog.id)).scalar() or 0
+    log_id = db.query(func.max(ActivityLog.id)).scalar() or 0
+    new_cursor = f"{change_id}.{log_id}"
+
+    since = _parse_cursor(cursor) if cursor else None
+    if since is None or not _can_delta(db, *since, change_id, log_id):
+        return _snapshot(db, new_cursor)
+
+    since_change, since_log = since
+    changes = db.query(ChangeLog.table_name, ChangeLog.row_id, ChangeLog.op).filter(
+        ChangeLog.id > since_change, ChangeLog.id <= change_id
+    ).order_by(ChangeLog.id)
+    latest = {}
+    for table_name, row_id, op in changes:
+        latest[(table_name, row_id)] = op  # The last change to a row wins
+
+    response = {"cursor": new_cursor, "full": False, "deleted": {}}
+    for table_name, model in MODELS.items():
+        upserted = [row_id for (name, row_id), op in latest.items() if name == table_name and op == "upsert"]
+        deleted = {row_id for (name, row_id), op in latest.items() if name == table_name and op == "delete"}
+        rows = db.query(model).filter(model.id.in_(upserted)).all() if upserted else []
+        # Deleted after the high-water marks were read
+        deleted |= set(upserted) - {row.id for row in rows}
+        response[_response_key(table_name)] = [SERIALIZERS[table_name](row) for row in rows]
+        response["deleted"][_response_key(table_name)] = sorted(deleted)
+
+    logs = db.query(*LOG_COLUMNS).filter(ActivityLog.id > since_log, ActivityLog.id <= log_id) \
+        .order_by(ActivityLog.id.desc())
+    response["logs"] = [log_row(l) for l in logs]
+    return response
+
+def prune_change_log(db: Session, hours: int = SYNC_CHANGE_LOG_HOURS) -> int:
+    """Drop change_log entries older than hours. The caller commits."""
+    cutoff = datetime.utcnow() - timedelta(hours=hours)
+    return db.query(ChangeLog).filter(ChangeLog.changed_at < cutoff).delete(synchronize_session=False)
+
+def _parse_cursor(cursor: str):
+    try:
+        change_id, log_id = cursor.split(".")
+        return int(change_id), int(log_id)
+    except ValueError:
+        return None
+
+def _can_delta(db: Session, since_change: int, since_log: int, change_id: int, log_id: int) -> bool:
+    # A cursor from another database, e.g. after a restore
+    if since_change > change_id or since_log > log_id:
+        return False
+    # Entries after the cursor were pruned
+    oldest = db.query(func.min(ChangeLog.id)).scalar()
+    if oldest is not None and since_change < oldest - 1:
+        return False
+    if oldest is None and since_change < _change_log_sequence(db):
+        return False
+    # Deleting a sensor or purging events (see maintenance.py) removes logs the
+    # client holds, and SQLite may then reuse their ids
+    if db.query(ChangeLog.id).filter(
+        ChangeLog.id > since_change, ChangeLog.table_name.in_(("sensors", "activity_logs")), ChangeLog.op == "delete"
+    ).first():
+        return False
+    # Too far behind to be worth a delta
+    return log_id - since_log <= SYNC_MAX_LOGS
+
+def _change_log_sequence(db: Session) -> int:
+    return db.execute(text("SELECT seq FROM sqlite_sequence WHERE name = 'change_log'")).scalar() or 0
+
+def _snapshot(db: Session, cursor: str):
+    logs = db.query(*LOG_COLUMNS).order_by(ActivityLog.timestamp.desc()).limit(SYNC_MAX_LOGS)
+    return {
+        "cursor": cursor,
+        "full": True,
+        "sensors": [sensor_row(s) for s in db.query(Sensor)],
+        "logs": [log_row(l) for l in logs],
+        "adjustments": [adjustment_row(a) for a in db.query(DataAdjustment).order_by(DataAdjustment.timestamp.desc())],
+        "anomalies": [anomaly_row(a) for a in db.query(Anomaly).order_by(Anomaly.timestamp.desc())],
+        "deleted": {"sensors": [], "adjustments": [], "anomalies": []},
+    }
+
+def _response_key(table_name: str) -> str:
+    return "adjustments" if table_name == "data_adjustments" else table_name
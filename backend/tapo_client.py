@@ -4,9 +4,25 @@ Connects directly to Tapo H100 hub to get T100 sensor events
 """
 import asyncio
 import logging
+import os
+import time
 from datetime import datetime
+from sqlalchemy.dialects.sqlite import insert
 from tapo import ApiClient, T100Handler
-from database import SessionLocal, Sensor, ActivityLog
+from database import SessionLocal, ActivityLog, BackfillState
+from rollup import record_activity
+from ingest import ingest_queue, IngestEvent
+from sensor_registry import sensor_registry
+from broadcaster import broadcaster
+from response_cache import table_versions
+from poll_scheduler import PollScheduler, busy_hours, hub_rate_limiter
+
+# How often the usually-busy hours of the week are re-read from the rollup
+BUSY_HOURS_REFRESH_SECONDS = 3600
+
+# Hub requests allowed in flight during a historical backfill
+BACKFILL_CONCURRENCY = int(os.getenv("BACKFILL_CONCURRENCY", "4"))
+BACKFILL_PAGE_SIZE = int(os.getenv("BACKFILL_PAGE_SIZE", "50"))
 
 logger = logging.getLogger(__name__)
 
@@ -20,11 +36,16 @@ class TapoClient:
         self.hub = None
         self.last_states = {}  # Track last known state of each sensor
         self.last_error = None # Track last connection error
+        self.scheduler = PollScheduler()
+        self.rate_limiter = hub_rate_limiter(hub_ip)
+        self._wake = None
+        self._busy_hours_loaded = None
         
     async def start(self):
         """Start polling Tapo hub for sensor events"""
         self.running = True
         self.last_error = None
+        self._wake = asyncio.Event()
         logger.info(f"Starting Tapo client for hub at {self.hub_ip}")
         
         try:
@@ -32,24 +53,31 @@ class TapoClient:
             self.client = ApiClient(self.username, self.password)
             self.hub = await self.client.h100(self.hub_ip)
             
-            logger.info("Connected to Tapo H100 hub")
+            logger.info(f"Connected to Tapo H100 hub at {self.hub_ip}")
             
             # Fetch historical data on startup
             logger.info("Fetching historical data on startup...")
             await self.get_historical_logs()
             
-            # Main polling loop
+            # Main polling loop, at the cadence the scheduler picks from recent motion and errors
             while self.running:
+                started = time.perf_counter()
                 try:
-                    await self._poll_sensors()
+                    motion = await self._poll_sensors()
+                    self.scheduler.record_success((time.perf_counter() - started) * 1000, motion)
                     # Clear error if polling succeeds
                     if self.last_error:
                         self.last_error = None
                 except Exception as e:
-                    logger.error(f"Error polling Tapo sensors: {e}")
+                    self.scheduler.record_error((time.perf_counter() - started) * 1000)
+                    logger.error(f"Error polling Tapo sensors (retrying in ~{self.scheduler.interval:.0f}s): {e}")
                     self.last_error = str(e)
+                await self._refresh_busy_hours()
                 
-                await asyncio.sleep(2)  # Poll every 2 seconds for responsive detection
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=self.scheduler.next_delay())
+                except asyncio.TimeoutError:
+                    pass
                 
         except Exception as e:
             error_msg = str(e)
@@ -57,221 +85,320 @@ class TapoClient:
             logger.error("Please check your credentials in config.py")
             self.last_error = error_msg
     
+    def stats(self):
+        return {
+            "hub_ip": self.hub_ip,
+            "status": "running" if self.running else "stopped",
+            "connected": self.hub is not None,
+            "error": self.last_error,
+            "sensors": len(self.last_states),
+            "polling": {**self.scheduler.stats(), "rate_limit": self.rate_limiter.stats()},
+        }
+    
     def stop(self):
         self.running = False
+        if self._wake:
+            self._wake.set()  # Don't sit out the rest of an idle interval
     
-    async def _poll_sensors(self):
-        """Poll the hub for sensor states"""
+    async def _refresh_busy_hours(self):
+        if not self.last_states:
+            return
+        if self._busy_hours_loaded is not None and time.monotonic() - self._busy_hours_loaded < BUSY_HOURS_REFRESH_SECONDS:
+            return
+        self._busy_hours_loaded = time.monotonic()
         try:
-            # Get list of child devices (T100 sensors)
-            children = await self.hub.get_child_device_list()
+            # This hub's sensors, as seen by the polls so far
+            unique_ids = [f"tapo-{device_id}" for device_id in self.last_states]
+            self.scheduler.set_busy_hours(await asyncio.to_thread(busy_hours, unique_ids))
+        except Exception as e:
+            logger.error(f"Error loading busy hours for the poll scheduler: {e}")
+    
+    async def _poll_sensors(self):
+        """Poll the hub for sensor states. Returns whether any sensor reports motion."""
+        # Get list of child devices (T100 sensors)
+        await self.rate_limiter.acquire()
+        children = await self.hub.get_child_device_list()
+        
+        motion = False
+        for child in children:
+            device_id = child.device_id
             
-            for child in children:
-                device_id = child.device_id
+            # Check if this is a T100 motion sensor (all children from H100 should be T100s)
+            if hasattr(child, 'detected'):
+                # Get current state
+                is_detected = child.detected
+                motion = motion or bool(is_detected)
                 
-                # Check if this is a T100 motion sensor (all children from H100 should be T100s)
-                if hasattr(child, 'detected'):
-                    # Get current state
-                    is_detected = child.detected
+                # Check if state changed
+                if device_id not in self.last_states or self.last_states[device_id] != is_detected:
+                    self.last_states[device_id] = is_detected
                     
-                    # Check if state changed
-                    if device_id not in self.last_states or self.last_states[device_id] != is_detected:
-                        self.last_states[device_id] = is_detected
-                        
-                        # Log the event
-                        await self._log_activity(
-                            device_id=device_id,
-                            name=child.nickname,
-                            detected=is_detected
-                        )
-                        
-                        logger.info(f"Sensor '{child.nickname}': {'MOTION DETECTED' if is_detected else 'Clear'}")
-            
-        except Exception as e:
-            logger.error(f"Error in _poll_sensors: {e}")
-            import traceback
-            traceback.print_exc()
+                    # Log the event
+                    await self._log_activity(
+                        device_id=device_id,
+                        name=child.nickname,
+                        detected=is_detected
+                    )
+                    
+                    logger.info(f"Sensor '{child.nickname}': {'MOTION DETECTED' if is_detected else 'Clear'}")
+        return motion
     
-    async def get_historical_logs(self):
-        """Fetch historical logs from all sensors"""
+    async def get_historical_logs(self, full: bool = False):
+        """
+        Fetch historical logs from all sensors.
+
+        Each sensor's fetch stops at its persisted high-water mark, so only logs
+        newer than the previous backfill are read. Pass full=True to ignore the
+        marks and re-read everything the hub still holds.
+        """
         if not self.hub:
             logger.warning("Hub not connected")
             return {"message": "Hub not connected", "count": 0}
 
-        total_logs = 0
+        started = time.perf_counter()
+        stats = {"fetched": 0, "inserted": 0, "failed_pages": 0, "failed_sensors": 0}
         try:
+            await self.rate_limiter.acquire()
             children = await self.hub.get_child_device_list()
             
-            for child in children:
-                type_name = type(child).__name__
-                # logger.info(f"Child: {child.nickname} ({child.device_id}), Type: {type_name}")
-                
-                handler = None
-                if type_name == 'T100Result':
-                    handler = await self.hub.t100(child.device_id)
-                elif type_name == 'T110Result':
-                    handler = await self.hub.t110(child.device_id)
-                
-                if handler and hasattr(handler, 'get_trigger_logs'):
-                    logger.info(f"Fetching logs for {child.nickname}")
-                    
-                    # Fetch all pages
-                    start_id = 0
-                    page_size = 50
-                    
-                    try:
-                        while True:
-                            logs_response = await handler.get_trigger_logs(page_size=page_size, start_id=start_id)
-                            
-                            if not hasattr(logs_response, 'logs') or not logs_response.logs:
-                                break
-                                
-                            logs = logs_response.logs
-                            for log_item in logs:
-                                await self._process_historical_log(child, log_item)
-                                total_logs += 1
-                            
-                            # Check if we reached the end
-                            if len(logs) < page_size:
-                                break
-                                
-                            # Update start_id for next page
-                            if hasattr(logs[-1], 'id'):
-                                start_id = logs[-1].id
-                            else:
-                                logger.warning("Log item has no 'id', cannot paginate")
-                                break
-                                
-                    except Exception as e:
-                        logger.error(f"Error fetching logs for {child.nickname}: {e}")
-                else:
-                    logger.info(f"Skipping child {child.nickname} (No handler or get_trigger_logs)")
+            # Children are fetched concurrently, with at most BACKFILL_CONCURRENCY
+            # hub requests in flight. Pages flow through a bounded queue to a single
+            # writer so database work never holds up the fetchers. Each fetch handles
+            # its own errors, and all of them finish before the writer is told to stop.
+            semaphore = asyncio.Semaphore(BACKFILL_CONCURRENCY)
+            pages = asyncio.Queue(maxsize=BACKFILL_CONCURRENCY * 2)
+            writer = asyncio.create_task(self._write_historical_pages(pages, stats))
+            try:
+                await asyncio.gather(
+                    *(self._fetch_child_logs(child, semaphore, pages, stats, full) for child in children),
+                    return_exceptions=True
+                )
+            finally:
+                await pages.put(None)
+                await writer
                         
         except Exception as e:
             logger.error(f"Error in get_historical_logs: {e}")
             import traceback
             traceback.print_exc()
-            
-        return {"message": "Historical fetch completed", "count": total_logs}
+        
+        elapsed = round(time.perf_counter() - started, 3)
+        logger.info(f"Historical fetch: {stats['fetched']} fetched, {stats['inserted']} inserted in {elapsed}s")
+        return {
+            "message": "Historical fetch completed",
+            "count": stats["fetched"],
+            "fetched": stats["fetched"],
+            "inserted": stats["inserted"],
+            "failed_pages": stats["failed_pages"],
+            "failed_sensors": stats["failed_sensors"],
+            "elapsed_seconds": elapsed,
+            "full": full
+        }
 
-    async def _process_historical_log(self, child, log_item):
-        """Process a single historical log item"""
-        db = SessionLocal()
+    async def _fetch_child_logs(self, child, semaphore: asyncio.Semaphore, pages: asyncio.Queue, stats: dict, full: bool = False):
+        """
+        Page through one child's trigger logs, queueing each page for the writer.
+        Errors are logged and counted rather than raised, so one sensor can't end
+        the backfill for the others.
+        """
         try:
-            # Inspect log_item to find timestamp and value
-            # Assuming log_item has 'timestamp' (seconds since epoch or ISO string) and 'event'
+            type_name = type(child).__name__
             
-            # Debug log first time
-            # logger.info(f"Log item: {dir(log_item)}")
-            
-            timestamp = None
-            value = "active" # Default to active for trigger logs?
-            
-            if hasattr(log_item, 'timestamp'):
-                ts = log_item.timestamp
-                if isinstance(ts, int):
-                    timestamp = datetime.fromtimestamp(ts)
-                elif isinstance(ts, str):
-                    # Try parsing ISO
-                    try:
-                        timestamp = datetime.fromisoformat(ts.replace('Z', '+00:00'))
-                    except:
-                        pass
+            handler = None
+            async with semaphore:
+                await self.rate_limiter.acquire()
+                if type_name == 'T100Result':
+                    handler = await self.hub.t100(child.device_id)
+                elif type_name == 'T110Result':
+                    handler = await self.hub.t110(child.device_id)
             
-            if not timestamp:
-                # Fallback or skip
+            if not handler or not hasattr(handler, 'get_trigger_logs'):
+                logger.info(f"Skipping child {child.nickname} (No handler or get_trigger_logs)")
                 return
-
-            unique_id = f"tapo-{child.device_id}"
             
-            # Find sensor
-            sensor = db.query(Sensor).filter(Sensor.unique_id == unique_id).first()
-            if not sensor:
-                # Create if missing (though unlikely if we just listed it)
-                sensor = Sensor(unique_id=unique_id, name=child.nickname, type="PIR")
-                db.add(sensor)
-                db.commit()
-                db.refresh(sensor)
-
-            # Check if log already exists
-            exists = db.query(ActivityLog).filter(
-                ActivityLog.sensor_id == sensor.id,
-                ActivityLog.timestamp == timestamp
-            ).first()
+            logger.info(f"Fetching logs for {child.nickname}")
+            sensor_id = await asyncio.to_thread(sensor_registry.resolve, f"tapo-{child.device_id}", child.nickname)
+            last_id, last_timestamp = (None, None) if full else await asyncio.to_thread(_load_backfill_mark, sensor_id)
+            newest_id, newest_timestamp = last_id, last_timestamp
+            
+            # Fetch pages, newest first, until we reach logs a previous backfill already stored
+            start_id = 0
+            page_size = BACKFILL_PAGE_SIZE
             
-            if not exists:
-                log = ActivityLog(sensor_id=sensor.id, value=value, timestamp=timestamp)
-                db.add(log)
-                db.commit()
+            while True:
+                async with semaphore:
+                    await self.rate_limiter.acquire()
+                    logs_response = await handler.get_trigger_logs(page_size=page_size, start_id=start_id)
+                
+                if not hasattr(logs_response, 'logs') or not logs_response.logs:
+                    break
+                    
+                logs = logs_response.logs
+                stats["fetched"] += len(logs)
+                
+                events = []
+                reached_mark = False
+                for log_item in logs:
+                    log_id = getattr(log_item, 'id', None)
+                    ts = _parse_log_timestamp(log_item)
+                    if log_id is not None and last_id is not None:
+                        known = log_id <= last_id
+                    else:
+                        known = ts is not None and last_timestamp is not None and ts <= last_timestamp
+                    if known:
+                        reached_mark = True
+                        continue
+                    if log_id is not None and (newest_id is None or log_id > newest_id):
+                        newest_id = log_id
+                    if ts:
+                        events.append((ts, "active", None if log_id is None else str(log_id)))
+                        if newest_timestamp is None or ts > newest_timestamp:
+                            newest_timestamp = ts
+                
+                await pages.put((sensor_id, events, None))
                 
+                # Check if we reached the end, or logs we already have
+                if len(logs) < page_size or reached_mark:
+                    break
+                    
+                # Update start_id for next page
+                if hasattr(logs[-1], 'id'):
+                    start_id = logs[-1].id
+                else:
+                    logger.warning("Log item has no 'id', cannot paginate")
+                    break
+                    
+            # Queued behind this child's pages, so the mark only moves once they are written
+            if (newest_id, newest_timestamp) != (last_id, last_timestamp):
+                await pages.put((sensor_id, [], (newest_id, newest_timestamp)))
+                    
         except Exception as e:
-            logger.error(f"Error processing log item: {e}")
-        finally:
-            db.close()
+            # Leave the mark where it was so the next backfill retries the gap
+            stats["failed_sensors"] += 1
+            logger.error(f"Error fetching logs for {getattr(child, 'nickname', child)}: {e}")
 
-    async def _log_activity(self, device_id: str, name: str, detected: bool):
-        """Log sensor activity to database"""
-        db = SessionLocal()
-        try:
-            unique_id = f"tapo-{device_id}"
-            
-            # Find or create sensor
-            sensor = db.query(Sensor).filter(Sensor.unique_id == unique_id).first()
-            if not sensor:
-                sensor = Sensor(unique_id=unique_id, name=name, type="PIR")
-                db.add(sensor)
-                db.commit()
-                db.refresh(sensor)
-                logger.info(f"Created new sensor: {name} ({unique_id})")
-            
-            # Log activity
-            status = "active" if detected else "inactive"
-            log = ActivityLog(sensor_id=sensor.id, value=status, timestamp=datetime.utcnow())
-            db.add(log)
-            db.commit()
-            
-        except Exception as e:
-            logger.error(f"Error logging activity: {e}")
-        finally:
-            db.close()
+    async def _write_historical_pages(self, pages: asyncio.Queue, stats: dict):
+        """
+        Single writer for the backfill: one transaction per page, off the event loop.
+        A sensor's mark is not saved if any of its pages failed to write, so the
+        next backfill fetches those logs again.
+        """
+        failed = set()
+        while True:
+            page = await pages.get()
+            if page is None:
+                break
+            sensor_id, events, mark = page
+            if events:
+                inserted = await asyncio.to_thread(_write_historical_page, sensor_id, events)
+                if inserted is None:
+                    stats["failed_pages"] += 1
+                    failed.add(sensor_id)
+                else:
+                    stats["inserted"] += inserted
+            if mark:
+                if sensor_id in failed:
+                    logger.warning(f"Not moving the backfill mark for sensor {sensor_id}: some of its pages failed to write")
+                else:
+                    await asyncio.to_thread(_save_backfill_mark, sensor_id, *mark)
 
-tapo_client = None
+    async def _log_activity(self, device_id: str, name: str, detected: bool):
+        """Queue sensor activity for the ingest writer"""
+        status = "active" if detected else "inactive"
+        ingest_queue.submit(IngestEvent(
+            unique_id=f"tapo-{device_id}",
+            name=name,
+            value=status,
+            timestamp=datetime.utcnow()
+        ))
 
-def get_tapo_client():
-    global tapo_client
-    if tapo_client is None:
+def _parse_log_timestamp(log_item):
+    """Trigger log timestamp as a naive datetime, or None if it can't be read"""
+    ts = getattr(log_item, 'timestamp', None)
+    if isinstance(ts, int):
+        return datetime.fromtimestamp(ts)
+    if isinstance(ts, str):
+        # Try parsing ISO
         try:
-            # Try loading from DB first
-            db = SessionLocal()
-            from database import SystemConfig
-            configs = db.query(SystemConfig).all()
-            config_dict = {c.key: c.value for c in configs}
-            db.close()
-            
-            if "tapo_ip" in config_dict and "tapo_username" in config_dict and "tapo_password" in config_dict:
-                tapo_client = TapoClient(
-                    config_dict["tapo_ip"], 
-                    config_dict["tapo_username"], 
-                    config_dict["tapo_password"]
-                )
-            else:
-                # Fallback to config.py
-                try:
-                    from config import TAPO_USERNAME, TAPO_PASSWORD, TAPO_HUB_IP
-                    tapo_client = TapoClient(TAPO_HUB_IP, TAPO_USERNAME, TAPO_PASSWORD)
-                except ImportError:
-                    logger.warning("No configuration found in DB or config.py")
-                    return None
-                    
-        except Exception as e:
-            logger.error(f"Error initializing Tapo client: {e}")
+            return datetime.fromisoformat(ts.replace('Z', '+00:00')).replace(tzinfo=None)
+        except ValueError:
             return None
-            
-    return tapo_client
+    return None
+
+def _write_historical_page(sensor_id: int, events):
+    """
+    Insert a page of (timestamp, value, event_key) trigger-log events for one
+    sensor, skipping any already stored. Rows from before event keys existed
+    are skipped with one anti-join against the page's time range; keyed rows
+    are also protected by the unique (sensor_id, event_key) index through
+    INSERT OR IGNORE. Returns rows inserted, or None if the write failed.
+    """
+    if not events:
+        return 0
+
+    db = SessionLocal()
+    try:
+        timestamps = [ts for ts, _, _ in events]
+        existing = {
+            ts for (ts,) in db.query(ActivityLog.timestamp).filter(
+                ActivityLog.sensor_id == sensor_id,
+                ActivityLog.timestamp >= min(timestamps),
+                ActivityLog.timestamp <= max(timestamps)
+            )
+        }
+
+        rows = []
+        for ts, value, event_key in events:
+            if ts not in existing:
+                existing.add(ts)  # Also drops duplicates within the page
+                rows.append({"sensor_id": sensor_id, "timestamp": ts, "value": value, "event_key": event_key})
+
+        if not rows:
+            return 0
+
+        stmt = (
+            insert(ActivityLog)
+            .on_conflict_do_nothing(index_elements=[ActivityLog.sensor_id, ActivityLog.event_key])
+            .returning(ActivityLog.timestamp, ActivityLog.value)
+        )
+        inserted = db.execute(stmt, rows).all()
+        record_activity(db, [(sensor_id, ts, value) for ts, value in inserted])
+        db.commit()
+        table_versions.bump("activity_logs")
+        if inserted:
+            broadcaster.publish("changed")
+        return len(inserted)
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Error writing historical page: {e}")
+        return None
+    finally:
+        db.close()
+
+def _load_backfill_mark(sensor_id: int):
+    """(last_log_id, last_timestamp) already ingested for a sensor"""
+    db = SessionLocal()
+    try:
+        state = db.query(BackfillState).filter(BackfillState.sensor_id == sensor_id).first()
+        if not state:
+            return None, None
+        return state.last_log_id, state.last_timestamp
+    finally:
+        db.close()
 
-def reset_tapo_client():
-    global tapo_client
-    if tapo_client:
-        logger.info("Stopping existing Tapo client...")
-        tapo_client.stop()
-        tapo_client = None
+def _save_backfill_mark(sensor_id: int, last_log_id, last_timestamp):
+    db = SessionLocal()
+    try:
+        state = db.query(BackfillState).filter(BackfillState.sensor_id == sensor_id).first()
+        if not state:
+            state = BackfillState(sensor_id=sensor_id)
+            db.add(state)
+        state.last_log_id = last_log_id
+        state.last_timestamp = last_timestamp
+        state.updated_at = datetime.utcnow()
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Error saving backfill mark for sensor {sensor_id}: {e}")
+    finally:
+        db.close()
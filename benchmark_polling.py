@@ -0,0 +1,92 @@
+import sys
+import os
+import bisect
+import logging
+import statistics
+from datetime import datetime, timedelta
+
+# Add backend to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'backend'))
+
+import numpy as np
+import poll_scheduler
+from demo_data import PROFILES
+from poll_scheduler import PollScheduler, TAPO_POLL_BUSY_EVENTS
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SENSORS = 3
+DAYS = 7
+# How long a T100 keeps reporting "detected" after it triggers
+DETECTED_SECONDS = 10
+POLL_LATENCY_MS = 150
+
+START = datetime(2024, 1, 1)  # A Monday
+
+class SimulatedClock:
+    """Stands in for the time and datetime modules so the scheduler runs in simulated seconds"""
+    now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+    def utcnow(self):
+        return START + timedelta(seconds=self.now)
+
+def simulate_motion(profile: str, seed: int = 1):
+    """Motion onsets (seconds since the start) for a week of a demo_data profile"""
+    rng = np.random.default_rng(seed)
+    onsets = []
+    for hour in range(DAYS * 24):
+        when = START + timedelta(hours=hour)
+        rate = PROFILES[profile][when.weekday(), when.hour]
+        for _ in range(SENSORS):
+            onsets.extend(hour * 3600 + rng.uniform(0, 3600, rng.poisson(rate)))
+    return np.sort(np.array(onsets))
+
+def run(onsets, next_delay, record):
+    """Poll from t=0 to the end of the week. Returns (polls, onset-to-poll latencies, missed onsets)."""
+    clock = poll_scheduler.time.now = 0.0
+    polls = 0
+    seen = np.zeros(len(onsets), dtype=bool)
+    latencies = []
+    end = DAYS * 86400
+    while clock < end:
+        polls += 1
+        # Sensors still reporting "detected" at this poll
+        first = bisect.bisect_left(onsets, clock - DETECTED_SECONDS)
+        last = bisect.bisect_right(onsets, clock)
+        for i in range(first, last):
+            if not seen[i]:
+                seen[i] = True
+                latencies.append(clock - onsets[i])
+        record(last > first)
+        clock += next_delay()
+        poll_scheduler.time.now = clock
+    return polls, latencies, int((~seen).sum())
+
+def summarize(profile, name, polls, latencies, missed):
+    p95 = statistics.quantiles(latencies, n=20)[-1]
+    print(f"{profile:>7} | {name:>9} | {polls / DAYS:>9.0f} | {statistics.mean(latencies):>10.2f} | {p95:>9.2f} | {missed:>6}")
+
+def benchmark():
+    poll_scheduler.time = poll_scheduler.datetime = SimulatedClock()
+    scheduler = PollScheduler()
+    logger.info(f"Adaptive settings: min {scheduler.min_interval}s, max {scheduler.max_interval}s, hot for {scheduler.hot_seconds}s after motion")
+    logger.info(f"{SENSORS} sensors over {DAYS} days, each reporting detected for {DETECTED_SECONDS}s per trigger")
+
+    print(f"\n{'profile':>7} | {'cadence':>9} | {'polls/day':>9} | {'mean lag s':>10} | {'p95 lag s':>9} | {'missed':>6}")
+    print("-" * 66)
+    for profile in ("home", "office"):
+        onsets = simulate_motion(profile)
+        summarize(profile, "fixed 2s", *run(onsets, lambda: 2.0, lambda motion: None))
+        scheduler = PollScheduler()
+        # What busy_hours() would read back from a few weeks of this profile's rollup
+        rates = PROFILES[profile] * SENSORS
+        scheduler.set_busy_hours((day, hour) for day in range(7) for hour in range(24) if rates[day, hour] >= TAPO_POLL_BUSY_EVENTS)
+        summarize(profile, "adaptive", *run(onsets, scheduler.next_delay, lambda motion: scheduler.record_success(POLL_LATENCY_MS, motion)))
+
+if __name__ == "__main__":
+    benchmark()
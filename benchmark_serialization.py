@@ -0,0 +1,95 @@
+import sys
+import os
+import json
+import logging
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import List
+
+# Run against a throwaway database so this never touches matter_logger.db
+tmp_dir = tempfile.mkdtemp()
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp_dir, 'benchmark.db')}"
+
+# Add backend to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'backend'))
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+from sqlalchemy import insert
+from database import init_db, SessionLocal, Sensor, ActivityLog
+from pagination import logs_query
+from serialization import dumps, orjson, rows_to_dicts
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SIZES = [10_000, 50_000, 500_000]
+RUNS = 3
+
+def seed(rows: int):
+    db = SessionLocal()
+    sensor_ids = []
+    for i in range(4):
+        sensor = Sensor(unique_id=f"bench-{i}", name=f"Bench Sensor {i}", type="PIR")
+        db.add(sensor)
+        db.commit()
+        sensor_ids.append(sensor.id)
+
+    base = datetime.utcnow() - timedelta(days=365)
+    for start in range(0, rows, 50_000):
+        db.execute(insert(ActivityLog), [
+            {"sensor_id": sensor_ids[i % 4], "timestamp": base + timedelta(seconds=60 * i + i % 7), "value": "active"}
+            for i in range(start, min(start + 50_000, rows))
+        ])
+        db.commit()
+    db.close()
+
+def default_pipeline(limit: int) -> bytes:
+    """What the list endpoints used to do: ORM objects, response_model validation, jsonable_encoder, json"""
+    db = SessionLocal()
+    try:
+        logs = db.query(ActivityLog).order_by(ActivityLog.timestamp.desc()).limit(limit).all()
+        payload = [{"id": l.id, "sensor_id": l.sensor_id, "timestamp": l.timestamp, "value": l.value} for l in logs]
+        validated = TypeAdapter(List[dict]).validate_python(payload)
+        return json.dumps(jsonable_encoder(validated), ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode()
+    finally:
+        db.close()
+
+def fast_pipeline(limit: int) -> bytes:
+    """Column select as row tuples, plain dicts, FastJSONResponse's encoder"""
+    db = SessionLocal()
+    try:
+        result = db.execute(logs_query().limit(limit))
+        return dumps(rows_to_dicts(result.keys(), result.all()))
+    finally:
+        db.close()
+
+def timed(pipeline, limit: int):
+    samples = []
+    for _ in range(RUNS):
+        started = time.perf_counter()
+        body = pipeline(limit)
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples), body
+
+def benchmark():
+    logger.info(f"Seeding {max(SIZES)} activity logs...")
+    init_db()
+    seed(max(SIZES))
+    logger.info(f"Encoder: {'orjson' if orjson else 'json (orjson not installed)'}, median of {RUNS} runs")
+
+    print(f"\n{'rows':>9} | {'default (ms)':>12} | {'fast (ms)':>10} | {'speedup':>7} | {'body (KB)':>9}")
+    print("-" * 60)
+    for size in SIZES:
+        default_ms, default_body = timed(default_pipeline, size)
+        fast_ms, fast_body = timed(fast_pipeline, size)
+        if json.loads(default_body) != json.loads(fast_body):
+            logger.error(f"FAILURE: pipelines produced different JSON for {size} rows")
+            sys.exit(1)
+        print(f"{size:>9} | {default_ms:>12.1f} | {fast_ms:>10.1f} | {default_ms / fast_ms:>6.1f}x | {len(fast_body) / 1024:>9.0f}")
+
+if __name__ == "__main__":
+    benchmark()
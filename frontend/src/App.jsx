@@ -1,4 +1,4 @@
-import React, { useState, useEffect, useRef, useMemo } from 'react';
+import React, { useState, useEffect, useRef, useMemo, useCallback } from 'react';
 import axios from 'axios';
 
 import Heatmap from './components/Heatmap';
@@ -11,6 +11,7 @@ function App() {
     const [logs, setLogs] = useState([]);
 
     const [adjustments, setAdjustments] = useState([]);
+    const [dataVersion, setDataVersion] = useState(0); // Bumped whenever logs or adjustments change, so the heatmap refetches
     const [loading, setLoading] = useState(true);
     const [demoLoading, setDemoLoading] = useState(false);
     const [selectedSensors, setSelectedSensors] = useState(new Set());
@@ -35,11 +36,35 @@ function App() {
     const isInitialized = useRef(false);
     const previousLogCount = useRef(0);
     const previousWeeksToView = useRef(0);
+    const syncCursor = useRef(null);
+    const liveConnected = useRef(false);
+    const sensorsRef = useRef([]);
+    const logsRef = useRef([]);
+    const adjustmentsRef = useRef([]);
 
     useEffect(() => {
         fetchData();
-        const interval = setInterval(fetchData, 5000); // Refresh every 5 seconds
-        return () => clearInterval(interval);
+
+        // New events are pushed over SSE; polling only runs while the stream is down
+        const events = new EventSource('/api/events');
+        events.onopen = () => {
+            liveConnected.current = true;
+            if (syncCursor.current) fetchData(); // Catch up on anything missed while disconnected
+        };
+        events.onerror = () => {
+            liveConnected.current = false;
+        };
+        events.addEventListener('activity', (e) => applyLiveLogs(JSON.parse(e.data)));
+        events.addEventListener('changed', () => fetchData());
+        events.addEventListener('resync', () => fetchData());
+
+        const interval = setInterval(() => {
+            if (!liveConnected.current) fetchData();
+        }, 5000); // Refresh every 5 seconds
+        return () => {
+            clearInterval(interval);
+            events.close();
+        };
     }, []);
 
     // Position view at latest data when weeksToView changes
@@ -70,27 +95,73 @@ function App() {
         previousWeeksToView.current = weeksToView;
     }, [weeksToView, logs]);
 
+    // Merge /sync changes into a list of rows keyed by id
+    const mergeById = (current, updated, deletedIds) => {
+        const deleted = new Set(deletedIds);
+        const byId = new Map(current.filter(item => !deleted.has(item.id)).map(item => [item.id, item]));
+        updated.forEach(item => byId.set(item.id, item));
+        return Array.from(byId.values());
+    };
+
+    // Prepend pushed log rows (oldest first) without a round trip
+    const applyLiveLogs = (rows) => {
+        const knownSensors = new Set(sensorsRef.current.map(s => s.id));
+        if (rows.some(row => !knownSensors.has(row.sensor_id))) {
+            fetchData(); // A new sensor appeared; /sync brings it along with its events
+            return;
+        }
+        const newIds = new Set(rows.map(l => l.id));
+        const nextLogs = [...rows.slice().reverse(), ...logsRef.current.filter(l => !newIds.has(l.id))].slice(0, 50000);
+        logsRef.current = nextLogs;
+        setLogs(nextLogs);
+        setDataVersion(v => v + 1);
+    };
+
     const fetchData = async () => {
         try {
-            const [sensorsRes, logsRes, adjustmentsRes] = await Promise.all([
-                axios.get('/api/sensors'),
-                axios.get('/api/logs?limit=50000'),
-                axios.get('/api/adjustments')
-            ]);
-            setSensors(sensorsRes.data);
-            setLogs(logsRes.data);
-            setAdjustments(adjustmentsRes.data);
+            // Only changes since the last cursor; the first call (or a stale cursor) returns everything
+            const syncRes = await axios.get('/api/sync', {
+                params: syncCursor.current ? { since: syncCursor.current } : {}
+            });
+            const delta = syncRes.data;
+            syncCursor.current = delta.cursor;
+
+            let nextSensors = delta.sensors;
+            let nextLogs = delta.logs;
+            let nextAdjustments = delta.adjustments;
+            if (!delta.full) {
+                nextSensors = (delta.sensors.length || delta.deleted.sensors.length)
+                    ? mergeById(sensorsRef.current, delta.sensors, delta.deleted.sensors)
+                    : sensorsRef.current;
+                nextAdjustments = (delta.adjustments.length || delta.deleted.adjustments.length)
+                    ? mergeById(adjustmentsRef.current, delta.adjustments, delta.deleted.adjustments)
+                    : adjustmentsRef.current;
+                if (delta.logs.length) {
+                    const newIds = new Set(delta.logs.map(l => l.id));
+                    nextLogs = [...delta.logs, ...logsRef.current.filter(l => !newIds.has(l.id))].slice(0, 50000);
+                } else {
+                    nextLogs = logsRef.current;
+                }
+            }
+            const dataChanged = delta.full || nextLogs !== logsRef.current || nextAdjustments !== adjustmentsRef.current;
+            sensorsRef.current = nextSensors;
+            logsRef.current = nextLogs;
+            adjustmentsRef.current = nextAdjustments;
+            setSensors(nextSensors);
+            setLogs(nextLogs);
+            setAdjustments(nextAdjustments);
+            if (dataChanged) setDataVersion(v => v + 1);
 
             // ... existing auto-select logic ...
-            if (!isInitialized.current && sensorsRes.data.length > 0) {
-                setSelectedSensors(new Set(sensorsRes.data.filter(s => !s.is_hidden).map(s => s.id)));
+            if (!isInitialized.current && nextSensors.length > 0) {
+                setSelectedSensors(new Set(nextSensors.filter(s => !s.is_hidden).map(s => s.id)));
                 isInitialized.current = true;
             }
 
             // Prune selectedSensors of any IDs that are no longer in the sensors list
             // This prevents "ghost" selections from deleted sensors
             setSelectedSensors(prev => {
-                const currentSensorIds = new Set(sensorsRes.data.map(s => s.id));
+                const currentSensorIds = new Set(nextSensors.map(s => s.id));
                 const newSelection = new Set();
                 prev.forEach(id => {
                     if (currentSensorIds.has(id)) {
@@ -98,15 +169,15 @@ function App() {
                     }
                 });
                 // If selection became empty but we have sensors, select all (default behavior)
-                if (newSelection.size === 0 && sensorsRes.data.length > 0) {
-                    return new Set(sensorsRes.data.map(s => s.id));
+                if (newSelection.size === 0 && nextSensors.length > 0) {
+                    return new Set(nextSensors.map(s => s.id));
                 }
                 return newSelection;
             });
 
-            if (logsRes.data.length > previousLogCount.current) {
+            if (nextLogs.length > previousLogCount.current) {
                 // setWeeksToView(0); // Removed auto-reset to All-Time
-                previousLogCount.current = logsRes.data.length;
+                previousLogCount.current = nextLogs.length;
             }
         } catch (error) {
             console.error('Error fetching data:', error);
@@ -139,6 +210,7 @@ function App() {
             // alert(response.data.message); // Removed to improve UX
 
             // Reset local state immediately
+            syncCursor.current = null;
             setLogs([]);
             setSensors([]); // Clear sensors too as they are deleted
             setAdjustments([]); // Clear adjustments as they might be orphaned or irrelevant
@@ -311,6 +383,21 @@ function App() {
         return new Set(sensors.filter(s => s.is_hidden).map(s => s.id));
     }, [sensors]);
 
+    // Sensors whose buckets the heatmap requests
+    const heatmapSensorIds = useMemo(() => {
+        return Array.from(selectedSensors).filter(id => !hiddenSensorIds.has(id));
+    }, [selectedSensors, hiddenSensorIds]);
+
+    // Same exclusions as filteredLogs, applied to a (sensor, local day) heatmap bucket
+    const isDayExcluded = useCallback((sensorId, day) => {
+        if (excludeToday && day.getTime() === todayStart.getTime()) return true;
+        if (excludeFirstDay) {
+            const firstDate = sensorFirstDates.get(sensorId);
+            if (firstDate && day.getTime() === firstDate.getTime()) return true;
+        }
+        return false;
+    }, [excludeToday, excludeFirstDay, todayStart, sensorFirstDates]);
+
     // Filter logs by selected sensors and optionally by week/4-week range
     const filteredLogs = logs.filter(log => {
         if (!selectedSensors.has(log.sensor_id)) return false;
@@ -846,15 +933,16 @@ function App() {
                 <h2 className="text-xl font-semibold mb-4">Activity Heatmap</h2>
                 <p className="text-sm text-gray-500 mb-2">Click a cell to view details</p>
                 <Heatmap
-                    logs={filteredLogs}
+                    sensorIds={heatmapSensorIds}
                     weekRanges={weekRanges}
+                    refreshKey={dataVersion}
+                    isDayExcluded={isDayExcluded}
                     isAggregateMode={isAggregateMode}
                     isSumMode={isSumMode}
                     onCellClick={handleHeatmapClick}
                     onCellHover={setHoveredCell}
                     hoveredCell={hoveredCell}
                     highlightedCriteria={highlightedCriteria}
-                    adjustments={filteredAdjustments}
                 />
             </div>
 
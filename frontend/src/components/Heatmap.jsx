@@ -1,60 +1,67 @@
-import React from 'react';
+import React, { useState, useEffect } from 'react';
+import axios from 'axios';
 
-const Heatmap = ({ logs, weekRanges, isAggregateMode, isSumMode, onCellClick, onCellHover, hoveredCell, highlightedCriteria, adjustments }) => {
+// Naive UTC timestamp, the form the backend stores and compares against
+const toUtcParam = (ms) => new Date(ms).toISOString().slice(0, 19);
+
+// Quarter-hour buckets are only needed where local hours don't start on a UTC hour (e.g. UTC+5:30)
+const bucketMinutesFor = (...times) => times.some(ms => new Date(ms).getTimezoneOffset() % 60 !== 0) ? 15 : 60;
+
+const Heatmap = ({ sensorIds, weekRanges, refreshKey, isDayExcluded, isAggregateMode, isSumMode, onCellClick, onCellHover, hoveredCell, highlightedCriteria }) => {
     const days = ['Sun', 'Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat'];
     const hours = Array.from({ length: 24 }, (_, i) => i);
+    const [buckets, setBuckets] = useState([]);
+
+    const hasRanges = weekRanges && weekRanges.length > 0;
+    const rangeStart = hasRanges ? Math.min(...weekRanges.map(r => r.start.getTime())) : null;
+    const rangeEnd = hasRanges ? Math.max(...weekRanges.map(r => r.end.getTime())) : null;
+    const sensorKey = [...sensorIds].sort((a, b) => a - b).join(',');
+
+    // Counts are bucketed by the backend in UTC (adjustments included); each bucket
+    // is placed in its own local day and hour below, so DST changes are respected
+    useEffect(() => {
+        if (!hasRanges || sensorIds.length === 0) {
+            setBuckets([]);
+            return;
+        }
+        let cancelled = false;
+        axios.get('/api/heatmap', {
+            params: {
+                start: toUtcParam(rangeStart),
+                end: toUtcParam(rangeEnd),
+                sensor_ids: sensorIds,
+                bucket_minutes: bucketMinutesFor(rangeStart, rangeEnd, Date.now())
+            },
+            paramsSerializer: { indexes: null } // sensor_ids=1&sensor_ids=2
+        })
+            .then(res => {
+                if (!cancelled) setBuckets(res.data.buckets);
+            })
+            .catch(error => console.error('Error fetching heatmap:', error));
+        return () => {
+            cancelled = true;
+        };
+    }, [rangeStart, rangeEnd, sensorKey, refreshKey]);
 
     // Process data for a single week
-    const processWeekData = (weekLogs, weekStart, weekEnd) => {
+    const processWeekData = (weekStart, weekEnd) => {
         const grid = Array(24).fill().map(() => Array(7).fill(0));
         const adjustmentGrid = Array(24).fill().map(() => Array(7).fill(false));
 
-        if (!weekLogs) return { grid, adjustmentGrid };
-
-        weekLogs.forEach(log => {
-            if (log.value === 'active') {
-                const date = new Date(log.timestamp);
-                const hour = date.getHours();
-                const day = date.getDay();
-                grid[hour][day]++;
-            }
+        buckets.forEach(bucket => {
+            const slot = new Date(bucket.bucket + 'Z');
+            if (slot < weekStart || slot >= weekEnd) return;
+            const day = slot.getDay();
+            const hour = slot.getHours();
+            if (isDayExcluded && isDayExcluded(bucket.sensor_id, new Date(slot.getFullYear(), slot.getMonth(), slot.getDate()))) return;
+            grid[hour][day] += bucket.count;
+            if (bucket.adjusted) adjustmentGrid[hour][day] = true;
         });
 
-        // Apply adjustments to the grid
-        if (adjustments && adjustments.length > 0) {
-
-
-            // Create a map to store total adjustments per slot to avoid order-of-operation issues
-            const adjustmentMap = new Map(); // Key: "day-hour", Value: totalAdjustment
-
-            adjustments.forEach(adj => {
-                // Ensure timestamp is treated as UTC by appending 'Z' if not present
-                let timestamp = adj.timestamp;
-                if (!timestamp.endsWith('Z') && !timestamp.includes('+')) {
-                    timestamp = timestamp + 'Z';
-                }
-                const adjDate = new Date(timestamp);
-
-                // Check if this adjustment falls within this week's range
-                if (adjDate >= weekStart && adjDate < weekEnd) {
-                    // Use local time to match how logs are processed
-                    const hour = adjDate.getHours();
-                    const day = adjDate.getDay();
-                    const key = `${day}-${hour}`;
-
-                    const currentTotal = adjustmentMap.get(key) || 0;
-                    adjustmentMap.set(key, currentTotal + adj.value);
-                }
-            });
-
-            // Apply aggregated adjustments to the grid
-            adjustmentMap.forEach((totalAdj, key) => {
-                const [day, hour] = key.split('-').map(Number);
-                const oldValue = grid[hour][day];
-                grid[hour][day] = Math.max(0, grid[hour][day] + totalAdj);
-                adjustmentGrid[hour][day] = true;
-            });
-        }
+        // Negative adjustments never take a slot below zero
+        grid.forEach(row => row.forEach((count, day) => {
+            row[day] = Math.max(0, count);
+        }));
 
         return { grid, adjustmentGrid };
     };
@@ -144,11 +151,7 @@ const Heatmap = ({ logs, weekRanges, isAggregateMode, isSumMode, onCellClick, on
     if (isAggregateMode && weekRanges && weekRanges.length > 0) {
         // Process data for each week
         const processedWeeks = weekRanges.map(range => {
-            const weekLogs = logs.filter(log => {
-                const logDate = new Date(log.timestamp);
-                return logDate >= range.start && logDate < range.end;
-            });
-            return processWeekData(weekLogs, range.start, range.end);
+            return processWeekData(range.start, range.end);
         });
 
         // Calculate max count from total counts (sums) and collect unique sum values
@@ -262,11 +265,7 @@ const Heatmap = ({ logs, weekRanges, isAggregateMode, isSumMode, onCellClick, on
     if (weekRanges && weekRanges.length > 0) {
         // First pass: process all weeks and calculate max count
         const allProcessedWeeks = weekRanges.map(range => {
-            const weekLogs = logs.filter(log => {
-                const logDate = new Date(log.timestamp);
-                return logDate >= range.start && logDate < range.end;
-            });
-            return { range, ...processWeekData(weekLogs, range.start, range.end) };
+            return { range, ...processWeekData(range.start, range.end) };
         });
 
         // Calculate max count across all weeks and collect unique values
@@ -1,18 +1,17 @@
-import sqlite3
+import sys
 import os
 
-db_path = 'backend/matter_logger.db'
+# DATABASE_URL (default ./matter_logger.db) is relative to backend/, as for the backend itself
+backend_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend')
+os.chdir(backend_dir)
+sys.path.insert(0, backend_dir)
+from database import engine
+from maintenance import purge
 
-if not os.path.exists(db_path):
-    print(f"Database file not found at {db_path}")
+if not os.path.exists(engine.url.database):
+    print(f"Database file not found at {engine.url.database}")
     exit(1)
 
-conn = sqlite3.connect(db_path)
-cursor = conn.cursor()
-
 print("Purging ALL adjustments...")
-cursor.execute("DELETE FROM data_adjustments")
-print(f"Deleted {cursor.rowcount} rows.")
-
-conn.commit()
-conn.close()
+deleted = purge("data_adjustments")
+print(f"Deleted {deleted} rows.")
@@ -0,0 +1,130 @@
+import sys
+import os
+import asyncio
+import logging
+import tempfile
+import time
+
+# Run against a throwaway database so this never touches matter_logger.db
+tmp_dir = tempfile.mkdtemp()
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp_dir, 'matter.db')}"
+
+# Add backend to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'backend'))
+
+from aiohttp import web
+from database import init_db, SessionLocal, Sensor, ActivityLog
+from ingest import ingest_queue
+from matter_client import MatterListener
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+NOISE_FRAMES = 2000
+
+NODES = [
+    {"node_id": 7, "available": True, "attributes": {"0/40/5": "Hallway PIR", "1/1030/0": 0, "1/1030/1": 0}},
+    {"node_id": 8, "available": True, "attributes": {"0/40/3": "Smart Plug", "1/6/0": True}},
+]
+
+def attribute_updated(node_id, path, value):
+    return {"event": "attribute_updated", "data": [node_id, path, value]}
+
+class FakeMatterServer:
+    """Just enough of python-matter-server's websocket API: server info, start_listening, events"""
+
+    def __init__(self):
+        self.connections = 0
+        self.second_connection = asyncio.Event()
+
+    async def handle(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self.connections += 1
+        await ws.send_json({
+            "fabric_id": 1, "compressed_fabric_id": 1, "schema_version": 11,
+            "min_supported_schema_version": 9, "sdk_version": "fake", "wifi_credentials_set": False,
+            "thread_credentials_set": False, "bluetooth_enabled": False,
+        })
+        command = await ws.receive_json()
+        await ws.send_json({"message_id": command["message_id"], "result": NODES})
+
+        if self.connections == 1:
+            # Malformed occupancy frames must be skipped without dropping the connection
+            await ws.send_str('{"event": "attribute_updated", "data": [7, "1/1030/0", ')
+            await ws.send_json({"event": "attribute_updated", "data": {"node": 7, "path": "1/1030/0"}})
+
+            # Plenty of unrelated traffic around three occupancy changes, then drop the connection
+            for i in range(NOISE_FRAMES):
+                await ws.send_json(attribute_updated(8, "1/6/0", i % 2 == 0))
+                if i % 500 == 0:
+                    await ws.send_json(attribute_updated(7, "1/1030/0", 1 if i % 1000 == 0 else 0))
+            await ws.send_json(attribute_updated(7, "1/1030/1", 1))  # Occupancy cluster, other attribute
+            await ws.close()
+        else:
+            await ws.send_json(attribute_updated(7, "1/1030/0", 1))
+            self.second_connection.set()
+            async for _ in ws:  # Stay connected until the listener closes
+                pass
+        return ws
+
+async def verify():
+    logger.info("Starting Matter listener verification...")
+    init_db()
+    await ingest_queue.start()
+
+    server = FakeMatterServer()
+    app = web.Application()
+    app.router.add_get("/ws", server.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+
+    failures = []
+    listener = MatterListener(f"ws://127.0.0.1:{port}/ws", max_backoff=1)
+    await listener.start()
+    try:
+        await asyncio.wait_for(server.second_connection.wait(), timeout=10)
+        await asyncio.sleep(0.2)
+    except asyncio.TimeoutError:
+        failures.append("listener did not reconnect after the server dropped the connection")
+
+    started = time.perf_counter()
+    await listener.stop()
+    stop_ms = (time.perf_counter() - started) * 1000
+    await ingest_queue.stop()
+    await runner.cleanup()
+
+    stats = listener.stats()
+    logger.info(f"Listener stats: {stats}, stopped in {stop_ms:.0f}ms")
+    if stats["events_queued"] != 5:
+        failures.append(f"expected 5 occupancy events, queued {stats['events_queued']}")
+    if stats["reconnects"] < 1:
+        failures.append("no reconnect recorded")
+    if stats["frames_failed"] != 2:
+        failures.append(f"expected 2 malformed frames, counted {stats['frames_failed']}")
+    if stop_ms > 1000:
+        failures.append(f"stop() took {stop_ms:.0f}ms")
+
+    db = SessionLocal()
+    try:
+        sensors = {s.unique_id: s.name for s in db.query(Sensor)}
+        values = [value for (value,) in db.query(ActivityLog.value).order_by(ActivityLog.id)]
+    finally:
+        db.close()
+    if sensors != {"7-1": "Hallway PIR"}:
+        failures.append(f"unexpected sensors {sensors}")
+    if values != ["active", "inactive", "active", "inactive", "active"]:
+        failures.append(f"unexpected events {values}")
+
+    if failures:
+        for failure in failures:
+            logger.error(f"FAILURE: {failure}")
+        sys.exit(1)
+    logger.info("Matter listener verification PASSED!")
+
+if __name__ == "__main__":
+    asyncio.run(verify())
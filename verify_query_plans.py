@@ -0,0 +1,125 @@
+import sys
+import os
+import json
+import logging
+import tempfile
+from datetime import datetime, timedelta
+
+# Run against a throwaway database so this never touches matter_logger.db
+tmp_dir = tempfile.mkdtemp()
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp_dir, 'query_plans.db')}"
+
+# Add backend to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'backend'))
+
+from starlette.requests import Request
+from sqlalchemy import event
+from database import init_db, engine, SessionLocal, Sensor, ActivityLog, DataAdjustment
+from rollup import record_activity
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Tables small enough that a full scan is expected and harmless
+SCAN_ALLOWED = {"sensors", "system_config", "sensor_baselines", "backfill_state", "sqlite_sequence", "analyzer_state", "rollup_changes"}
+
+captured = []
+
+def capture(conn, cursor, statement, parameters, context, executemany):
+    if not executemany and statement.lstrip().upper().startswith(("SELECT", "DELETE", "UPDATE")):
+        captured.append((statement, parameters))
+
+def full_scans(statement, parameters):
+    """Tables the statement reads with a full scan instead of an index"""
+    raw = engine.raw_connection()
+    try:
+        plan = raw.cursor().execute(f"EXPLAIN QUERY PLAN {statement}", parameters).fetchall()
+    finally:
+        raw.close()
+
+    scans = []
+    for row in plan:
+        detail = row[-1]
+        if detail.startswith("SCAN ") and "USING" not in detail:
+            table = detail.split()[1]
+            if table not in SCAN_ALLOWED:
+                scans.append(detail)
+    return scans
+
+def request(path, query=""):
+    """A bare GET request for calling endpoint functions directly; query keeps response cache keys apart"""
+    return Request({"type": "http", "method": "GET", "path": path, "query_string": query.encode(), "headers": []})
+
+def seed():
+    db = SessionLocal()
+    sensor = Sensor(unique_id="demo-plan", name="Plan Sensor", type="PIR")
+    db.add(sensor)
+    db.commit()
+
+    base = datetime.utcnow() - timedelta(days=3)
+    events = [(sensor.id, base + timedelta(minutes=7 * i), "active") for i in range(500)]
+    for sensor_id, timestamp, value in events:
+        db.add(ActivityLog(sensor_id=sensor_id, timestamp=timestamp, value=value))
+    record_activity(db, events)
+    db.add(DataAdjustment(sensor_id=sensor.id, timestamp=base.replace(minute=0, second=0, microsecond=0), value=2, comment="plan"))
+    db.commit()
+    sensor_id = sensor.id
+    db.close()
+    return sensor_id, events
+
+def verify():
+    logger.info("Starting query plan verification...")
+    init_db()
+    sensor_id, events = seed()
+
+    import main
+    from analyzer import analyze_incremental
+    from poll_scheduler import busy_hours
+    from tapo_client import _write_historical_page
+
+    checks = {
+        "GET /logs": lambda db: main.read_logs(request("/logs"), 0, None, None, None, None, None, "json", db=db),
+        "GET /logs (cursor page)": lambda db: main.read_logs(request("/logs", "cursor"), 0, 100, f"{events[-50][1].isoformat()}_{10**9}", None, None, None, "json", db=db),
+        "GET /logs (sensor and time filter)": lambda db: main.read_logs(request("/logs", "sensor_ids"), 0, 100, None, [sensor_id], events[10][1], events[-10][1], "json", db=db),
+        "GET /anomalies": lambda db: main.read_anomalies(request("/anomalies"), db=db),
+        "GET /adjustments": lambda db: main.read_adjustments(request("/adjustments"), db=db),
+        "GET /heatmap": lambda db: main.read_heatmap(None, None, None, 60, db=db),
+        "GET /heatmap (sensor filter)": lambda db: main.read_heatmap(None, None, [sensor_id], 60, db=db),
+        "GET /heatmap (quarter-hour buckets)": lambda db: main.read_heatmap(None, None, None, 15, db=db),
+        "analyzer first run": lambda db: analyze_incremental(),
+        "analyzer changed buckets": lambda db: (_write_historical_page(sensor_id, [(events[0][1] - timedelta(minutes=1), "active", None)]), analyze_incremental()),
+        "poll scheduler busy hours": lambda db: busy_hours(["demo-plan"]),
+        "backfill dedup": lambda db: _write_historical_page(sensor_id, [(ts, value, None) for _, ts, value in events[:50]]),
+        "GET /sync (delta)": lambda db: main.sync_changes(json.loads(main.sync_changes(None, db=db).body)["cursor"], db=db),
+        "POST /maintenance/purge (sensor and time range)": lambda db: main.purge_rows("activity_logs", [sensor_id], False, None, events[10][1], events[20][1], False, 5, False, False),
+        "POST /demo/clear": lambda db: main.clear_demo_data(),
+    }
+
+    event.listen(engine, "before_cursor_execute", capture)
+    failures = 0
+    for name, run in checks.items():
+        captured.clear()
+        db = SessionLocal()
+        try:
+            run(db)
+        finally:
+            db.close()
+
+        scans = [(statement, scan) for statement, parameters in captured for scan in full_scans(statement, parameters)]
+        if scans:
+            failures += 1
+            logger.error(f"FAILURE: {name} performs a full table scan")
+            for statement, scan in scans:
+                logger.error(f"  {scan}: {' '.join(statement.split())}")
+        else:
+            logger.info(f"OK: {name} ({len(captured)} statements, all indexed)")
+    event.remove(engine, "before_cursor_execute", capture)
+
+    if failures:
+        logger.error(f"Query plan verification FAILED for {failures} endpoint(s)")
+        sys.exit(1)
+    logger.info("Query plan verification PASSED!")
+
+if __name__ == "__main__":
+    verify()